@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+
+"""Aggregate the per-run results CSVs into a columnar store.
+
+For each kind of result (e.g. totals), the store holds one NumPy file per
+column containing the rows of every per-run CSV
+(``results/result/placer/machine/netlist.csv``). Label columns (and any other
+non-numeric columns) are dictionary-encoded: the column file holds integer
+codes which index into a list of values stored alongside it.
+
+The store is updated incrementally: only per-run CSVs which are new or whose
+content has changed are parsed. Each parsed CSV is kept as a chunk of string
+columns from which the columns of the table are rebuilt when anything
+changes, which avoids re-parsing every CSV.
+
+The store layout is::
+
+    results/store/result/
+    |-- manifest.json
+    |-- chunks/
+    |   |-- chunk_name.npz
+    |   |-- ...
+    |-- column_name.npy
+    |-- column_name.dict.json  # For dictionary-encoded columns
+    |-- ...
+
+Tables can be loaded using ResultTable, e.g.::
+
+    >>> totals = ResultTable("totals")
+    >>> mask = totals.where(placer="hilbert", reinject_packets="True")
+    >>> totals["received"][mask]
+"""
+
+import argparse
+
+import csv
+
+import hashlib
+
+import json
+
+import os
+
+from collections import OrderedDict
+
+from glob import glob
+
+from os.path import abspath, basename, dirname, exists, getmtime, getsize, \
+    join, relpath
+
+import numpy as np
+
+from six import iteritems
+
+from cache import file_digest
+
+
+RESULTS_DIR = abspath(join(dirname(__file__), "..", "results"))
+
+# The default store directory
+STORE_DIR = join(RESULTS_DIR, "store")
+
+# Columns which are always dictionary-encoded (as are any non-numeric
+# columns)
+LABEL_COLUMNS = ["netlist", "machine", "placer", "placement_duration",
+                 "injection_rate", "reinject_packets"]
+
+# Representation of missing values in results CSVs
+NA = "NA"
+
+
+def _write_atomically(filename, write, mode="w"):
+    """Write a file via a temporary file, calling write(f) to write it."""
+    temp_file = "{}.tmp{}".format(filename, os.getpid())
+    with open(temp_file, mode) as f:
+        write(f)
+    os.rename(temp_file, filename)
+
+
+def read_csv_columns(filename):
+    """Read a CSV file into an OrderedDict of columns of strings."""
+    with open(filename, "r") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        rows = [row for row in reader if row]
+    columns = OrderedDict()
+    for i, name in enumerate(header):
+        columns[name] = np.array([row[i] if i < len(row) else NA
+                                  for row in rows], dtype=str)
+    return columns
+
+
+def _to_number(strings):
+    """Convert an array of strings to numbers, returning None if any value is
+    not a number. Missing values become NaN."""
+    missing = strings == NA
+    try:
+        values = np.where(missing, "nan", strings).astype(float)
+    except ValueError:
+        return None
+    if not missing.any() and np.all(values == np.round(values)):
+        try:
+            return strings.astype(np.int64)
+        except (ValueError, OverflowError):
+            pass
+    return values
+
+
+def _dictionary_value(string):
+    """Get the JSON value stored in a dictionary for a CSV string."""
+    if string == NA:
+        return None
+    for convert in (int, float):
+        try:
+            return convert(string)
+        except ValueError:
+            pass
+    return string
+
+
+class ResultTable(object):
+    """A table of results loaded from the store.
+
+    Columns are memory-mapped and loaded on first access. Indexing the table
+    by column name gives the (decoded) column values.
+    """
+
+    def __init__(self, result, store_dir=STORE_DIR):
+        self.directory = join(store_dir, result)
+        with open(join(self.directory, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+        self.columns = manifest["columns"]
+        self.encoded_columns = set(manifest["encoded_columns"])
+        self.num_rows = manifest["num_rows"]
+        self._dictionaries = {}
+
+    def __len__(self):
+        return self.num_rows
+
+    def codes(self, column):
+        """Get the raw values of a column (i.e. codes, for
+        dictionary-encoded columns)."""
+        return np.load(join(self.directory, "{}.npy".format(column)),
+                       mmap_mode="r")
+
+    def dictionary(self, column):
+        """Get the list of values of a dictionary-encoded column."""
+        if column not in self._dictionaries:
+            with open(join(self.directory,
+                           "{}.dict.json".format(column)), "r") as f:
+                self._dictionaries[column] = json.load(f)
+        return self._dictionaries[column]
+
+    def __getitem__(self, column):
+        if column in self.encoded_columns:
+            values = np.empty(len(self.dictionary(column)), dtype=object)
+            values[:] = self.dictionary(column)
+            return values[self.codes(column)]
+        else:
+            return self.codes(column)
+
+    def where(self, **labels):
+        """Get a boolean mask selecting the rows with the given values in
+        the given (dictionary-encoded) columns. Values may be given as
+        strings, as they appear in the CSVs."""
+        mask = np.ones(self.num_rows, dtype=bool)
+        for column, value in iteritems(labels):
+            dictionary = self.dictionary(column)
+            value = _dictionary_value(str(value))
+            code = dictionary.index(value) if value in dictionary else -1
+            mask &= self.codes(column) == code
+        return mask
+
+
+def _build_table(directory, chunks):
+    """Build the column files of a table from its chunks.
+
+    Parameters
+    ----------
+    chunks : [OrderedDict, ...]
+        The string columns of every chunk in the order they are to appear.
+
+    Returns
+    -------
+    (columns, encoded_columns, num_rows)
+    """
+    columns = []
+    for chunk in chunks:
+        columns.extend(c for c in chunk if c not in columns)
+    lengths = [len(next(iter(chunk.values()))) if chunk else 0
+               for chunk in chunks]
+    num_rows = sum(lengths)
+
+    encoded_columns = []
+    for column in columns:
+        strings = np.concatenate(
+            [chunk[column] if column in chunk else
+             np.full(length, NA, dtype="U{}".format(len(NA)))
+             for chunk, length in zip(chunks, lengths)] or
+            [np.zeros(0, dtype=str)]).astype(str)
+
+        values = None if column in LABEL_COLUMNS else _to_number(strings)
+        if values is None:
+            encoded_columns.append(column)
+            dictionary, values = np.unique(strings, return_inverse=True)
+            values = values.astype(np.int32)
+            _write_atomically(
+                join(directory, "{}.dict.json".format(column)),
+                lambda f: json.dump([_dictionary_value(s)
+                                     for s in dictionary.tolist()], f))
+
+        _write_atomically(join(directory, "{}.npy".format(column)),
+                          lambda f: np.save(f, values), "wb")
+
+    # Remove the files of columns which are no longer present (or no longer
+    # dictionary-encoded)
+    current = set("{}.npy".format(c) for c in columns)
+    current.update("{}.dict.json".format(c) for c in encoded_columns)
+    for filename in (glob(join(directory, "*.npy")) +
+                     glob(join(directory, "*.dict.json"))):
+        if basename(filename) not in current:
+            os.remove(filename)
+
+    return (columns, encoded_columns, num_rows)
+
+
+def update_store(result, results_dir=RESULTS_DIR, store_dir=STORE_DIR):
+    """Bring the store of a kind of result up-to-date with the per-run CSVs.
+
+    Returns
+    -------
+    (num_parsed, num_removed)
+        The number of per-run CSVs parsed (i.e. new or changed) and removed
+        since the store was last updated.
+    """
+    directory = join(store_dir, result)
+    chunks_dir = join(directory, "chunks")
+    manifest_file = join(directory, "manifest.json")
+    if not exists(chunks_dir):
+        os.makedirs(chunks_dir)
+
+    manifest = {"files": {}}
+    if exists(manifest_file):
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+    old_files = manifest["files"]
+
+    filenames = sorted(relpath(f, results_dir)
+                       for f in glob(join(results_dir, result,
+                                          "*", "*", "*.csv")))
+
+    files = {}
+    num_parsed = 0
+    for filename in filenames:
+        full_filename = join(results_dir, filename)
+        mtime = getmtime(full_filename)
+        size = getsize(full_filename)
+        entry = old_files.get(filename)
+        if (entry is not None and
+                entry["mtime"] == mtime and entry["size"] == size):
+            files[filename] = entry
+            continue
+
+        digest = file_digest(full_filename)
+        if entry is not None and entry["digest"] == digest:
+            files[filename] = dict(entry, mtime=mtime, size=size)
+            continue
+
+        # New or changed: parse into a chunk
+        chunk = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+        columns = read_csv_columns(full_filename)
+        _write_atomically(join(chunks_dir, "{}.npz".format(chunk)),
+                          lambda f: np.savez(f, **columns), "wb")
+        files[filename] = {"mtime": mtime, "size": size, "digest": digest,
+                           "chunk": chunk, "columns": list(columns)}
+        num_parsed += 1
+
+    removed = set(old_files) - set(files)
+    for filename in removed:
+        chunk_file = join(chunks_dir,
+                          "{}.npz".format(old_files[filename]["chunk"]))
+        if exists(chunk_file):
+            os.remove(chunk_file)
+
+    if num_parsed or removed or not exists(manifest_file):
+        chunks = []
+        for filename in filenames:
+            with np.load(join(chunks_dir, "{}.npz".format(
+                    files[filename]["chunk"]))) as data:
+                chunks.append(OrderedDict(
+                    (column, data[column])
+                    for column in files[filename]["columns"]))
+        columns, encoded_columns, num_rows = _build_table(directory, chunks)
+        manifest = {"columns": columns,
+                    "encoded_columns": encoded_columns,
+                    "num_rows": num_rows}
+
+    manifest["files"] = files
+    _write_atomically(manifest_file, lambda f: json.dump(manifest, f))
+
+    return (num_parsed, len(removed))
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(
+        description="Aggregate per-run results CSVs into a columnar store.")
+    parser.add_argument("results", metavar="RESULT", nargs="*",
+                        help="The kinds of results to aggregate (default: "
+                             "all those present).")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--store-dir",
+                        help="Directory of the store (default: store/ within "
+                             "the results directory).")
+    args = parser.parse_args()
+
+    store_dir = args.store_dir or join(args.results_dir, "store")
+    results = args.results or sorted(
+        name for name in os.listdir(args.results_dir)
+        if name != "store" and glob(join(args.results_dir, name,
+                                         "*", "*", "*.csv")))
+    for result in results:
+        num_parsed, num_removed = update_store(result, args.results_dir,
+                                               store_dir)
+        print("{}: {} new or changed, {} removed".format(
+            result, num_parsed, num_removed))
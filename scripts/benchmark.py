@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+"""Benchmark suite for the conversion and analysis stages of the pipeline.
+
+Synthetic netlists of each size and fan-out are generated (using the NumPy
+engine of generate_synthetic_benchmark.py) along with a synthetic machine
+large enough to hold them. Each stage of the pipeline is then timed in turn
+and its peak memory usage (as traced by tracemalloc) measured:
+
+* generate_nets: Generating the nets.
+* netlist_to_json: Writing the netlist as JSON.
+* json_to_netlist: Loading the JSON netlist.
+* json_to_binary: Converting the JSON netlist into a binary netlist.
+* load_binary: Loading the binary netlist.
+* generate_machine: Generating the machine description.
+* json_to_machine: Loading the machine description.
+* placements_to_json: Writing a (sequential) placement as JSON.
+* json_to_placements: Loading the placement.
+* measure_nets: Routing the netlist and writing the static analysis CSVs.
+
+The results are compared against stored baselines (BASELINES_FILE) and the
+benchmark fails if any stage has slowed down (or uses more memory) by more
+than a given fraction. Since timings depend on the host, baselines should be
+recorded (using --update-baselines) on the machine the benchmark is run on.
+"""
+
+import argparse
+
+import json
+
+import os
+
+import shutil
+
+import sys
+
+import tempfile
+
+import time
+
+from math import ceil, sqrt
+
+from os.path import abspath, dirname, exists, join
+
+import numpy as np
+
+from six.moves import StringIO
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+from rig.machine import Cores
+
+from netlist_to_json import JSONNetlistWriter, iter_json_netlist, \
+    load_netlist
+from binary_netlist import events_to_binary
+from machine_to_json import json_to_machine
+from generate_machine import generate_machine_json
+from generate_synthetic_benchmark import np_random_net_per_vertex
+from netlist_core import load_placements
+from static_analysis import measure_nets
+
+
+# The default file in which baselines are stored
+BASELINES_FILE = join(dirname(abspath(__file__)), "..", "benchmarks",
+                      "baselines.json")
+
+# The number of cores on each chip available to vertices (two are reserved)
+CORES_PER_CHIP = 16
+
+
+def _generate_nets(case):
+    rng = np.random.default_rng(0)
+    n = case["num_nets"]
+    case["csr"] = np_random_net_per_vertex(rng, n, 0, n, 1.0,
+                                           str(case["fan_out"]))
+
+
+def _netlist_to_json(case):
+    sources, sink_offsets, sinks, weights = case["csr"]
+    vertices = [str(i + 1) for i in range(case["num_nets"])]
+    with open(case["json_netlist"], "w") as f:
+        writer = JSONNetlistWriter(f, ((v, {Cores: 1}) for v in vertices),
+                                   renumber=False)
+        sinks = [vertices[s] for s in sinks.tolist()]
+        sink_offsets = sink_offsets.tolist()
+        for source, start, end, weight in zip(sources.tolist(),
+                                              sink_offsets,
+                                              sink_offsets[1:],
+                                              weights.tolist()):
+            writer.write_net(vertices[source], sinks[start:end], weight)
+        writer.close()
+
+
+def _json_to_netlist(case):
+    # Rig objects are built lazily so build them here to time their
+    # construction as part of loading the netlist.
+    case["netlist"] = load_netlist(case["json_netlist"])
+    case["netlist"].to_rig()
+
+
+def _json_to_binary(case):
+    with open(case["json_netlist"], "r") as f:
+        events_to_binary(iter_json_netlist(f), case["binary_netlist"])
+
+
+def _load_binary(case):
+    load_netlist(case["binary_netlist"]).to_rig()
+
+
+def _generate_machine(case):
+    num_chips = int(ceil(case["num_nets"] / float(CORES_PER_CHIP)))
+    side = int(ceil(sqrt(num_chips)))
+    case["json_machine"] = generate_machine_json(side, side, seed=0)
+
+
+def _json_to_machine(case):
+    with open(case["machine_file"], "w") as f:
+        json.dump(case["json_machine"], f)
+    with open(case["machine_file"], "r") as f:
+        hostname, case["machine"] = json_to_machine(json.load(f))
+
+
+def _placements_to_json(case):
+    machine = case["machine"]
+    chips = sorted(machine)
+    json_placements = {
+        "algorithm": "sequential",
+        "placement_duration": 0.0,
+        "placements": {v: chips[i // CORES_PER_CHIP]
+                       for i, v in enumerate(case["netlist"].vertex_ids)}}
+    with open(case["placements_file"], "w") as f:
+        json.dump(json_placements, f)
+
+
+def _json_to_placements(case):
+    case["placements"] = load_placements(case["placements_file"],
+                                         case["netlist"])
+
+
+def _measure_nets(case):
+    netlist = case["netlist"]
+    placements = case["placements"]
+    measure_nets("benchmark", netlist["vertices_resources"], netlist["nets"],
+                 placements["algorithm"], placements["placement_duration"],
+                 placements["placements"], "benchmark", case["machine"],
+                 StringIO(), StringIO(), StringIO(), StringIO())
+
+
+# The stages of the benchmark, in the order they must be run
+STAGES = [
+    ("generate_nets", _generate_nets),
+    ("netlist_to_json", _netlist_to_json),
+    ("json_to_netlist", _json_to_netlist),
+    ("json_to_binary", _json_to_binary),
+    ("load_binary", _load_binary),
+    ("generate_machine", _generate_machine),
+    ("json_to_machine", _json_to_machine),
+    ("placements_to_json", _placements_to_json),
+    ("json_to_placements", _json_to_placements),
+    ("measure_nets", _measure_nets),
+]
+
+
+def run_stage(stage, case, repeat=1, memory=True):
+    """Run a stage, returning its duration (the fastest of repeat runs) and
+    peak traced memory usage in bytes (or None when not measured)."""
+    durations = []
+    for _ in range(repeat):
+        before = time.time()
+        stage(case)
+        durations.append(time.time() - before)
+
+    peak = None
+    if memory and tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            stage(case)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return (min(durations), peak)
+
+
+def run_benchmarks(sizes, fan_outs, stages=None, repeat=1, memory=True):
+    """Run the benchmark stages for every netlist size and fan-out.
+
+    Parameters
+    ----------
+    stages : [name, ...] or None
+        The stages to report (default: all). Stages which others depend on
+        are always run.
+
+    Generates
+    ---------
+    (stage, num_nets, fan_out, duration, peak_memory)
+    """
+    names = [name for name, _ in STAGES]
+    if stages is None:
+        stages = names
+    num_stages = max(names.index(name) for name in stages) + 1
+
+    directory = tempfile.mkdtemp()
+    try:
+        for num_nets in sizes:
+            for fan_out in fan_outs:
+                case = {
+                    "num_nets": num_nets,
+                    "fan_out": fan_out,
+                    "json_netlist": join(directory, "netlist.json"),
+                    "binary_netlist": join(directory, "netlist.bin"),
+                    "machine_file": join(directory, "machine.json"),
+                    "placements_file": join(directory, "placements.json"),
+                }
+                for name, stage in STAGES[:num_stages]:
+                    if name in stages:
+                        duration, peak = run_stage(stage, case, repeat,
+                                                   memory)
+                        yield (name, num_nets, fan_out, duration, peak)
+                    else:
+                        # Run only to produce the inputs of later stages
+                        stage(case)
+    finally:
+        shutil.rmtree(directory)
+
+
+def baseline_key(stage, num_nets, fan_out):
+    return "{}/{}/{}".format(stage, num_nets, fan_out)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the conversion and analysis stages of the "
+                    "pipeline against stored baselines.")
+
+    parser.add_argument("--sizes", "-n", metavar="NUM_NETS", type=int,
+                        nargs="+", default=[1000, 10000, 100000],
+                        help="Netlist sizes to benchmark (default: "
+                             "%(default)s).")
+
+    parser.add_argument("--fan-outs", "-f", metavar="FAN_OUT", type=int,
+                        nargs="+", default=[1, 8],
+                        help="Net fan-outs to benchmark (default: "
+                             "%(default)s).")
+
+    parser.add_argument("--stages", "-s", metavar="STAGE", nargs="+",
+                        choices=[name for name, _ in STAGES],
+                        help="Stages to benchmark (default: all).")
+
+    parser.add_argument("--repeat", "-r", type=int, default=1,
+                        help="Time each stage this many times, taking the "
+                             "fastest (default: %(default)s).")
+
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Do not measure memory usage (which requires "
+                             "running each stage an extra time).")
+
+    parser.add_argument("--baselines", default=BASELINES_FILE,
+                        help="File containing the baselines (default: "
+                             "benchmarks/baselines.json).")
+
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="Fail if a stage takes more than this fraction "
+                             "longer than its baseline (default: "
+                             "%(default)s).")
+
+    parser.add_argument("--min-slowdown", type=float, default=0.05,
+                        help="Ignore slowdowns of less than this many "
+                             "seconds, which are within the noise for very "
+                             "fast stages (default: %(default)s).")
+
+    parser.add_argument("--memory-threshold", type=float, default=0.25,
+                        help="Fail if a stage uses more than this fraction "
+                             "more memory than its baseline (default: "
+                             "%(default)s).")
+
+    parser.add_argument("--update-baselines", action="store_true",
+                        help="Record the results as the new baselines rather "
+                             "than comparing against the old ones.")
+
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if exists(args.baselines):
+        with open(args.baselines, "r") as f:
+            baselines = json.load(f)
+
+    print("stage,num_nets,fan_out,duration,peak_memory,"
+          "baseline_duration,baseline_peak_memory,status")
+    failures = []
+    for stage, num_nets, fan_out, duration, peak in run_benchmarks(
+            sorted(args.sizes), args.fan_outs, args.stages, args.repeat,
+            not args.no_memory):
+        key = baseline_key(stage, num_nets, fan_out)
+        baseline = baselines.get(key)
+
+        if args.update_baselines:
+            baselines[key] = {"duration": duration, "peak_memory": peak}
+            status = "updated"
+        elif baseline is None:
+            status = "no_baseline"
+        else:
+            regressions = []
+            if (duration > baseline["duration"] * (1.0 + args.threshold) and
+                    duration - baseline["duration"] > args.min_slowdown):
+                regressions.append("slower")
+            if (peak is not None and baseline["peak_memory"] is not None and
+                    peak > (baseline["peak_memory"] *
+                            (1.0 + args.memory_threshold))):
+                regressions.append("more_memory")
+            status = "+".join(regressions) or "ok"
+            if regressions:
+                failures.append(key)
+
+        print("{},{},{},{},{},{},{},{}".format(
+            stage, num_nets, fan_out, duration,
+            "NA" if peak is None else peak,
+            "NA" if baseline is None else baseline["duration"],
+            "NA" if baseline is None or baseline["peak_memory"] is None
+            else baseline["peak_memory"],
+            status))
+        sys.stdout.flush()
+
+    if args.update_baselines:
+        directory = dirname(abspath(args.baselines))
+        if not exists(directory):
+            os.makedirs(directory)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+            f.write("\n")
+
+    if failures:
+        sys.stderr.write("FAIL: {} stage(s) regressed: {}\n".format(
+            len(failures), ", ".join(failures)))
+        return 1
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""Regression benchmark for the CSV generation in static_analysis.
+
+Synthetic routed netlists of increasing size are generated and the time taken
+to produce the per-net and per-chip CSVs measured. For smaller netlists the
+original (quadratic) implementation is also timed for comparison. The
+benchmark fails if the per-net cost at the largest size has grown by more than
+a given factor relative to the smallest size, i.e. if the implementation has
+stopped scaling linearly.
+"""
+
+import argparse
+
+import random
+
+import sys
+
+import time
+
+from collections import defaultdict
+
+from six import iteritems
+from six.moves import StringIO
+
+from rig.machine import Machine
+from rig.netlist import Net
+from rig.routing_table import Routes
+from rig.place_and_route.routing_tree import RoutingTree
+
+from static_analysis import write_route_stats
+
+
+def make_routed_netlist(num_nets, width=48, height=48, fan_out=4, seed=0):
+    """Generate a synthetic set of nets along with their routing trees.
+
+    Each net is routed along a random-length straight line of chips heading
+    east (wrapping around the machine) with all sinks at the end.
+    """
+    rng = random.Random(seed)
+    machine = Machine(width, height)
+
+    vertices = list(range(num_nets))
+    nets = []
+    routes = {}
+    for source in vertices:
+        net = Net(source, rng.sample(vertices, fan_out), rng.random())
+
+        x, y = rng.randrange(width), rng.randrange(height)
+        num_hops = rng.randrange(1, 16)
+        tree = node = RoutingTree((x, y))
+        for _ in range(num_hops):
+            x = (x + 1) % width
+            child = RoutingTree((x, y))
+            node.children.append((Routes.east, child))
+            node = child
+        for sink in net.sinks:
+            node.children.append((Routes.core_1, sink))
+
+        nets.append(net)
+        routes[net] = tree
+
+    routing_tables = defaultdict(list)
+    for net, tree in iteritems(routes):
+        for node in tree:
+            if isinstance(node, RoutingTree):
+                routing_tables[node.chip].append(net)
+
+    return nets, routes, routing_tables, machine
+
+
+def legacy_route_stats(std_cols, nets, routes, routing_tables, machine):
+    """The original string-building implementation of write_route_stats."""
+    std_header = "netlist,machine,placer,placement_duration"
+    std_cols = ",".join(map(str, std_cols))
+
+    per_net_csv = "{},net,fan_out,total_hops\n".format(std_header)
+    for net, routing_tree in iteritems(routes):
+        index = nets.index(net)
+        fan_out = len(net.sinks)
+        total_hops = len(list(routing_tree))
+        per_net_csv += "{},{},{},{}\n".format(std_cols,
+                                              index,
+                                              fan_out,
+                                              total_hops)
+
+    per_chip_csv = "{},x,y,routing_table_entries,num_nets,total_weight\n"\
+        .format(std_header)
+    chip_num_nets = defaultdict(lambda: 0)
+    chip_total_weight = defaultdict(lambda: 0.0)
+    for net, routing_tree in iteritems(routes):
+        for node in routing_tree:
+            if isinstance(node, RoutingTree):
+                chip_num_nets[node.chip] += 1
+                chip_total_weight[node.chip] += net.weight
+    for x, y in machine:
+        routing_table_entries = len(routing_tables[(x, y)])
+        per_chip_csv += "{},{},{},{},{},{}\n".format(std_cols,
+                                                     x, y,
+                                                     routing_table_entries,
+                                                     chip_num_nets[(x, y)],
+                                                     chip_total_weight[(x, y)])
+
+    return (per_net_csv, per_chip_csv)
+
+
+def time_route_stats(nets, routes, routing_tables, machine, legacy=False):
+    """Time the generation of the CSVs, returning the duration in seconds."""
+    std_cols = ["benchmark", "machine", "placer", 0.0]
+    before = time.time()
+    if legacy:
+        legacy_route_stats(std_cols, nets, routes, routing_tables, machine)
+    else:
+        write_route_stats(std_cols, nets, routes, routing_tables, machine,
+                          StringIO(), StringIO())
+    return time.time() - before
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the generation of static analysis CSVs.")
+
+    parser.add_argument("sizes", metavar="NUM_NETS", type=int, nargs="*",
+                        default=[1000, 10000, 100000],
+                        help="Netlist sizes to benchmark.")
+
+    parser.add_argument("--legacy-max", type=int, default=10000,
+                        help="Largest netlist for which the original "
+                             "implementation is also timed.")
+
+    parser.add_argument("--max-growth", type=float, default=3.0,
+                        help="Fail if the time-per-net at the largest size "
+                             "exceeds that at the smallest by this factor.")
+
+    args = parser.parse_args(argv)
+    sizes = sorted(args.sizes)
+
+    print("num_nets,duration,per_net_us,legacy_duration,speedup")
+    per_net = []
+    for num_nets in sizes:
+        netlist = make_routed_netlist(num_nets)
+        duration = time_route_stats(*netlist)
+        per_net.append(duration / num_nets)
+
+        if num_nets <= args.legacy_max:
+            legacy_duration = time_route_stats(*netlist, legacy=True)
+            speedup = legacy_duration / duration
+        else:
+            legacy_duration = speedup = "NA"
+
+        print("{},{},{},{},{}".format(num_nets, duration,
+                                      per_net[-1] * 1e6,
+                                      legacy_duration, speedup))
+
+    growth = per_net[-1] / per_net[0]
+    if growth > args.max_growth:
+        sys.stderr.write(
+            "FAIL: time-per-net grew by {:.1f}x from {} to {} nets\n".format(
+                growth, sizes[0], sizes[-1]))
+        return 1
+    return 0
+
+
+if __name__=="__main__":
+    sys.exit(main(sys.argv[1:]))
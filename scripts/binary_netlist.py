@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+
+"""Convert between JSON netlists and a compact, memory-mappable binary netlist
+format.
+
+The binary format consists of an 8-byte magic number, a little-endian 64-bit
+header length, a JSON header and then a series of 64-byte aligned arrays:
+
+* ``vertex_name_offsets`` (uint64, num_vertices + 1) and ``vertex_names``
+  (uint8): The UTF-8 encoded vertex IDs, concatenated. Vertex i's ID is
+  ``vertex_names[vertex_name_offsets[i]:vertex_name_offsets[i + 1]]``.
+* ``vertex_resources`` (uint32, num_vertices): An index into the resource table
+  in the header for each vertex. (NO_RESOURCES for vertices which appear in
+  nets but not in the vertices_resources of the JSON netlist.)
+* ``net_sources`` (uint32, num_nets): The source vertex index of each net.
+* ``net_sink_offsets`` (uint64, num_nets + 1) and ``net_sinks`` (uint32): The
+  sink vertex indices of every net, concatenated (i.e. in CSR form).
+* ``net_weights`` (float64, num_nets): The weight of each net.
+
+Since the arrays are memory-mapped when loaded, processes loading the same
+netlist share the same pages rather than each holding a private copy.
+"""
+
+import json
+
+import struct
+
+from array import array
+
+from collections import OrderedDict
+
+from itertools import chain
+
+import numpy as np
+
+from six import iteritems
+
+from netlist_to_json import STANDARD_RESOURCES, JSONNetlistWriter, \
+    iter_json_netlist
+from profiling import phase, start_timing
+
+
+# Magic number at the start of every binary netlist
+MAGIC = b"SPNNETL1"
+
+# The conventional file extension for binary netlists
+EXTENSION = ".bin"
+
+# Alignment (in bytes) of arrays within the file
+ALIGNMENT = 64
+
+# The resource index used for vertices without any defined resources
+NO_RESOURCES = 0xFFFFFFFF
+
+# The arrays in a binary netlist file and their types (all little-endian)
+ARRAYS = OrderedDict([
+    ("vertex_name_offsets", "<u8"),
+    ("vertex_names", "u1"),
+    ("vertex_resources", "<u4"),
+    ("net_sources", "<u4"),
+    ("net_sink_offsets", "<u8"),
+    ("net_sinks", "<u4"),
+    ("net_weights", "<f8"),
+])
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_binary_netlist(filename, vertex_ids, vertex_resources, resources,
+                         net_sources, net_sink_offsets, net_sinks,
+                         net_weights, extra=None):
+    """Write a binary netlist file from its component arrays.
+
+    Parameters
+    ----------
+    vertex_ids : [str, ...]
+    vertex_resources, net_sources, net_sink_offsets, net_sinks, net_weights
+        Array-likes, as described in the module documentation.
+    resources : [{resource_name: value, ...}, ...]
+        The resource table (with resource names as strings).
+    extra : {key: value, ...}
+        Any other (JSON-serialisable) top-level fields of the netlist.
+    """
+    encoded_ids = [v.encode("utf-8") for v in vertex_ids]
+    name_offsets = np.zeros(len(encoded_ids) + 1, dtype=np.uint64)
+    np.cumsum([len(v) for v in encoded_ids], out=name_offsets[1:])
+
+    arrays = {
+        "vertex_name_offsets": name_offsets,
+        "vertex_names": np.frombuffer(b"".join(encoded_ids), dtype=np.uint8),
+        "vertex_resources": vertex_resources,
+        "net_sources": net_sources,
+        "net_sink_offsets": net_sink_offsets,
+        "net_sinks": net_sinks,
+        "net_weights": net_weights,
+    }
+    arrays = OrderedDict((name, np.ascontiguousarray(arrays[name],
+                                                     dtype=dtype))
+                         for name, dtype in iteritems(ARRAYS))
+
+    # Lay out the arrays, relative to the end of the header
+    layout = OrderedDict()
+    offset = 0
+    for name, data in iteritems(arrays):
+        offset = _align(offset)
+        layout[name] = {"offset": offset, "length": len(data)}
+        offset += data.nbytes
+
+    header = {
+        "num_vertices": len(vertex_ids),
+        "num_nets": len(arrays["net_sources"]),
+        "resources": resources,
+        "extra": extra or {},
+        "arrays": layout,
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(filename, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", data_start))
+        f.write(header_bytes)
+        for name, data in iteritems(arrays):
+            f.seek(data_start + layout[name]["offset"])
+            f.write(data.tobytes())
+        f.truncate(data_start + offset)
+
+
+def json_to_binary(json_netlist, filename):
+    """Write a JSON-structured netlist as a binary netlist file."""
+    events_to_binary(
+        chain((("vertices_resources", vertex_resources)
+               for vertex_resources
+               in iteritems(json_netlist["vertices_resources"])),
+              (("nets", net) for net in json_netlist["nets"]),
+              ((key, value) for key, value in iteritems(json_netlist)
+               if key not in ("vertices_resources", "nets"))),
+        filename)
+
+
+def events_to_binary(events, filename):
+    """Write a binary netlist file from a series of netlist events as
+    produced by netlist_to_json.iter_json_netlist.
+
+    Only the (compact) arrays of the binary format are held in memory, so
+    arbitrarily large JSON netlists may be converted by streaming them through
+    iter_json_netlist.
+    """
+    vertex_indices = OrderedDict()
+    resource_indices = OrderedDict()
+    vertex_resources = array("L")
+
+    def vertex_index(vertex):
+        index = vertex_indices.get(vertex)
+        if index is None:
+            # Resources are unknown until the vertex appears in the
+            # vertices_resources
+            index = vertex_indices[vertex] = len(vertex_indices)
+            vertex_resources.append(NO_RESOURCES)
+        return index
+
+    net_sources = array("L")
+    net_sinks = array("L")
+    net_sink_counts = array("L")
+    net_weights = array("d")
+    extra = {}
+    for key, value in events:
+        if key == "vertices_resources":
+            vertex, resources = value
+            resource_key = tuple(iteritems(resources))
+            vertex_resources[vertex_index(vertex)] = \
+                resource_indices.setdefault(resource_key,
+                                            len(resource_indices))
+        elif key == "nets":
+            net_sources.append(vertex_index(value["source"]))
+            net_sinks.extend(vertex_index(sink) for sink in value["sinks"])
+            net_sink_counts.append(len(value["sinks"]))
+            net_weights.append(value["weight"])
+        else:
+            extra[key] = value
+
+    net_sink_offsets = np.zeros(len(net_sink_counts) + 1, dtype=np.uint64)
+    np.cumsum(np.asarray(net_sink_counts), out=net_sink_offsets[1:])
+
+    write_binary_netlist(filename,
+                         list(vertex_indices),
+                         np.asarray(vertex_resources),
+                         [dict(r) for r in resource_indices],
+                         np.asarray(net_sources), net_sink_offsets,
+                         np.asarray(net_sinks), np.asarray(net_weights),
+                         extra)
+
+
+class BinaryNetlist(object):
+    """A memory-mapped binary netlist.
+
+    The arrays described in the module documentation are available as
+    (read-only) attributes of the same name.
+
+    Attributes
+    ----------
+    num_vertices : int
+    num_nets : int
+    resources : [{resource: value, ...}, ...]
+        The resource table using Rig resource types where appropriate.
+    extra : {key: value, ...}
+        Any other top-level fields of the original JSON netlist.
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(
+                    "{} is not a binary netlist".format(filename))
+            data_start, = struct.unpack("<Q", f.read(8))
+            header = json.loads(
+                f.read(data_start - len(MAGIC) - 8).rstrip(b"\0")
+                .decode("utf-8"))
+
+        self.num_vertices = header["num_vertices"]
+        self.num_nets = header["num_nets"]
+        self.extra = header["extra"]
+        self.json_resources = header["resources"]
+        self.resources = [{STANDARD_RESOURCES.get(r, r): v
+                           for r, v in iteritems(rs)}
+                          for rs in self.json_resources]
+
+        self._mmap = np.memmap(filename, dtype=np.uint8, mode="r")
+        for name, dtype in iteritems(ARRAYS):
+            offset = data_start + header["arrays"][name]["offset"]
+            length = header["arrays"][name]["length"]
+            nbytes = length * np.dtype(dtype).itemsize
+            setattr(self, name,
+                    self._mmap[offset:offset + nbytes].view(dtype))
+
+        self._vertex_ids = None
+
+    @property
+    def vertex_ids(self):
+        """The list of (string) vertex IDs, decoded on first use."""
+        if self._vertex_ids is None:
+            names = self.vertex_names.tobytes()
+            offsets = self.vertex_name_offsets.tolist()
+            self._vertex_ids = [names[start:end].decode("utf-8")
+                                for start, end in zip(offsets, offsets[1:])]
+        return self._vertex_ids
+
+    def net_sinks_of(self, net):
+        """Get the array of sink vertex indices of the given net index."""
+        return self.net_sinks[self.net_sink_offsets[net]:
+                              self.net_sink_offsets[net + 1]]
+
+    def to_netlist(self):
+        """Convert into Rig/Python objects, as json_to_netlist."""
+        from netlist_core import Netlist
+        return Netlist.from_binary(self).to_rig()
+
+    def iter_vertices_resources(self):
+        """Generate (vertex_id, resources) pairs with JSON resource names."""
+        ids = self.vertex_ids
+        resources = self.json_resources
+        for v, r in enumerate(self.vertex_resources.tolist()):
+            if r != NO_RESOURCES:
+                yield (ids[v], resources[r])
+
+    def iter_nets(self):
+        """Generate (source, sinks, weight) tuples with vertex IDs."""
+        ids = self.vertex_ids
+        offsets = self.net_sink_offsets
+        sinks = self.net_sinks
+        for net, (source, weight) in enumerate(
+                zip(self.net_sources.tolist(), self.net_weights.tolist())):
+            yield (ids[source],
+                   [ids[s] for s in
+                    sinks[offsets[net]:offsets[net + 1]].tolist()],
+                   weight)
+
+    def write_json(self, f):
+        """Write the netlist as JSON to a file, one net at a time."""
+        writer = JSONNetlistWriter(f, self.iter_vertices_resources(),
+                                   renumber=False)
+        for source, sinks, weight in self.iter_nets():
+            writer.write_net(source, sinks, weight)
+        writer.close(**self.extra)
+
+    def to_json(self):
+        """Convert into a JSON-structured netlist."""
+        ids = self.vertex_ids
+        resources = self.json_resources
+
+        json_netlist = {
+            "vertices_resources": OrderedDict(
+                (ids[v], resources[r])
+                for v, r in enumerate(self.vertex_resources.tolist())
+                if r != NO_RESOURCES),
+            "nets": [],
+        }
+
+        offsets = self.net_sink_offsets.tolist()
+        sinks = [ids[s] for s in self.net_sinks.tolist()]
+        json_netlist["nets"] = [
+            {"source": ids[source],
+             "sinks": sinks[start:end],
+             "weight": weight}
+            for source, start, end, weight
+            in zip(self.net_sources.tolist(), offsets, offsets[1:],
+                   self.net_weights.tolist())]
+
+        json_netlist.update(self.extra)
+        return json_netlist
+
+
+if __name__=="__main__":
+    import sys
+    timer = start_timing()
+    if len(sys.argv) == 3:
+        with phase("json_to_binary"):
+            with open(sys.argv[1], "r") as f:
+                events_to_binary(iter_json_netlist(f), sys.argv[2])
+        timer.write_sidecars([sys.argv[2]])
+    elif len(sys.argv) == 2:
+        with phase("binary_to_json"):
+            BinaryNetlist(sys.argv[1]).write_json(sys.stdout)
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+        timer.write_sidecars([sys.stdout])
+    else:
+        print("Expected one argument: binary_netlist (converted to JSON).")
+        print("Or two arguments: json_netlist binary_netlist.")
+        sys.exit(1)
@@ -0,0 +1,111 @@
+"""A cache of parsed input files, keyed on the hash of their contents.
+
+Parsed objects are pickled into CACHE_DIR so that loading an unchanged file a
+second time (in any process) only requires hashing the file and unpickling
+the result. Within a process, results are also kept in memory.
+"""
+
+import hashlib
+
+import json
+
+import os
+
+import pickle
+
+from os.path import abspath, dirname, exists, getmtime, getsize, join
+
+from machine_to_json import json_to_machine
+from profiling import phase
+
+
+# The directory in which cached objects are stored
+CACHE_DIR = join(dirname(abspath(__file__)), "..", ".cache")
+
+# Cached objects already loaded by this process {(kind, digest): obj, ...}
+_loaded = {}
+
+# Digests already computed by this process {(filename, mtime, size): digest}
+_digests = {}
+
+
+def file_digest(filename):
+    """Get a hash of the contents of a file."""
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cached_file_digest(filename):
+    """Like file_digest but only re-hashes files whose size or modification
+    time have changed since they were last hashed by this process."""
+    key = (abspath(filename), getmtime(filename), getsize(filename))
+    digest = _digests.get(key)
+    if digest is None:
+        digest = _digests[key] = file_digest(filename)
+    return digest
+
+
+def cached_load(kind, filename, load, cache_dir=CACHE_DIR):
+    """Load a file via the cache.
+
+    Parameters
+    ----------
+    kind : str
+        The kind of object being loaded (cached objects of each kind are
+        stored in their own subdirectory).
+    filename : str
+    load : f(filename) -> obj
+        Function which loads the file when it is not in the cache. The object
+        returned must be picklable.
+    """
+    digest = cached_file_digest(filename)
+    obj = _loaded.get((kind, digest))
+    if obj is not None:
+        return obj
+
+    cache_file = join(cache_dir, kind, "{}.pickle".format(digest))
+    try:
+        with open(cache_file, "rb") as f:
+            obj = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        obj = load(filename)
+
+        # Written atomically since other processes may be reading the cache
+        if not exists(dirname(cache_file)):
+            try:
+                os.makedirs(dirname(cache_file))
+            except OSError:
+                # Created concurrently by another process
+                pass
+        temp_file = "{}.tmp{}".format(cache_file, os.getpid())
+        with open(temp_file, "wb") as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_file, cache_file)
+
+    _loaded[(kind, digest)] = obj
+    return obj
+
+
+def _load_machine_json(filename):
+    with open(filename, "r") as f:
+        with phase("parse_json"):
+            json_machine = json.load(f)
+    with phase("json_to_machine"):
+        return json_to_machine(json_machine)
+
+
+def load_machine(filename, cache_dir=CACHE_DIR):
+    """Load a machine JSON file, as json_to_machine, via the cache.
+
+    Returns
+    -------
+    (hostname, Machine)
+        The Machine is shared between all callers loading the same file and
+        so must not be modified.
+    """
+    with phase("load_machine"):
+        return cached_load("machines", filename, _load_machine_json,
+                           cache_dir)
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+
+"""Compare many placements of the same netlist without running them.
+
+Each placement is compared with a reference placement (the first given) in
+terms of:
+
+* The displacement of every vertex: the toroidal Manhattan distance between
+  the chips it is placed on in the two placements.
+* The change in the number of vertices placed on every chip.
+* The change in weighted wirelength (both the weighted half-perimeter
+  wirelength and the weighted toroidal distance, see placement_metrics.py).
+
+The placements are then clustered (using k-medoids, with the mean per-vertex
+displacement between two placements as their distance) so that a
+representative placement (the medoid) of each cluster can be picked, e.g. to
+spend hardware time on.
+
+Placements are loaded one at a time, with only the chip coordinates of each
+vertex being kept (as 16-bit integers), so hundreds of placements of large
+netlists can be compared at once.
+"""
+
+import argparse
+
+import csv
+
+import json
+
+import numpy as np
+
+from netlist_to_json import load_netlist
+from netlist_core import Placements
+from cache import load_machine
+from placement_metrics import net_pins, half_perimeters, toroidal_distances
+from profiling import phase, start_timing
+
+
+# The number of clusters produced by default
+NUM_CLUSTERS = 4
+
+# The (approximate) maximum number of elements in the temporary arrays used
+# when comparing placements
+BLOCK_SIZE = 1 << 22
+
+
+def load_locations(filenames, netlist):
+    """Load a series of placements of a netlist, one at a time.
+
+    Returns
+    -------
+    (locations, info)
+        locations is an int16 array of shape (num_placements, num_vertices,
+        2) giving the chip of each vertex in each placement ((-1, -1) for
+        unplaced vertices). info gives the algorithm and seed (or None) of
+        each placement.
+    """
+    locations = np.empty((len(filenames), netlist.num_vertices, 2),
+                         dtype=np.int16)
+    info = []
+    for i, filename in enumerate(filenames):
+        with open(filename, "r") as f:
+            placements = Placements.from_json(json.load(f), netlist)
+        locations[i] = placements.locations
+        info.append((placements.algorithm, placements.extra.get("seed")))
+    return (locations, info)
+
+
+def displacements(a, b, width, height):
+    """Get the toroidal Manhattan distance between corresponding chips of two
+    (..., 2) arrays of chip coordinates."""
+    d = np.abs(a - b)
+    return (np.minimum(d[..., 0], width - d[..., 0]) +
+            np.minimum(d[..., 1], height - d[..., 1]))
+
+
+def occupancy(locations, placed, width, height):
+    """Get a (width, height) array counting the vertices placed on each chip
+    by a (num_vertices, 2) array of locations."""
+    xy = locations[placed].astype(np.int64)
+    return np.bincount(xy[:, 0] * height + xy[:, 1],
+                       minlength=width * height).reshape((width, height))
+
+
+def _blocks(num_rows, row_size, block_size=BLOCK_SIZE):
+    """Split rows into (start, end) blocks of about block_size elements."""
+    block = max(1, block_size // max(1, row_size))
+    for start in range(0, num_rows, block):
+        yield (start, min(start + block, num_rows))
+
+
+def displacement_matrix(locations, reference, placed, width, height):
+    """Get the displacement of every placed vertex in every placement
+    relative to a reference placement.
+
+    Returns
+    -------
+    np.ndarray (int16, (num_placements, num_placed_vertices))
+    """
+    reference = reference[placed]
+    displacement = np.empty((len(locations), len(reference)), dtype=np.int16)
+    for start, end in _blocks(len(locations), len(reference)):
+        displacement[start:end] = displacements(
+            locations[start:end][:, placed], reference, width, height)
+    return displacement
+
+
+def distance_matrix(locations, placed, width, height):
+    """Get the mean displacement of the (placed) vertices between every pair
+    of placements.
+
+    Returns
+    -------
+    np.ndarray (num_placements, num_placements)
+    """
+    num_placements = len(locations)
+    num_placed = len(locations[0][placed])
+
+    distances = np.zeros((num_placements, num_placements))
+    if num_placed == 0:
+        return distances
+    for i in range(num_placements - 1):
+        reference = locations[i][placed]
+        for start, end in _blocks(num_placements - i - 1, num_placed):
+            rows = slice(i + 1 + start, i + 1 + end)
+            distances[i, rows] = displacements(
+                locations[rows][:, placed], reference,
+                width, height).mean(axis=1)
+    return distances + distances.T
+
+
+def k_medoids(distances, k, max_iterations=100):
+    """Cluster items given the distances between every pair.
+
+    Medoids are chosen greedily (as PAM's build step) and then refined by
+    alternately assigning items to their nearest medoid and choosing the
+    member of each cluster with the least total distance to its other
+    members.
+
+    Returns
+    -------
+    (medoids, labels)
+        The index of the medoid of each cluster and the cluster of each item.
+    """
+    k = min(k, len(distances))
+    if k == 0:
+        return ([], np.zeros(0, dtype=int))
+
+    medoids = [int(np.argmin(distances.sum(axis=1)))]
+    while len(medoids) < k:
+        nearest = distances[:, medoids].min(axis=1)
+        gains = np.maximum(nearest[:, None] - distances, 0.0).sum(axis=0)
+        gains[medoids] = -1.0
+        medoids.append(int(np.argmax(gains)))
+
+    for _ in range(max_iterations):
+        labels = np.argmin(distances[:, medoids], axis=1)
+        new_medoids = []
+        for cluster, medoid in enumerate(medoids):
+            members = np.flatnonzero(labels == cluster)
+            if len(members) == 0:
+                new_medoids.append(medoid)
+            else:
+                costs = distances[np.ix_(members, members)].sum(axis=1)
+                new_medoids.append(int(members[np.argmin(costs)]))
+        if new_medoids == medoids:
+            break
+        medoids = new_medoids
+
+    return (medoids, np.argmin(distances[:, medoids], axis=1))
+
+
+def compare_placements(netlist, machine, filenames, summary_file,
+                       occupancy_file=None, vertex_file=None,
+                       distance_file=None, num_clusters=NUM_CLUSTERS):
+    """Compare placements of a netlist with the first, writing the results
+    as CSV into the supplied file objects.
+
+    Parameters
+    ----------
+    netlist : netlist_core.Netlist
+    filenames : [placements_filename, ...]
+    summary_file : file
+        Receives one row per placement.
+    occupancy_file : file or None
+        Receives the number of vertices on (and the change since the
+        reference of) every chip whose occupancy is non-zero in either.
+    vertex_file : file or None
+        Receives the mean and maximum displacement of every vertex (and the
+        fraction of placements in which it moved) across all placements.
+    distance_file : file or None
+        Receives the distance between every pair of placements.
+
+    Returns
+    -------
+    [filename, ...]
+        The representative (medoid) placement of each cluster.
+    """
+    width, height = machine.width, machine.height
+
+    with phase("load_placements"):
+        locations, info = load_locations(filenames, netlist)
+
+    # Only vertices placed by every placement are compared. (Slicing, rather
+    # than masking, avoids copying the locations when every vertex is
+    # placed.)
+    placed_vertices = np.all(locations[:, :, 0] >= 0, axis=0)
+    placed = slice(None) if placed_vertices.all() else placed_vertices
+    reference = locations[0]
+
+    with phase("wirelength"):
+        pin_offsets, pin_vertices = net_pins(netlist)
+        weights = netlist.net_weights.astype(float)
+        hpwl = []
+        distances = []
+        for placement in locations:
+            pins = placement[pin_vertices].astype(np.int64)
+            hpwl.append(float(np.dot(
+                half_perimeters(pin_offsets, pins[:, 0], pins[:, 1]),
+                weights)))
+            distances.append(float(np.dot(
+                toroidal_distances(pin_offsets, pins[:, 0], pins[:, 1],
+                                   width, height),
+                weights)))
+
+    with phase("displacement"):
+        displacement = displacement_matrix(locations, reference, placed,
+                                           width, height)
+
+    with phase("occupancy"):
+        reference_occupancy = occupancy(reference, placed, width, height)
+        occupancy_changes = []
+        if occupancy_file is not None:
+            occupancy_csv = csv.writer(occupancy_file, lineterminator="\n")
+            occupancy_csv.writerow(["placement", "x", "y", "vertices",
+                                    "delta"])
+        for filename, placement in zip(filenames, locations):
+            chip_occupancy = occupancy(placement, placed, width, height)
+            delta = chip_occupancy - reference_occupancy
+            occupancy_changes.append(int(np.abs(delta).sum()) // 2)
+            if occupancy_file is not None:
+                for x, y in zip(*np.nonzero(chip_occupancy +
+                                            reference_occupancy)):
+                    occupancy_csv.writerow([filename, x, y,
+                                            chip_occupancy[x, y],
+                                            delta[x, y]])
+
+    with phase("cluster"):
+        pairwise = distance_matrix(locations, placed, width, height)
+        medoids, labels = k_medoids(pairwise, num_clusters)
+
+    summary_csv = csv.writer(summary_file, lineterminator="\n")
+    summary_csv.writerow(["placement", "algorithm", "seed",
+                          "weighted_hpwl", "weighted_hpwl_delta",
+                          "weighted_toroidal_distance",
+                          "weighted_toroidal_distance_delta",
+                          "mean_displacement", "max_displacement",
+                          "vertices_moved", "occupancy_changes",
+                          "cluster", "representative"])
+    for i, filename in enumerate(filenames):
+        algorithm, seed = info[i]
+        summary_csv.writerow([
+            filename, algorithm, "NA" if seed is None else seed,
+            hpwl[i], hpwl[i] - hpwl[0],
+            distances[i], distances[i] - distances[0],
+            float(displacement[i].mean()) if displacement.shape[1] else 0.0,
+            int(displacement[i].max()) if displacement.shape[1] else 0,
+            int(np.count_nonzero(displacement[i])),
+            occupancy_changes[i],
+            labels[i], i in medoids])
+
+    if vertex_file is not None:
+        vertex_csv = csv.writer(vertex_file, lineterminator="\n")
+        vertex_csv.writerow(["vertex", "mean_displacement",
+                             "max_displacement", "moved_fraction"])
+        for vertex, mean, maximum, moved in zip(
+                (v for v, p in zip(netlist.vertex_ids, placed_vertices)
+                 if p),
+                displacement.mean(axis=0).tolist(),
+                displacement.max(axis=0).tolist(),
+                np.count_nonzero(displacement, axis=0).tolist()):
+            vertex_csv.writerow([vertex, mean, maximum,
+                                 moved / float(len(filenames))])
+
+    if distance_file is not None:
+        distance_csv = csv.writer(distance_file, lineterminator="\n")
+        distance_csv.writerow(["placement_a", "placement_b",
+                               "mean_displacement"])
+        for i, a in enumerate(filenames):
+            for j, b in enumerate(filenames):
+                distance_csv.writerow([a, b, pairwise[i, j]])
+
+    return [filenames[m] for m in medoids]
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare placements of a netlist with the first and "
+                    "cluster them to pick representative placements.")
+    parser.add_argument("netlist", metavar="NETLIST")
+    parser.add_argument("machine", metavar="MACHINE")
+    parser.add_argument("summary", metavar="SUMMARY",
+                        help="CSV file to write the per-placement summary "
+                             "into.")
+    parser.add_argument("placements", metavar="PLACEMENTS", nargs="*",
+                        help="Placement files, the first being the "
+                             "reference.")
+    parser.add_argument("--placements-file", "-f",
+                        help="A file listing further placement files, one "
+                             "per line.")
+    parser.add_argument("--clusters", "-k", type=int, default=NUM_CLUSTERS,
+                        help="Number of clusters (default: %(default)s).")
+    parser.add_argument("--occupancy", metavar="FILENAME",
+                        help="Also write per-chip occupancy changes.")
+    parser.add_argument("--vertices", metavar="FILENAME",
+                        help="Also write per-vertex displacement.")
+    parser.add_argument("--distances", metavar="FILENAME",
+                        help="Also write the distance between every pair of "
+                             "placements.")
+    args = parser.parse_args()
+
+    filenames = list(args.placements)
+    if args.placements_file is not None:
+        with open(args.placements_file, "r") as f:
+            filenames.extend(f.read().split())
+    if not filenames:
+        parser.error("expected at least one placement file")
+
+    timer = start_timing()
+    netlist = load_netlist(args.netlist)
+    hostname, machine = load_machine(args.machine)
+
+    outputs = [args.summary, args.occupancy, args.vertices, args.distances]
+    files = [open(f, "w") if f is not None else None for f in outputs]
+    try:
+        representatives = compare_placements(netlist, machine, filenames,
+                                             *files,
+                                             num_clusters=args.clusters)
+    finally:
+        for f in files:
+            if f is not None:
+                f.close()
+    timer.write_sidecars([f for f in outputs if f is not None])
+
+    print("Representative placements:")
+    for filename in representatives:
+        print(filename)
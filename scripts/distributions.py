@@ -0,0 +1,215 @@
+"""Safe, precompiled random distribution expressions.
+
+Distributions are described by simple Python-style expressions made up of
+numbers, arithmetic operators and calls to the random-number functions of
+Python's :py:mod:`random` module, for example ``"randint(1, 5)"``,
+``"gauss(0, 2)"`` or ``"1 + expovariate(0.5) * 2"``. Expressions are parsed
+and checked just once, never evaluated with ``eval``.
+"""
+
+import ast
+
+import operator
+
+import random
+
+import numpy as np
+
+
+# The functions which may be used in distribution expressions. For each, a
+# function which draws a single sample using Python's random module and a
+# function f(rng, n, *args) which draws n samples using a NumPy Generator.
+FUNCTIONS = {
+    "random": (
+        random.random,
+        lambda rng, n: rng.random(n)),
+    "randint": (
+        random.randint,
+        lambda rng, n, a, b: rng.integers(a, np.add(b, 1), n)),
+    "uniform": (
+        random.uniform,
+        lambda rng, n, a, b: rng.uniform(a, b, n)),
+    "gauss": (
+        random.gauss,
+        lambda rng, n, mu, sigma: rng.normal(mu, sigma, n)),
+    "normalvariate": (
+        random.normalvariate,
+        lambda rng, n, mu, sigma: rng.normal(mu, sigma, n)),
+    "lognormvariate": (
+        random.lognormvariate,
+        lambda rng, n, mu, sigma: rng.lognormal(mu, sigma, n)),
+    "expovariate": (
+        random.expovariate,
+        lambda rng, n, lambd: rng.exponential(np.divide(1.0, lambd), n)),
+    "triangular": (
+        random.triangular,
+        lambda rng, n, low=0.0, high=1.0, mode=None: rng.triangular(
+            low, np.divide(np.add(low, high), 2.0) if mode is None else mode,
+            high, n)),
+    "betavariate": (
+        random.betavariate,
+        lambda rng, n, alpha, beta: rng.beta(alpha, beta, n)),
+    "gammavariate": (
+        random.gammavariate,
+        lambda rng, n, alpha, beta: rng.gamma(alpha, beta, n)),
+    "paretovariate": (
+        random.paretovariate,
+        lambda rng, n, alpha: rng.pareto(alpha, n) + 1.0),
+    "weibullvariate": (
+        random.weibullvariate,
+        lambda rng, n, alpha, beta: np.multiply(alpha, rng.weibull(beta, n))),
+    "choice": (
+        random.choice,
+        lambda rng, n, seq: rng.choice(seq, n)),
+}
+
+# Named constants which may be used in distribution expressions
+CONSTANTS = {
+    "pi": np.pi,
+    "e": np.e,
+}
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+class Distribution(object):
+    """A compiled distribution expression.
+
+    Calling the object draws a single sample using Python's :py:mod:`random`
+    module, drawing values in exactly the same order as evaluating the
+    expression with ``eval`` would. :py:meth:`.sample` draws many samples at
+    once using a NumPy Generator.
+    """
+
+    def __init__(self, description):
+        self.description = description
+        try:
+            tree = ast.parse(description.strip(), mode="eval")
+        except SyntaxError as e:
+            raise ValueError("Invalid distribution {!r}: {}".format(
+                description, e))
+        self._node = _compile(tree.body, description)
+
+    def __call__(self):
+        return self._node.scalar()
+
+    def sample(self, n, rng):
+        """Draw n samples as a NumPy array of floats."""
+        return np.broadcast_to(
+            np.asarray(self._node.batch(rng, n), dtype=float), (n, )).copy()
+
+    def __repr__(self):
+        return "<{} {!r}>".format(self.__class__.__name__, self.description)
+
+
+class _Constant(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+    def batch(self, rng, n):
+        return self.value
+
+
+class _Operator(object):
+
+    def __init__(self, op, operands):
+        self.op = op
+        self.operands = operands
+
+    def scalar(self):
+        return self.op(*[o.scalar() for o in self.operands])
+
+    def batch(self, rng, n):
+        return self.op(*[np.asarray(o.batch(rng, n))
+                         for o in self.operands])
+
+
+class _Call(object):
+
+    def __init__(self, name, args, kwargs):
+        self.scalar_function, self.batch_function = FUNCTIONS[name]
+        self.args = args
+        self.kwargs = kwargs
+
+    def scalar(self):
+        return self.scalar_function(
+            *[a.scalar() for a in self.args],
+            **{k: v.scalar() for k, v in self.kwargs.items()})
+
+    def batch(self, rng, n):
+        return self.batch_function(
+            rng, n,
+            *[a.batch(rng, n) for a in self.args],
+            **{k: v.batch(rng, n) for k, v in self.kwargs.items()})
+
+
+def _constant_value(node):
+    """Get the value of a numeric literal node or raise TypeError."""
+    if hasattr(ast, "Constant"):
+        if (isinstance(node, ast.Constant) and
+                isinstance(node.value, (int, float)) and
+                not isinstance(node.value, bool)):
+            return node.value
+    elif isinstance(node, ast.Num):
+        return node.n
+    raise TypeError()
+
+
+def _compile(node, description):
+    """Compile an expression AST node into a _Constant, _Operator or _Call
+    (folding constant sub-expressions)."""
+    try:
+        return _Constant(_constant_value(node))
+    except TypeError:
+        pass
+
+    if isinstance(node, ast.Name) and node.id in CONSTANTS:
+        return _Constant(CONSTANTS[node.id])
+    elif isinstance(node, (ast.List, ast.Tuple)):
+        # Only used as the argument to 'choice'
+        return _Constant([_compile(e, description).scalar()
+                          for e in node.elts])
+    elif (isinstance(node, ast.BinOp) and
+            type(node.op) in BINARY_OPERATORS):
+        compiled = _Operator(BINARY_OPERATORS[type(node.op)],
+                             [_compile(node.left, description),
+                              _compile(node.right, description)])
+    elif (isinstance(node, ast.UnaryOp) and
+            type(node.op) in UNARY_OPERATORS):
+        compiled = _Operator(UNARY_OPERATORS[type(node.op)],
+                             [_compile(node.operand, description)])
+    elif (isinstance(node, ast.Call) and
+            isinstance(node.func, ast.Name) and
+            node.func.id in FUNCTIONS and
+            not getattr(node, "starargs", None) and
+            not getattr(node, "kwargs", None)):
+        return _Call(node.func.id,
+                     [_compile(a, description) for a in node.args],
+                     {k.arg: _compile(k.value, description)
+                      for k in node.keywords})
+    else:
+        raise ValueError(
+            "Unsupported expression {!r} in distribution {!r}".format(
+                ast.dump(node), description))
+
+    # Fold operators whose operands are all constant
+    if all(isinstance(o, _Constant) for o in compiled.operands):
+        return _Constant(compiled.scalar())
+    return compiled
@@ -1,55 +1,93 @@
 #!/usr/bin/env python
 
-"""Run a single network experiment."""
+"""Run network experiments on a SpiNNaker machine.
+
+Results are either written once a sweep completes or, with --stream, appended
+to the output files as the sweep progresses with checkpoints from which an
+interrupted sweep can be resumed (see stream_experiment).
+"""
 
 import sys
 
+import json
+
+import os
+
+import argparse
+
 from math import ceil
 
-from collections import defaultdict
+from os.path import splitext, basename, dirname, exists, join
 
-from os.path import splitext, basename
+import numpy as np
 
 from network_tester import Experiment, to_csv
 
-from six import iteritems
+from rig.machine_control import MachineController
 
-import json
+from six import iteritems
 
-from netlist_to_json import json_to_netlist
-from place import json_to_placements
-from machine_to_json import json_to_machine
+from netlist_to_json import load_netlist
+from netlist_core import load_placements
+from cache import load_machine
+from profiling import phase, start_timing
 
 
 # The number of graduations in injection rate
 NUM_STEPS = 30
 MAX_PACKETS_PER_TIMESTEP = 60
 
-def run_experiment(netlist_name, vertices_resources, nets,
-                   placement_algorithm, placement_duration, placements,
-                   machine_name, machine, hostname):
-    import logging
-    logging.basicConfig(level=logging.DEBUG)
+# Adaptive sweeps start with COARSE_STEPS evenly spaced injection rates and
+# then make REFINE_PASSES further passes, each measuring REFINE_STEPS evenly
+# spaced rates between the highest unsaturated and lowest saturated rates
+# measured so far.
+COARSE_STEPS = 6
+REFINE_STEPS = 4
+REFINE_PASSES = 2
+
+# The directory into which batch results are written by default
+RESULTS_DIR = join(dirname(__file__), "..", "results")
+
+# The network is considered saturated when more than this fraction of the
+# packets offered are dropped or blocked
+SATURATION_THRESHOLD = 0.01
+
+# The number of groups run (and written out) at once by streaming sweeps
+STREAM_GROUPS = 5
+
+# The suffix appended to the totals filename to name a streaming sweep's
+# checkpoint file
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+
+def _new_experiment(hostname, netlist, placements, machine):
+    """Create a network tester Experiment for a placed netlist.
+    
+    Parameters
+    ----------
+    netlist : netlist_core.Netlist
+    placements : netlist_core.Placements
     
+    Returns
+    -------
+    (Experiment, [network tester net, ...])
+    """
     e = Experiment(hostname)
     assert machine.issubset(e.machine)
     e.machine = machine
     
-    vertices = defaultdict(e.new_vertex)
-    
-    # Make sure all vertices have a corresponding network tester vertex
-    for vertex in vertices_resources:
-        vertices[vertex]
+    # A network tester vertex for every vertex index
+    vertices = [e.new_vertex() for _ in range(netlist.num_vertices)]
     
     # Convert nets into network tester nets
     nets = [e.new_net(vertices[n.source],
                       [vertices[sink] for sink in n.sinks],
                       n.weight)
-            for n in nets]
+            for n in netlist.iter_nets()]
     
-    e.placements = {vertices[v]: xy for v, xy in iteritems(placements)}
-    
-    max_weight = max(n.weight for n in nets)
+    e.placements = {vertices[v]: (x, y)
+                    for v, (x, y) in enumerate(placements.locations.tolist())
+                    if x >= 0}
     
     e.timestep = 1e-3
     
@@ -70,67 +108,483 @@ def run_experiment(netlist_name, vertices_resources, nets,
     e.record_dropped_multicast = True
     e.record_reinjected = True
     
-    for reinject_packets in [False, True]:
-        for step in range(NUM_STEPS):
-            with e.new_group() as group:
-                e.reinject_packets = reinject_packets
-                
-                # Work out the current packets-per-timestep
-                ppts = (((step + 1) / float(NUM_STEPS)) *
-                        MAX_PACKETS_PER_TIMESTEP)
-                
-                # Send slightly more than this if requried, compensating for
-                # the extra packets by scaling the probability.
-                e.packets_per_timestep = int(ceil(ppts))
-                scale = ppts / ceil(ppts)
-                
-                # Scale the net probabilities such that the most highly
-                # weighted net is sending the specified number of packets per
-                # timestep.
-                probability = scale / float(max_weight)
-                for net in nets:
-                    net.probability = probability * net.weight
-                
-                group.add_label("netlist", netlist_name)
-                group.add_label("reinject_packets", e.reinject_packets)
-                group.add_label("machine", machine_name)
-                group.add_label("placer", placement_algorithm)
-                group.add_label("placement_duration", placement_duration)
-                group.add_label("injection_rate", ppts / e.timestep)
-                group.add_label("duration", e.duration)
-    
-    results = e.run(ignore_deadline_errors=True)
-    return (to_csv(results.totals()) + "\n",
-            to_csv(results.router_counters()) + "\n")
+    return (e, nets)
+
+
+def _run_groups(hostname, netlist, placements, machine, labels, points,
+                first_group=0):
+    """Run an experiment with one group per injection rate.
+    
+    Parameters
+    ----------
+    labels : (netlist_name, machine_name, placement_algorithm,
+              placement_duration)
+    points : [(reinject_packets, packets_per_timestep), ...]
+        The reinjection setting and (fractional) number of packets per
+        timestep sent by the most highly weighted net in each group.
+    first_group : int
+        The name of the first group (subsequent groups are numbered
+        sequentially).
+    
+    Returns
+    -------
+    network_tester.Results
+    """
+    netlist_name, machine_name, placement_algorithm, placement_duration = \
+        labels
+    
+    with phase("create_experiment"):
+        e, nets = _new_experiment(hostname, netlist, placements, machine)
+    max_weight = max(n.weight for n in nets)
+    
+    for group_num, (reinject_packets, ppts) in enumerate(points,
+                                                         first_group):
+        with e.new_group(group_num) as group:
+            e.reinject_packets = reinject_packets
+            
+            # Send slightly more than this if requried, compensating for
+            # the extra packets by scaling the probability.
+            e.packets_per_timestep = int(ceil(ppts))
+            scale = ppts / ceil(ppts)
+            
+            # Scale the net probabilities such that the most highly
+            # weighted net is sending the specified number of packets per
+            # timestep.
+            probability = scale / float(max_weight)
+            for net in nets:
+                net.probability = probability * net.weight
+            
+            group.add_label("netlist", netlist_name)
+            group.add_label("reinject_packets", e.reinject_packets)
+            group.add_label("machine", machine_name)
+            group.add_label("placer", placement_algorithm)
+            group.add_label("placement_duration", placement_duration)
+            group.add_label("injection_rate", ppts / e.timestep)
+            group.add_label("duration", e.duration)
+    
+    with phase("run"):
+        return e.run(ignore_deadline_errors=True)
+
+
+def saturation(totals):
+    """Get the fraction of offered packets which were dropped or blocked in
+    each row (i.e. group) of a totals table."""
+    dropped = (totals["dropped_multicast"].astype(float) +
+               totals["blocked"].astype(float))
+    offered = totals["sent"].astype(float) + totals["blocked"]
+    return dropped / np.maximum(offered, 1.0)
+
+
+def adaptive_sweep(measure, max_ppts=MAX_PACKETS_PER_TIMESTEP,
+                   coarse_steps=COARSE_STEPS, refine_steps=REFINE_STEPS,
+                   refine_passes=REFINE_PASSES,
+                   threshold=SATURATION_THRESHOLD):
+    """Find the saturation point of a network, with and without packet
+    reinjection, by a coarse sweep followed by refinement around the knee.
+    
+    Parameters
+    ----------
+    measure : f([(reinject_packets, ppts), ...]) -> [saturation, ...]
+        Called once per pass to measure the fraction of packets dropped or
+        blocked at each of the given points.
+    
+    Returns
+    -------
+    {reinject_packets: (highest_unsaturated_ppts, lowest_saturated_ppts)}
+        The final bracket around each knee. The lowest saturated rate is None
+        if the network never saturated.
+    """
+    brackets = {reinject_packets: (0.0, None)
+                for reinject_packets in [False, True]}
+    
+    points = [(reinject_packets, (step + 1) * max_ppts / float(coarse_steps))
+              for reinject_packets in [False, True]
+              for step in range(coarse_steps)]
+    
+    for _ in range(refine_passes + 1):
+        if not points:
+            break
+        
+        measured = {}
+        for point, value in zip(points, measure(points)):
+            measured.setdefault(point[0], []).append((point[1], value))
+        
+        # Narrow each bracket to the saturated rate nearest the knee
+        for reinject_packets, results in iteritems(measured):
+            low, high = brackets[reinject_packets]
+            for ppts, value in results:
+                if value > threshold and (high is None or ppts < high):
+                    high = ppts
+            for ppts, value in results:
+                if (value <= threshold and ppts > low and
+                        (high is None or ppts < high)):
+                    low = ppts
+            brackets[reinject_packets] = (low, high)
+        
+        # Refine within every bracket which contains a knee
+        points = [(reinject_packets,
+                   low + (high - low) * (step + 1) / float(refine_steps + 1))
+                  for reinject_packets, (low, high) in sorted(
+                      iteritems(brackets))
+                  if high is not None
+                  for step in range(refine_steps)]
+    
+    return brackets
+
+
+def sweep_points(num_steps=NUM_STEPS, max_ppts=MAX_PACKETS_PER_TIMESTEP):
+    """Get the evenly spaced (reinject_packets, packets_per_timestep) points
+    of a non-adaptive sweep."""
+    return [(reinject_packets, ((step + 1) / float(num_steps)) * max_ppts)
+            for reinject_packets in [False, True]
+            for step in range(num_steps)]
+
+
+def run_experiment(netlist_name, netlist, placements, machine_name, machine,
+                   hostname, adaptive=False):
+    """Run an injection-rate sweep on a placed netlist.
+    
+    The netlist and placements are a netlist_core.Netlist and
+    netlist_core.Placements respectively.
+    
+    The hostname may also be a MachineController, allowing a connection to
+    be shared between experiments (see run_batch).
+    
+    If adaptive is False, NUM_STEPS evenly spaced injection rates are
+    measured. Otherwise the saturation point is located by adaptive_sweep
+    with one experiment run per pass.
+    
+    Returns
+    -------
+    (totals, router_counters)
+        CSV strings.
+    """
+    import logging
+    logging.basicConfig(level=logging.DEBUG)
+    
+    labels = (netlist_name, machine_name, placements.algorithm,
+              placements.placement_duration)
+    
+    if not adaptive:
+        results = _run_groups(hostname, netlist, placements, machine,
+                              labels, sweep_points())
+        with phase("to_csv"):
+            return (to_csv(results.totals()) + "\n",
+                    to_csv(results.router_counters()) + "\n")
+    
+    totals = []
+    router_counters = []
+    
+    def measure(points):
+        num_groups = sum(len(t) for t in totals)
+        results = _run_groups(hostname, netlist, placements, machine,
+                              labels, points, num_groups)
+        totals.append(results.totals())
+        router_counters.append(results.router_counters())
+        return saturation(totals[-1])
+    
+    adaptive_sweep(measure)
+    
+    with phase("to_csv"):
+        return ("\n".join(to_csv(t, header=(i == 0))
+                          for i, t in enumerate(totals)) + "\n",
+                "\n".join(to_csv(r, header=(i == 0))
+                          for i, r in enumerate(router_counters)) + "\n")
+
+
+def _fsync(f):
+    """Flush a file all the way to disk."""
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class _StreamingSweep(object):
+    """Measures the points of a sweep a few groups at a time, appending the
+    results of each chunk of groups to the output CSVs as soon as they are
+    available.
+    
+    After each chunk the CSVs are fsync'd and a checkpoint (recording their
+    sizes and the points measured so far) is atomically written alongside
+    the totals file. If a sweep with the same labels is restarted, the
+    outputs are truncated to their checkpointed sizes and the points already
+    measured are skipped.
+    """
+    
+    def __init__(self, hostname, netlist, placements, machine, labels,
+                 adaptive, filenames, chunk_size):
+        self.hostname = hostname
+        self.netlist = netlist
+        self.placements = placements
+        self.machine = machine
+        self.labels = labels
+        self.chunk_size = chunk_size
+        self.checkpoint_filename = filenames[0] + CHECKPOINT_SUFFIX
+        self.key = {"labels": list(labels), "adaptive": adaptive}
+        
+        # [[reinject_packets, ppts, saturation], ...] for every point
+        # measured so far and the number of these replayed by measure()
+        self.measured = []
+        self.replayed = 0
+        
+        sizes = [0, 0]
+        if exists(self.checkpoint_filename):
+            with open(self.checkpoint_filename, "r") as f:
+                checkpoint = json.load(f)
+            if (checkpoint["key"] == self.key and
+                    all(exists(filename) for filename in filenames)):
+                self.measured = checkpoint["measured"]
+                sizes = checkpoint["sizes"]
+        
+        self.files = []
+        for filename, size in zip(filenames, sizes):
+            directory = dirname(filename)
+            if directory and not exists(directory):
+                os.makedirs(directory)
+            f = open(filename, "r+b" if size else "wb")
+            f.truncate(size)
+            f.seek(size)
+            self.files.append(f)
+    
+    @property
+    def resumed_groups(self):
+        return len(self.measured)
+    
+    def close(self):
+        for f in self.files:
+            f.close()
+    
+    def _write_checkpoint(self):
+        temp_file = "{}.tmp{}".format(self.checkpoint_filename, os.getpid())
+        with open(temp_file, "w") as f:
+            json.dump({"key": self.key,
+                       "measured": self.measured,
+                       "sizes": [f_.tell() for f_ in self.files]}, f)
+            _fsync(f)
+        os.rename(temp_file, self.checkpoint_filename)
+    
+    def measure(self, points):
+        """Measure the saturation at each point (see adaptive_sweep)."""
+        saturations = []
+        
+        # Points measured before the sweep was interrupted
+        while (points and self.replayed < len(self.measured)):
+            reinject_packets, ppts, value = self.measured[self.replayed]
+            if (reinject_packets, ppts) != tuple(points[0]):
+                raise ValueError(
+                    "Checkpoint {} does not match this sweep: remove it to "
+                    "start again.".format(self.checkpoint_filename))
+            saturations.append(value)
+            points = points[1:]
+            self.replayed += 1
+        
+        for start in range(0, len(points), self.chunk_size):
+            chunk = points[start:start + self.chunk_size]
+            results = _run_groups(self.hostname, self.netlist,
+                                  self.placements, self.machine,
+                                  self.labels, chunk, len(self.measured))
+            totals = results.totals()
+            with phase("write_results"):
+                for f, data in zip(self.files,
+                                   (totals, results.router_counters())):
+                    f.write((to_csv(data, header=(f.tell() == 0)) +
+                             "\n").encode("utf-8"))
+                    _fsync(f)
+                values = saturation(totals).tolist()
+                self.measured.extend([reinject_packets, ppts, value]
+                                     for (reinject_packets, ppts), value
+                                     in zip(chunk, values))
+                self.replayed = len(self.measured)
+                self._write_checkpoint()
+            saturations.extend(values)
+        
+        return saturations
+
+
+def stream_experiment(netlist_name, netlist, placements, machine_name,
+                      machine, hostname, totals_filename,
+                      router_counters_filename, adaptive=False,
+                      chunk_size=STREAM_GROUPS):
+    """Run an injection-rate sweep as run_experiment but write the results
+    to the output files as the sweep progresses.
+    
+    The groups of the sweep are run chunk_size at a time (one experiment
+    run per chunk) so only one chunk's results are held in memory. After
+    each chunk the outputs are fsync'd and checkpointed so that, if the
+    sweep is interrupted, running it again resumes after the last completed
+    chunk. The checkpoint is removed once the sweep completes.
+    
+    Returns
+    -------
+    int
+        The number of groups whose results were kept from an interrupted
+        sweep.
+    """
+    import logging
+    logging.basicConfig(level=logging.DEBUG)
+    
+    labels = (netlist_name, machine_name, placements.algorithm,
+              placements.placement_duration)
+    
+    sweep = _StreamingSweep(hostname, netlist, placements, machine, labels,
+                            adaptive,
+                            (totals_filename, router_counters_filename),
+                            chunk_size)
+    resumed_groups = sweep.resumed_groups
+    try:
+        if adaptive:
+            adaptive_sweep(sweep.measure)
+        else:
+            sweep.measure(sweep_points())
+    finally:
+        sweep.close()
+    
+    os.remove(sweep.checkpoint_filename)
+    return resumed_groups
+
+
+def _write_result(filename, data):
+    """Atomically write a results file, creating directories as required."""
+    directory = dirname(filename)
+    if not exists(directory):
+        os.makedirs(directory)
+    temp_file = "{}.tmp{}".format(filename, os.getpid())
+    with open(temp_file, "w") as f:
+        f.write(data)
+    os.rename(temp_file, filename)
+
+
+def run_batch(machine_filename, pairs, results_dir=RESULTS_DIR,
+              adaptive=False, stream=False):
+    """Run experiments for many placed netlists on the same machine.
+    
+    A single connection to the machine is shared by all experiments. The
+    results of each placement are written to
+    ``results_dir/{totals,router_counters}/placer/machine/netlist.csv`` as
+    soon as its experiment completes. Consecutive pairs using the same
+    netlist only load it once.
+    
+    Parameters
+    ----------
+    machine_filename : str
+    pairs : [(netlist_filename, placements_filename), ...]
+    stream : bool
+        If True, use stream_experiment so that each placement's results are
+        written as its sweep progresses and an interrupted batch may be
+        resumed by running it again.
+    
+    A timing sidecar (see profiling.py) is written alongside the results of
+    each placement.
+    
+    Generates
+    ---------
+    (totals_filename, router_counters_filename)
+        As the results of each placement are written.
+    """
+    machine_name = splitext(basename(machine_filename))[0]
+    hostname, machine = load_machine(machine_filename)
+    mc = MachineController(hostname)
+    
+    netlist_filename = netlist = None
+    for pair_netlist_filename, placements_filename in pairs:
+        timer = start_timing()
+        if pair_netlist_filename != netlist_filename:
+            netlist_filename = pair_netlist_filename
+            netlist = load_netlist(netlist_filename)
+        netlist_name = splitext(basename(netlist_filename))[0]
+        with phase("load_placements"):
+            placements = load_placements(placements_filename, netlist)
+        
+        filenames = tuple(
+            join(results_dir, result, placements.algorithm, machine_name,
+                 "{}.csv".format(netlist_name))
+            for result in ("totals", "router_counters"))
+        if stream:
+            stream_experiment(netlist_name, netlist, placements,
+                              machine_name, machine, mc, filenames[0],
+                              filenames[1], adaptive)
+        else:
+            totals, router_counters = \
+                run_experiment(netlist_name, netlist, placements,
+                               machine_name, machine, mc, adaptive)
+            _write_result(filenames[0], totals)
+            _write_result(filenames[1], router_counters)
+        timer.write_sidecars(filenames)
+        yield filenames
 
 
 if __name__=="__main__":
     import sys
-    if len(sys.argv) != 6:
-        print("Expected five arguments: netlist placements machine totals router_counters.")
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        parser = argparse.ArgumentParser(
+            prog="experiment.py --batch",
+            description="Run experiments for several placed netlists on the "
+                        "same machine and write the results into the results "
+                        "directory.")
+        parser.add_argument("machine", metavar="MACHINE")
+        parser.add_argument("pairs", metavar="NETLIST PLACEMENTS", nargs="*",
+                            help="Netlist and placement filename pairs.")
+        parser.add_argument("--pairs-file", "-f",
+                            help="A file listing further netlist and "
+                                 "placement filename pairs, one pair per "
+                                 "line.")
+        parser.add_argument("--results-dir", default=RESULTS_DIR,
+                            help="Directory to write results into.")
+        parser.add_argument("--adaptive", action="store_true",
+                            help="Use adaptive injection-rate sweeps.")
+        parser.add_argument("--stream", action="store_true",
+                            help="Write results as each sweep progresses "
+                                 "and resume interrupted sweeps.")
+        args = parser.parse_args(sys.argv[2:])
+        
+        filenames = list(args.pairs)
+        if args.pairs_file is not None:
+            with open(args.pairs_file, "r") as f:
+                filenames.extend(f.read().split())
+        if len(filenames) % 2 != 0:
+            parser.error("expected netlist and placement filename pairs")
+        
+        for totals_file, router_counters_file in run_batch(
+                args.machine, list(zip(filenames[0::2], filenames[1::2])),
+                args.results_dir, args.adaptive, args.stream):
+            print("Wrote {} and {}".format(totals_file, router_counters_file))
+        sys.exit(0)
+    
+    # Use an adaptive sweep if --adaptive is given and stream the results
+    # (see stream_experiment) if --stream is given after the five positional
+    # arguments.
+    argv = [arg for arg in sys.argv if arg not in ("--adaptive", "--stream")]
+    
+    if len(argv) != 6:
+        print("Expected five arguments: netlist placements machine totals router_counters [--adaptive] [--stream].")
         sys.exit(1)
     else:
-        netlist_name = splitext(basename(sys.argv[1]))[0]
-        with open(sys.argv[1], "r") as f:
-            netlist = json_to_netlist(json.load(f))
-        with open(sys.argv[2], "r") as f:
-            placements = json_to_placements(json.load(f))
-        machine_name = splitext(basename(sys.argv[3]))[0]
-        with open(sys.argv[3], "r") as f:
-            hostname, machine = json_to_machine(json.load(f))
-        
-        totals, router_counters = \
-            run_experiment(netlist_name,
-                           netlist["vertices_resources"], netlist["nets"],
-                           placements["algorithm"],
-                           placements["placement_duration"],
-                           placements["placements"],
-                           machine_name, machine, hostname)
+        timer = start_timing()
+        netlist_name = splitext(basename(argv[1]))[0]
+        netlist = load_netlist(argv[1])
+        with phase("load_placements"):
+            placements = load_placements(argv[2], netlist)
+        machine_name = splitext(basename(argv[3]))[0]
+        hostname, machine = load_machine(argv[3])
         
-        with open(sys.argv[4], "w") as f:
-            f.write(totals)
-        with open(sys.argv[5], "w") as f:
-            f.write(router_counters)
+        if "--stream" in sys.argv:
+            resumed_groups = \
+                stream_experiment(netlist_name, netlist, placements,
+                                  machine_name, machine, hostname,
+                                  argv[4], argv[5],
+                                  adaptive="--adaptive" in sys.argv)
+            if resumed_groups:
+                print("Resumed after {} groups.".format(resumed_groups))
+        else:
+            totals, router_counters = \
+                run_experiment(netlist_name, netlist, placements,
+                               machine_name, machine, hostname,
+                               adaptive="--adaptive" in sys.argv)
+            
+            with open(argv[4], "w") as f:
+                f.write(totals)
+            with open(argv[5], "w") as f:
+                f.write(router_counters)
+        timer.write_sidecars(argv[4:6])
 
 
 
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""Generate a JSON machine description of a synthetic SpiNNaker system.
+
+Synthetic machines do not correspond to real hardware (their hostname is null)
+but may be used with the placement, static analysis and simulation scripts,
+e.g. for testing at scales beyond the machines available.
+"""
+
+import argparse
+
+import json
+
+import sys
+
+import numpy as np
+
+from rig.machine import Machine, Links
+
+from machine_to_json import _resources_to_json
+
+
+def generate_machine_json(width, height, dead_chip_rate=0.0,
+                          dead_link_rate=0.0, seed=None, hostname=None):
+    """Generate a machine description with randomly chosen faults.
+
+    Chip (0, 0) is never dead. Links are only ever marked dead between two
+    working chips and are always dead in both directions.
+
+    Parameters
+    ----------
+    width, height : int
+    dead_chip_rate, dead_link_rate : float
+        The probability of any individual chip or (bidirectional) link being
+        dead.
+    seed : int or None
+        Seed for the random number generator.
+
+    Returns
+    -------
+    dict
+        In the format produced by machine_to_json.
+    """
+    rng = np.random.default_rng(seed)
+
+    dead = rng.random((width, height)) < dead_chip_rate
+    dead[0, 0] = False
+    alive = ~dead
+
+    # Decide the fate of each link in the east, north-east and north
+    # directions (the other three are their opposites) between live chips.
+    dead_links = np.zeros((width, height, 6), dtype=bool)
+    for link in (Links.east, Links.north_east, Links.north):
+        dx, dy = link.to_vector()
+        neighbour_alive = np.roll(np.roll(alive, -dx, axis=0), -dy, axis=1)
+        failed = ((rng.random((width, height)) < dead_link_rate) &
+                  alive & neighbour_alive)
+        dead_links[:, :, int(link)] = failed
+        dead_links[:, :, int(link.opposite)] |= np.roll(
+            np.roll(failed, dx, axis=0), dy, axis=1)
+
+    return {"hostname": hostname,
+            "width": width,
+            "height": height,
+            "chip_resources":
+                _resources_to_json(Machine(1, 1).chip_resources),
+            "chip_resource_exceptions": [],
+            "dead_chips": np.argwhere(dead).tolist(),
+            "dead_links": np.argwhere(dead_links).tolist(),
+           }
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic machine description.")
+    parser.add_argument("width", type=int)
+    parser.add_argument("height", type=int)
+    parser.add_argument("--dead-chip-rate", type=float, default=0.0,
+                        help="Probability of each chip being dead.")
+    parser.add_argument("--dead-link-rate", type=float, default=0.0,
+                        help="Probability of each link being dead.")
+    parser.add_argument("--seed", type=int,
+                        help="Seed for the random number generator.")
+    args = parser.parse_args()
+
+    json.dump(generate_machine_json(args.width, args.height,
+                                    args.dead_chip_rate, args.dead_link_rate,
+                                    args.seed),
+              sys.stdout)
+    sys.stdout.write("\n")
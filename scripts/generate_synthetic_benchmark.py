@@ -4,7 +4,7 @@
 
 import argparse
 
-import json
+import sys
 
 import re
 
@@ -16,19 +16,26 @@ from math import sqrt, ceil
 
 import random
 
+from multiprocessing import Pool
+
+import numpy as np
+
 from six import iteritems
+from six.moves import map
+
+from netlist_to_json import JSONNetlistWriter
 
-from netlist_to_json import netlist_to_json
+from distributions import Distribution
 
-def to_dist(description):
-    # XXX: Insecure, but for expert use only!
-    local_vars = {n: getattr(random, n) for n in dir(random)}
-    return (lambda: eval(description, local_vars))
+
+# The default number of source vertices generated in each shard by the NumPy
+# engine
+DEFAULT_SHARD_SIZE = 16384
 
 
 def add_random_net_per_vertex(vertices, nets, probability, num_sinks="1", weight="1"):
-    num_sinks_dist = to_dist(num_sinks)
-    weight_dist = to_dist(weight)
+    num_sinks_dist = Distribution(num_sinks)
+    weight_dist = Distribution(weight)
     
     for vertex in vertices:
         nets.append(Net(vertex,
@@ -37,7 +44,7 @@ def add_random_net_per_vertex(vertices, nets, probability, num_sinks="1", weight
 
 
 def add_nearest_neighbour(vertices, nets, topology, weight="1"):
-    weight_dist = to_dist(weight)
+    weight_dist = Distribution(weight)
     
     wraps = topology.endswith("torus")
     
@@ -72,10 +79,10 @@ def add_nearest_neighbour(vertices, nets, topology, weight="1"):
 
 def add_distance_dependent(vertices, nets, topology,
                            num_sinks="1", dx="0", dy=None, weight="1"):
-    num_sinks_dist = to_dist(num_sinks)
-    dx_dist = to_dist(dx)
-    dy_dist = to_dist(dy if dy is not None else dx)
-    weight_dist = to_dist(weight)
+    num_sinks_dist = Distribution(num_sinks)
+    dx_dist = Distribution(dx)
+    dy_dist = Distribution(dy if dy is not None else dx)
+    weight_dist = Distribution(weight)
     
     wraps = topology.endswith("torus")
     
@@ -100,7 +107,7 @@ def add_distance_dependent(vertices, nets, topology,
 
 
 def add_all_to_all_pipeline(vertices, nets, width, weight="1"):
-    weight_dist = to_dist(weight)
+    weight_dist = Distribution(weight)
     
     n_vertices = len(vertices)
     width = int(width)
@@ -111,7 +118,7 @@ def add_all_to_all_pipeline(vertices, nets, width, weight="1"):
              if i + width < n_vertices]
 
 def add_merge_node_pipeline(vertices, nets, width, weight="1"):
-    weight_dist = to_dist(weight)
+    weight_dist = Distribution(weight)
     
     n_vertices = len(vertices)
     width = int(width)
@@ -138,6 +145,278 @@ def add_merge_node_pipeline(vertices, nets, width, weight="1"):
         pass
 
 
+# NumPy generation engine
+# -----------------------
+#
+# The following functions produce netlists with the same topology semantics
+# as the corresponding functions above (including torus wrapping and the
+# removal of duplicate sinks) but draw all random values for every vertex at
+# once and resolve neighbours by arithmetic on the grid coordinates.
+#
+# Each function generates just the nets produced by the source vertices
+# range(start, stop) (a 'shard') using the NumPy Generator supplied. Nets are
+# returned in CSR form as vertex indices, i.e. as a tuple (sources,
+# sink_offsets, sinks, weights) of NumPy arrays, in the order the
+# corresponding function above would have produced them.
+
+
+def _counts_to_offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def _ranges(starts, counts):
+    """Concatenate range(start, start + count) for every start and count."""
+    offsets = _counts_to_offsets(counts)
+    return (np.repeat(starts - offsets[:-1], counts) +
+            np.arange(offsets[-1], dtype=np.int64))
+
+
+def _first_occurrences(rows, values):
+    """Get a mask selecting the first occurrence of each value within each
+    row (rows must be in ascending order)."""
+    keep = np.zeros(len(values), dtype=bool)
+    if len(values):
+        _, first = np.unique(rows * (values.max() + 1) + values,
+                             return_index=True)
+        keep[first] = True
+    return keep
+
+
+def _sample_without_replacement(rng, population, counts):
+    """For each count, draw that many distinct integers from
+    range(population).
+
+    Returns
+    -------
+    np.ndarray
+        The samples for each count, concatenated.
+    """
+    counts = np.minimum(counts, population)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    samples = rng.integers(0, population, len(rows))
+
+    # Rows sampling most of the population are sampled directly to avoid
+    # repeatedly redrawing duplicates.
+    dense = counts * 2 > population
+    offsets = _counts_to_offsets(counts)
+    for row in np.flatnonzero(dense):
+        samples[offsets[row]:offsets[row + 1]] = \
+            rng.choice(population, counts[row], replace=False)
+
+    # Redraw any duplicates until none remain
+    while True:
+        duplicates = ~_first_occurrences(rows, samples)
+        num_duplicates = np.count_nonzero(duplicates)
+        if num_duplicates == 0:
+            return samples
+        samples[duplicates] = rng.integers(0, population, num_duplicates)
+
+
+def np_random_net_per_vertex(rng, n_vertices, start, stop, probability,
+                             num_sinks="1", weight="1"):
+    n_sources = stop - start
+    num_sinks = np.clip(Distribution(num_sinks).sample(n_sources, rng)
+                        .astype(np.int64), 0, n_vertices)
+    weights = Distribution(weight).sample(n_sources, rng)
+    
+    sinks = _sample_without_replacement(rng, n_vertices, num_sinks)
+    return (np.arange(start, stop), _counts_to_offsets(num_sinks),
+            sinks, weights)
+
+
+def np_nearest_neighbour(rng, n_vertices, start, stop, topology, weight="1"):
+    weights = Distribution(weight).sample(stop - start, rng)
+    
+    wraps = topology.endswith("torus")
+    
+    neighbour_vectors = [
+        (+1, +0),
+        (-1, +0),
+        (+0, +1),
+        (+0, -1),
+    ]
+    if topology.startswith("hex"):
+        neighbour_vectors.extend([
+            (+1, +1),
+            (-1, -1),
+        ])
+    
+    width = int(ceil(sqrt(n_vertices)))
+    index = np.arange(start, stop)
+    x = index % width
+    y = index // width
+    
+    # A (stop - start, len(neighbour_vectors)) array of neighbour indices
+    # with -1 where no neighbour exists.
+    neighbours = np.empty((len(index), len(neighbour_vectors)),
+                          dtype=np.int64)
+    for i, (dx, dy) in enumerate(neighbour_vectors):
+        xx = x + dx
+        yy = y + dy
+        if wraps:
+            xx %= width
+            yy %= width
+        neighbour = yy * width + xx
+        valid = ((xx >= 0) & (xx < width) & (yy >= 0) & (yy < width) &
+                 (neighbour < n_vertices))
+        neighbours[:, i] = np.where(valid, neighbour, -1)
+    
+    valid = neighbours >= 0
+    return (index, _counts_to_offsets(valid.sum(axis=1)),
+            neighbours[valid], weights)
+
+
+def np_distance_dependent(rng, n_vertices, start, stop, topology,
+                          num_sinks="1", dx="0", dy=None, weight="1"):
+    n_sources = stop - start
+    num_sinks = np.maximum(Distribution(num_sinks).sample(n_sources, rng)
+                           .astype(np.int64), 0)
+    weights = Distribution(weight).sample(n_sources, rng)
+    
+    wraps = topology.endswith("torus")
+    
+    width = int(ceil(sqrt(n_vertices)))
+    
+    # Candidate sinks for every vertex, concatenated
+    rows = np.repeat(np.arange(start, stop), num_sinks)
+    xx = (rows % width) + Distribution(dx).sample(len(rows), rng)
+    yy = (rows // width) + Distribution(dy if dy is not None else dx).sample(
+        len(rows), rng)
+    if wraps:
+        xx %= width
+        yy %= width
+    xx = np.round(xx).astype(np.int64)
+    yy = np.round(yy).astype(np.int64)
+    neighbours = yy * width + xx
+    valid = ((xx >= 0) & (xx < width) & (yy >= 0) & (yy < width) &
+             (neighbours < n_vertices))
+    rows = rows[valid]
+    neighbours = neighbours[valid]
+    
+    # Remove duplicate sinks (keeping the first occurrence)
+    keep = _first_occurrences(rows, neighbours)
+    rows = rows[keep]
+    neighbours = neighbours[keep]
+    
+    # Only vertices with at least one sink get a net
+    counts = np.bincount(rows - start, minlength=n_sources)
+    sources = np.flatnonzero(counts)
+    return (sources + start, _counts_to_offsets(counts[sources]),
+            neighbours, weights[sources])
+
+
+def np_all_to_all_pipeline(rng, n_vertices, start, stop, width, weight="1"):
+    width = int(width)
+    sources = np.arange(start, max(start, min(stop, n_vertices - width)))
+    first_sinks = (sources // width + 1) * width
+    counts = np.minimum(first_sinks + width, n_vertices) - first_sinks
+    weights = Distribution(weight).sample(len(sources), rng)
+    return (sources, _counts_to_offsets(counts),
+            _ranges(first_sinks, counts), weights)
+
+
+def np_merge_node_pipeline(rng, n_vertices, start, stop, width, weight="1"):
+    width = int(width)
+    
+    # The vertices are divided into groups of a node, WIDTH ensemble vertices
+    # and a final node. A shard consists of the groups whose first node lies
+    # within it.
+    group_size = width + 2
+    groups = np.arange(-(-start // group_size), -(-stop // group_size))
+    nodes = groups * group_size
+    ensemble_starts = nodes + 1
+    ensemble_sizes = np.minimum(nodes + 1 + width, n_vertices) - nodes - 1
+    last_nodes = nodes + 1 + width
+    
+    # Each group produces (in order): a net from the previous group's final
+    # node, a net from its node to the ensemble and (if the group's final
+    # node exists) a net from each ensemble vertex to the final node. Every
+    # net's sinks are a contiguous range of vertices.
+    has_link = (groups > 0).astype(np.int64)
+    num_ensemble_nets = np.where(last_nodes < n_vertices, ensemble_sizes, 0)
+    group_offsets = _counts_to_offsets(has_link + 1 + num_ensemble_nets)
+    
+    num_nets = group_offsets[-1]
+    sources = np.empty(num_nets, dtype=np.int64)
+    first_sinks = np.empty(num_nets, dtype=np.int64)
+    counts = np.ones(num_nets, dtype=np.int64)
+    
+    linked = has_link.astype(bool)
+    link_nets = group_offsets[:-1][linked]
+    sources[link_nets] = nodes[linked] - 1
+    first_sinks[link_nets] = nodes[linked]
+    
+    node_nets = group_offsets[:-1] + has_link
+    sources[node_nets] = nodes
+    first_sinks[node_nets] = ensemble_starts
+    counts[node_nets] = ensemble_sizes
+    
+    rows = np.repeat(np.arange(len(groups)), num_ensemble_nets)
+    within = _ranges(np.zeros(len(groups), dtype=np.int64),
+                     num_ensemble_nets)
+    ensemble_nets = node_nets[rows] + 1 + within
+    sources[ensemble_nets] = ensemble_starts[rows] + within
+    first_sinks[ensemble_nets] = last_nodes[rows]
+    
+    weights = Distribution(weight).sample(num_nets, rng)
+    return (sources, _counts_to_offsets(counts),
+            _ranges(first_sinks, counts), weights)
+
+
+# The connectivity patterns in the order they are added to the netlist as
+# (argument name, legacy function, NumPy function) tuples. The index of each
+# pattern is used when deriving its random number streams so must not change.
+PATTERNS = [
+    ("random_net_per_vertex",
+     add_random_net_per_vertex, np_random_net_per_vertex),
+    ("nearest_neighbour",
+     add_nearest_neighbour, np_nearest_neighbour),
+    ("distance_dependent",
+     add_distance_dependent, np_distance_dependent),
+    ("all_to_all_pipeline",
+     add_all_to_all_pipeline, np_all_to_all_pipeline),
+    ("merge_node_pipeline",
+     add_merge_node_pipeline, np_merge_node_pipeline),
+]
+
+
+def shard_rng(seed, pattern, occurrence, shard):
+    """Get the independent random number Generator for a shard of the given
+    occurrence (i.e. nth use on the command line) of a pattern (index into
+    PATTERNS)."""
+    return np.random.default_rng(
+        np.random.SeedSequence([seed, pattern, occurrence, shard]))
+
+
+def generate_shard(task):
+    """Generate the nets of a single shard (for use with Pool.imap).
+    
+    Parameters
+    ----------
+    task : (seed, pattern, occurrence, arguments, n_vertices, shard, start, stop)
+    
+    Returns
+    -------
+    (sources, sink_offsets, sinks, weights)
+    """
+    (seed, pattern, occurrence, arguments,
+     n_vertices, shard, start, stop) = task
+    rng = shard_rng(seed, pattern, occurrence, shard)
+    return PATTERNS[pattern][2](rng, n_vertices, start, stop, *arguments)
+
+
+def shard_tasks(args, seed, shard_size):
+    """Generate the tasks for generate_shard, in netlist order."""
+    n_vertices = args.num_vertices
+    for pattern, (name, _, _) in enumerate(PATTERNS):
+        for occurrence, arguments in enumerate(getattr(args, name)):
+            for shard, start in enumerate(range(0, n_vertices, shard_size)):
+                yield (seed, pattern, occurrence, arguments, n_vertices,
+                       shard, start, min(start + shard_size, n_vertices))
+
+
 def main(argv):
     parser = argparse.ArgumentParser(
         description="Generate a synthetic benchmark network.")
@@ -191,36 +470,92 @@ def main(argv):
                              "This approximately matches a style of network "
                              "generated by nengo_spinnaker.")
     
+    parser.add_argument("--legacy", action="store_true",
+                        help="Use the original (slow) pure-Python "
+                             "generators, e.g. to reproduce the exact "
+                             "behaviour of older versions of this script.")
+    
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for the random number generators. If not "
+                             "given, a seed is chosen at random. Either way, "
+                             "the seed used is recorded in the netlist.")
+    
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE,
+                        help="The number of source vertices whose nets are "
+                             "generated together (with their own random "
+                             "number stream) by the NumPy engine "
+                             "(default: %(default)s). The netlist produced "
+                             "depends on the seed and shard size but not on "
+                             "the number of processes used.")
+    
+    parser.add_argument("--processes", "-j", type=int, default=1,
+                        help="The number of processes to generate shards "
+                             "in (default: %(default)s). Ignored with "
+                             "--legacy.")
+    
     args = parser.parse_args(argv)
     
+    if args.seed is None:
+        args.seed = np.random.SeedSequence().entropy
+    
     # Create the specified number of vertices
     vertices = [str(i + 1) for i in range(args.num_vertices)]
     vertices_resources = {v: {Cores: 1} for v in vertices}
     
-    nets = []
+    # Nets are written out as they are generated rather than being
+    # accumulated in memory.
+    nets = JSONNetlistWriter(sys.stdout, vertices_resources)
     
     # Add connectivity according to arguments
-    for a in args.random_net_per_vertex:
-        add_random_net_per_vertex(vertices, nets, *a)
-    for a in args.nearest_neighbour:
-        add_nearest_neighbour(vertices, nets, *a)
-    for a in args.distance_dependent:
-        add_distance_dependent(vertices, nets, *a)
-    for a in args.all_to_all_pipeline:
-        add_all_to_all_pipeline(vertices, nets, *a)
-    for a in args.merge_node_pipeline:
-        add_merge_node_pipeline(vertices, nets, *a)
-    
-    # Dump the netlist as a file
-    json_netlist = netlist_to_json({
-        "vertices_resources": vertices_resources,
-        "nets": nets,
-    })
-    json_netlist["generator_arguments"] = " ".join(argv)
-    print(json.dumps(json_netlist))
+    if args.legacy:
+        random.seed(args.seed)
+        for name, legacy_function, _ in PATTERNS:
+            for a in getattr(args, name):
+                legacy_function(vertices, nets, *a)
+    else:
+        tasks = shard_tasks(args, args.seed, args.shard_size)
+        if args.processes > 1:
+            pool = Pool(args.processes)
+            shards = pool.imap(generate_shard, tasks)
+        else:
+            pool = None
+            shards = map(generate_shard, tasks)
+        
+        # Shards are written in order as they complete
+        for sources, sink_offsets, sinks, weights in shards:
+            sinks = [vertices[s] for s in sinks.tolist()]
+            sink_offsets = sink_offsets.tolist()
+            for source, start, end, weight in zip(sources.tolist(),
+                                                  sink_offsets,
+                                                  sink_offsets[1:],
+                                                  weights.tolist()):
+                nets.write_net(vertices[source], sinks[start:end], weight)
+        
+        if pool is not None:
+            pool.close()
+            pool.join()
+    
+    # The number of processes is omitted from the recorded arguments since it
+    # does not affect the netlist produced.
+    parameters = vars(args)
+    del parameters["processes"]
+    nets.close(generator_arguments=" ".join(_without_processes(argv)),
+               generator_seed=args.seed,
+               generator_parameters=parameters)
+    sys.stdout.write("\n")
     return 0
 
 
+def _without_processes(argv):
+    """Remove the --processes/-j option from a list of arguments."""
+    argv = iter(argv)
+    for arg in argv:
+        if arg in ("--processes", "-j"):
+            next(argv, None)
+        elif not arg.startswith(("--processes=", "-j")):
+            yield arg
+
+
 if __name__=="__main__":
     import sys
     sys.exit(main(sys.argv[1:]))
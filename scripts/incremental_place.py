@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+"""Re-place and re-route a netlist after a small edit, reusing earlier work.
+
+Given the netlist and placement from before an edit and the edited netlist,
+the two netlists are compared (see diff_netlists) to find the vertices and
+nets which were added, removed or changed. Vertices which are unchanged
+("kept") are fixed at their previous locations using LocationConstraints so
+that the placer only places the changed part of the netlist.
+
+If the routes of the previous placement are in the route cache (see
+route_cache.py, e.g. because static_analysis.py has been run on it), kept
+vertices also keep their previous core allocations and only the nets with an
+endpoint which is not kept are routed again; every other net reuses its
+previous routing tree. (Rig's routers route every net independently so the
+reused routes are exactly those which routing the whole netlist would
+produce.) The resulting routes are written into the route cache under the
+new placement's key so that static_analysis.py and friends reuse them too.
+"""
+
+import argparse
+
+import sys
+
+import time
+
+from collections import defaultdict
+
+from six import iteritems
+
+from rig.machine import Cores
+
+from rig.place_and_route import allocate, route
+from rig.place_and_route.utils import build_routing_tables
+
+from rig.place_and_route.constraints import LocationConstraint, \
+    ReserveResourceConstraint
+
+from rig.place_and_route.exceptions import InsufficientResourceError
+
+from netlist_to_json import load_netlist
+from netlist_core import Placements, load_placements
+from place import get_placer, place_to_json, _write_placements
+from cache import load_machine
+from route_cache import load_cached_routes, store_routes, routes_key
+from profiling import phase, start_timing
+
+
+def _net_signature(net):
+    return (net.source, tuple(net.sinks), net.weight)
+
+
+def diff_netlists(old_vertices_resources, old_nets,
+                  new_vertices_resources, new_nets):
+    """Compare two versions of a netlist.
+
+    Vertices are matched by their IDs and are "changed" if their resource
+    requirements differ. Nets are matched if they have the same source, sinks
+    and weight.
+
+    Returns
+    -------
+    {"added_vertices": set, "removed_vertices": set,
+     "changed_vertices": set, "matched_nets": {new_net: old_net, ...},
+     "added_nets": [net, ...], "removed_nets": [net, ...]}
+    """
+    added_vertices = set(v for v in new_vertices_resources
+                         if v not in old_vertices_resources)
+    removed_vertices = set(v for v in old_vertices_resources
+                           if v not in new_vertices_resources)
+    changed_vertices = set(v for v, resources in
+                           iteritems(new_vertices_resources)
+                           if v in old_vertices_resources and
+                           old_vertices_resources[v] != resources)
+
+    # {signature: [old_net, ...], ...}, popped as nets are matched so that
+    # duplicate nets are matched one-to-one
+    unmatched = defaultdict(list)
+    for net in reversed(old_nets):
+        unmatched[_net_signature(net)].append(net)
+
+    matched_nets = {}
+    added_nets = []
+    for net in new_nets:
+        candidates = unmatched.get(_net_signature(net))
+        if candidates:
+            matched_nets[net] = candidates.pop()
+        else:
+            added_nets.append(net)
+    removed_nets = [net for nets in unmatched.values() for net in nets]
+
+    return {"added_vertices": added_vertices,
+            "removed_vertices": removed_vertices,
+            "changed_vertices": changed_vertices,
+            "matched_nets": matched_nets,
+            "added_nets": added_nets,
+            "removed_nets": removed_nets}
+
+
+def kept_vertices(diff, new_vertices_resources, old_placements, machine):
+    """Get the set of vertices which may stay where they were: those which
+    are unchanged and previously placed on a chip which is still present."""
+    return set(v for v in new_vertices_resources
+               if v not in diff["added_vertices"] and
+               v not in diff["changed_vertices"] and
+               tuple(old_placements.get(v, (-1, -1))) in machine)
+
+
+def incremental_place(vertices_resources, nets, machine, old_placements,
+                      kept, algorithm="default", seed=None, metrics=False):
+    """Place a netlist, fixing kept vertices at their old locations.
+
+    Returns
+    -------
+    json_placements
+        As place.place_to_json with an additional "incremental" entry giving
+        the number of vertices kept and placed.
+    """
+    constraints = [LocationConstraint(v, tuple(old_placements[v]))
+                   for v in vertices_resources if v in kept]
+    json_placements = place_to_json(vertices_resources, nets, machine,
+                                    algorithm, seed, metrics, constraints)
+    json_placements["incremental"] = {
+        "vertices_kept": len(constraints),
+        "vertices_placed": len(vertices_resources) - len(constraints)}
+    return json_placements
+
+
+def incremental_route(vertices_resources, nets, machine, placements, kept,
+                      matched_nets, old_allocations, old_routes):
+    """Allocate and route a placed netlist, reusing the allocations of kept
+    vertices and the routes of nets whose endpoints are all kept.
+
+    Parameters
+    ----------
+    matched_nets : {net: old_net, ...}
+        Nets which are unchanged since the old routes were produced.
+    old_allocations, old_routes
+        As produced by route_cache.route_netlist for the old netlist.
+
+    Returns
+    -------
+    (allocations, routes, routing_tables, num_reused)
+    """
+    constraints = [ReserveResourceConstraint(Cores, slice(0, 2))]
+
+    with phase("allocate"):
+        # Kept vertices keep their allocations; others are allocated around
+        # them.
+        allocations = {v: old_allocations[v]
+                       for v in vertices_resources if v in kept}
+        reservations = [ReserveResourceConstraint(resource, allocation,
+                                                  tuple(placements[v]))
+                        for v, resources in iteritems(allocations)
+                        for resource, allocation in iteritems(resources)]
+        unallocated = {v: r for v, r in iteritems(vertices_resources)
+                       if v not in allocations}
+        allocations.update(allocate(unallocated, [], machine,
+                                    constraints + reservations,
+                                    {v: placements[v] for v in unallocated}))
+
+    reused = {net: old_routes[old_net]
+              for net, old_net in iteritems(matched_nets)
+              if net.source in kept and all(s in kept for s in net.sinks)}
+    with phase("route"):
+        rerouted = route(vertices_resources,
+                         [net for net in nets if net not in reused],
+                         machine, constraints, placements, allocations)
+
+    # In netlist order, as route_netlist produces
+    routes = {net: reused[net] if net in reused else rerouted[net]
+              for net in nets}
+    with phase("build_routing_tables"):
+        routing_tables = build_routing_tables(routes,
+                                              {n: (k, -1)
+                                               for k, n in enumerate(nets)})
+    return (allocations, routes, routing_tables, len(reused))
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(
+        description="Place and route an edited netlist, keeping unchanged "
+                    "vertices where they were and reusing their routes.")
+    parser.add_argument("old_netlist", metavar="OLD_NETLIST")
+    parser.add_argument("old_placements", metavar="OLD_PLACEMENTS")
+    parser.add_argument("netlist", metavar="NETLIST")
+    parser.add_argument("machine", metavar="MACHINE")
+    parser.add_argument("placements", metavar="PLACEMENTS",
+                        help="File to write the new placement into.")
+    parser.add_argument("--algorithm", "-a", default="default",
+                        help="Placement algorithm used to place changed "
+                             "vertices (default: %(default)s).")
+    parser.add_argument("--seed", type=int,
+                        help="Seed Python's random number generator with "
+                             "this value before placing.")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Record placement quality metrics.")
+    parser.add_argument("--no-route", action="store_true",
+                        help="Only place the netlist, do not route it.")
+    args = parser.parse_args()
+
+    if get_placer(args.algorithm) is None:
+        sys.stderr.write(
+            "Placement algorithm {} does not exist\n".format(args.algorithm))
+        sys.exit(1)
+
+    timer = start_timing()
+    old_netlist = load_netlist(args.old_netlist)
+    netlist = load_netlist(args.netlist)
+    with phase("load_placements"):
+        old_placements = load_placements(args.old_placements,
+                                          old_netlist)["placements"]
+    hostname, machine = load_machine(args.machine)
+
+    with phase("diff"):
+        diff = diff_netlists(old_netlist["vertices_resources"],
+                             old_netlist["nets"],
+                             netlist["vertices_resources"], netlist["nets"])
+        kept = kept_vertices(diff, netlist["vertices_resources"],
+                             old_placements, machine)
+
+    try:
+        json_placements = incremental_place(
+            netlist["vertices_resources"], netlist["nets"], machine,
+            old_placements, kept, args.algorithm, args.seed, args.metrics)
+    except InsufficientResourceError:
+        # Did not fit. Fail quietly, as place.py.
+        sys.exit(10)
+    _write_placements(args.placements, json_placements)
+
+    print("Vertices: {} kept, {} placed ({} added, {} changed, {} removed)."
+          .format(json_placements["incremental"]["vertices_kept"],
+                  json_placements["incremental"]["vertices_placed"],
+                  len(diff["added_vertices"]),
+                  len(diff["changed_vertices"]),
+                  len(diff["removed_vertices"])))
+    print("Placement took {:.3f}s.".format(
+        json_placements["placement_duration"]))
+
+    if not args.no_route:
+        old = load_cached_routes(
+            routes_key(args.old_netlist, args.machine, args.old_placements),
+            old_netlist["vertices_resources"], old_netlist["nets"], machine)
+        if old is None:
+            # No previous routes to reuse
+            sys.stderr.write("Previous routes not cached; routing every "
+                             "net.\n")
+            kept = set()
+            old = ({}, {}, {})
+        old_allocations, old_routes, old_routing_tables = old
+
+        before = time.time()
+        placements = Placements.from_json(json_placements,
+                                          netlist)["placements"]
+        allocations, routes, routing_tables, num_reused = incremental_route(
+            netlist["vertices_resources"], netlist["nets"], machine,
+            placements, kept, diff["matched_nets"],
+            old_allocations, old_routes)
+        route_duration = time.time() - before
+
+        store_routes(routes_key(args.netlist, args.machine, args.placements),
+                     netlist["vertices_resources"], netlist["nets"],
+                     allocations, routes, routing_tables)
+
+        print("Nets: {} reused, {} routed ({} added, {} removed)."
+              .format(num_reused, len(netlist["nets"]) - num_reused,
+                      len(diff["added_nets"]), len(diff["removed_nets"])))
+        print("Routing took {:.3f}s.".format(route_duration))
+
+    timer.write_sidecars([args.placements])
@@ -7,17 +7,14 @@ import sys
 
 import pickle
 
-import json
-
-from six import iteritems
-
 from rig.machine import Cores
 
 from rig.place_and_route.constraints import ReserveResourceConstraint
 
-from netlist_to_json import json_to_netlist
-from machine_to_json import json_to_machine
-from place import json_to_placements
+from netlist_to_json import load_netlist
+from cache import load_machine
+from netlist_core import load_placements
+from profiling import phase, start_timing
 
 
 if __name__=="__main__":
@@ -26,20 +23,22 @@ if __name__=="__main__":
         print("Expected three arguments: netlist machine placements out.")
         sys.exit(1)
     else:
-        with open(sys.argv[1], "r") as f:
-            netlist = json_to_netlist(json.load(f))
-        with open(sys.argv[2], "r") as f:
-            hostname, machine = json_to_machine(json.load(f))
-        with open(sys.argv[3], "r") as f:
-            placements = json_to_placements(json.load(f))
+        timer = start_timing()
+        netlist = load_netlist(sys.argv[1])
+        hostname, machine = load_machine(sys.argv[2])
+        with phase("load_placements"):
+            placements = load_placements(sys.argv[3], netlist)
         
-        with open(sys.argv[4], "wb") as f:
-            pickle.dump({
-                "vertices_resources": netlist["vertices_resources"],
-                "nets": netlist["nets"],
-                "machine": machine,
-                "constraints": [ReserveResourceConstraint(Cores, slice(0, 2))],
-                "placements": placements["placements"],
-            }, f)
+        with phase("write_pickle"):
+            with open(sys.argv[4], "wb") as f:
+                pickle.dump({
+                    "vertices_resources": netlist["vertices_resources"],
+                    "nets": netlist["nets"],
+                    "machine": machine,
+                    "constraints": [ReserveResourceConstraint(Cores,
+                                                              slice(0, 2))],
+                    "placements": placements["placements"],
+                }, f)
+        timer.write_sidecars([sys.argv[4]])
 
 
@@ -0,0 +1,163 @@
+"""Model the load placed on each link of a SpiNNaker machine by a set of
+routes."""
+
+import csv
+
+from array import array
+
+from collections import OrderedDict
+
+import numpy as np
+
+from six import iteritems
+
+from rig.machine import Links
+
+from rig.place_and_route.routing_tree import RoutingTree
+
+
+# The percentiles of link load reported in link load summaries
+PERCENTILES = (50, 90, 99)
+
+# The number of most heavily loaded links to flag as 'hot' by default
+NUM_HOT_LINKS = 10
+
+
+def link_loads(routes, machine):
+    """Compute the total weight of traffic carried by every link.
+
+    Every routing tree is traversed exactly once, recording the (flattened)
+    index of each link used in a compact array. The loads are then accumulated
+    in a single vectorised pass.
+
+    Parameters
+    ----------
+    routes : {Net: RoutingTree, ...}
+    machine : Machine
+
+    Returns
+    -------
+    np.ndarray
+        A (width, height, 6) array where element [x, y, link] gives the sum of
+        the weights of all nets leaving chip (x, y) via the given link.
+    """
+    height = machine.height
+
+    # Flattened (x, y, link) index of every hop taken and the number of hops
+    # in each net's route.
+    hop_indices = array("l")
+    hop_counts = array("l")
+    weights = array("d")
+
+    for net, routing_tree in iteritems(routes):
+        num_hops = len(hop_indices)
+        to_visit = [routing_tree]
+        while to_visit:
+            node = to_visit.pop()
+            x, y = node.chip
+            base = (x * height + y) * 6
+            for route, child in node.children:
+                if isinstance(child, RoutingTree):
+                    hop_indices.append(base + int(route))
+                    to_visit.append(child)
+        hop_counts.append(len(hop_indices) - num_hops)
+        weights.append(net.weight)
+
+    hop_weights = np.repeat(np.asarray(weights), np.asarray(hop_counts))
+    loads = np.bincount(np.asarray(hop_indices, dtype=np.intp),
+                        weights=hop_weights,
+                        minlength=machine.width * height * 6)
+    return loads.reshape((machine.width, height, 6))
+
+
+def working_links(machine):
+    """Get a (width, height, 6) boolean array which is True for every link
+    which is present and connects two working chips."""
+    alive = np.zeros((machine.width, machine.height), dtype=bool)
+    for x, y in machine:
+        alive[x, y] = True
+
+    mask = np.empty((machine.width, machine.height, 6), dtype=bool)
+    for link in Links:
+        # Both this chip and the chip at the other end of the link must work
+        dx, dy = link.to_vector()
+        mask[:, :, int(link)] = alive & np.roll(np.roll(alive, -dx, axis=0),
+                                                -dy, axis=1)
+
+    for x, y, link in machine.dead_links:
+        mask[x, y, int(link)] = False
+
+    return mask
+
+
+def hot_links(loads, mask, num_hot_links=NUM_HOT_LINKS):
+    """List the most heavily loaded working links.
+
+    Returns
+    -------
+    [(x, y, link, load), ...]
+        In descending order of load.
+    """
+    flat_loads = np.where(mask, loads, -np.inf).ravel()
+    num_hot_links = min(num_hot_links, int(np.count_nonzero(mask)))
+    if num_hot_links == 0:
+        return []
+
+    hottest = np.argpartition(flat_loads, -num_hot_links)[-num_hot_links:]
+    hottest = hottest[np.argsort(flat_loads[hottest])[::-1]]
+
+    return [(x, y, Links(link), loads[x, y, link])
+            for x, y, link in zip(*np.unravel_index(hottest, loads.shape))]
+
+
+def link_load_summary(loads, mask):
+    """Summarise the distribution of load over all working links.
+
+    Returns
+    -------
+    OrderedDict
+        Giving the max_load, mean_load and pN_load (for each percentile N in
+        PERCENTILES) of the working links along with the number of links which
+        are working and which carry any traffic.
+    """
+    working_loads = loads[mask]
+    if len(working_loads) == 0:
+        working_loads = np.zeros(1)
+
+    summary = OrderedDict()
+    summary["max_load"] = working_loads.max()
+    summary["mean_load"] = working_loads.mean()
+    for percentile, value in zip(PERCENTILES,
+                                 np.percentile(working_loads, PERCENTILES)):
+        summary["p{}_load".format(percentile)] = value
+    summary["num_links"] = int(np.count_nonzero(mask))
+    summary["num_used_links"] = int(np.count_nonzero(loads[mask]))
+    return summary
+
+
+def write_link_stats(std_header, std_cols, loads, mask, per_link_file,
+                     num_hot_links=NUM_HOT_LINKS):
+    """Write the load of every working link as CSV.
+
+    Links amongst the num_hot_links most heavily loaded are given their rank
+    (starting from 1) in the hot_link_rank column, other links have NA.
+    """
+    ranks = {(x, y, link): rank + 1
+             for rank, (x, y, link, load)
+             in enumerate(hot_links(loads, mask, num_hot_links))}
+
+    per_link_csv = csv.writer(per_link_file, lineterminator="\n")
+    per_link_csv.writerow(std_header +
+                          ["x", "y", "link", "load", "hot_link_rank"])
+    for x, y, link in zip(*np.nonzero(mask)):
+        per_link_csv.writerow(std_cols + [x, y, link,
+                                          loads[x, y, link],
+                                          ranks.get((x, y, link), "NA")])
+
+
+def write_link_summary(std_header, std_cols, loads, mask, summary_file):
+    """Write a one-row CSV summarising the load on all working links."""
+    summary = link_load_summary(loads, mask)
+    summary_csv = csv.writer(summary_file, lineterminator="\n")
+    summary_csv.writerow(std_header + list(summary))
+    summary_csv.writerow(std_cols + list(summary.values()))
@@ -10,6 +10,8 @@ from rig.machine_control import MachineController
 
 from rig.machine import Machine, Cores, SDRAM, SRAM, Links
 
+from profiling import phase, start_timing
+
 
 def _resources_to_json(resources):
     return {str(r): v for r, v in iteritems(resources)}
@@ -18,7 +20,8 @@ def _resources_to_json(resources):
 def machine_to_json(hostname):
     """Represent the resources available in a given machine as a JSON
     object."""
-    machine = MachineController(hostname).get_machine()
+    with phase("get_machine"):
+        machine = MachineController(hostname).get_machine()
     
     return {"hostname": hostname,
             "width": machine.width,
@@ -65,5 +68,10 @@ if __name__=="__main__":
         print("Expected one argument: hostname.")
         sys.exit(1)
     else:
-        print(json.dumps(machine_to_json(sys.argv[1])))
+        timer = start_timing()
+        json_machine = machine_to_json(sys.argv[1])
+        with phase("write_json"):
+            print(json.dumps(json_machine))
+        sys.stdout.flush()
+        timer.write_sidecars([sys.stdout])
 
@@ -0,0 +1,294 @@
+"""Integer-indexed in-memory netlists and placements.
+
+Vertices are identified by dense integer indices (0 to num_vertices - 1) with
+each (string) vertex ID held just once. Nets are held as NumPy arrays in CSR
+form, exactly as in the binary netlist format (see binary_netlist.py), so
+binary netlists are used directly from their memory-mapped file. Placements
+are held as a (num_vertices, 2) array of chip coordinates.
+
+Rig's placers and routers require dicts keyed on vertex IDs and lists of Net
+objects. These are only built when first used (e.g. ``netlist["nets"]``,
+which, along with ``netlist["vertices_resources"]``, is provided for
+compatibility with the dicts produced by json_to_netlist) and are then kept.
+"""
+
+import json
+
+from array import array
+
+import numpy as np
+
+from six import iteritems
+
+from rig.netlist import Net
+
+from netlist_to_json import STANDARD_RESOURCES
+from binary_netlist import NO_RESOURCES
+from profiling import phase
+
+
+class NetRecord(object):
+    """A net whose source and sinks are vertex indices."""
+
+    __slots__ = ("source", "sinks", "weight")
+
+    def __init__(self, source, sinks, weight):
+        self.source = source
+        self.sinks = sinks
+        self.weight = weight
+
+
+class Netlist(object):
+    """A netlist whose vertices are identified by integer indices.
+
+    Attributes
+    ----------
+    vertex_ids : [str, ...]
+        The ID of each vertex.
+    vertex_resources : np.ndarray (uint32, num_vertices)
+        An index into resources for each vertex (NO_RESOURCES for vertices
+        which appear in nets but have no resources).
+    resources : [{resource: value, ...}, ...]
+        The resource table using Rig resource types where appropriate.
+    net_sources, net_sink_offsets, net_sinks, net_weights : np.ndarray
+        The nets in CSR form, as in the binary netlist format.
+    extra : {key: value, ...}
+        Any other top-level fields of the netlist.
+    """
+
+    def __init__(self, vertex_ids, vertex_resources, resources, net_sources,
+                 net_sink_offsets, net_sinks, net_weights, extra=None):
+        self.vertex_ids = vertex_ids
+        self.vertex_resources = vertex_resources
+        self.resources = resources
+        self.net_sources = net_sources
+        self.net_sink_offsets = net_sink_offsets
+        self.net_sinks = net_sinks
+        self.net_weights = net_weights
+        self.extra = extra or {}
+
+        self._vertex_indices = None
+        self._rig = None
+
+    @property
+    def num_vertices(self):
+        return len(self.vertex_ids)
+
+    @property
+    def num_nets(self):
+        return len(self.net_sources)
+
+    @property
+    def vertex_indices(self):
+        """A dict {vertex_id: index, ...}, built on first use."""
+        if self._vertex_indices is None:
+            self._vertex_indices = {v: i
+                                    for i, v in enumerate(self.vertex_ids)}
+        return self._vertex_indices
+
+    def net(self, index):
+        """Get the NetRecord of the net with the given index."""
+        start, end = self.net_sink_offsets[index:index + 2]
+        return NetRecord(int(self.net_sources[index]),
+                         self.net_sinks[start:end],
+                         float(self.net_weights[index]))
+
+    def iter_nets(self):
+        """Generate a NetRecord for every net (with sinks as lists)."""
+        offsets = self.net_sink_offsets.tolist()
+        sinks = self.net_sinks.tolist()
+        for source, start, end, weight in zip(self.net_sources.tolist(),
+                                              offsets, offsets[1:],
+                                              self.net_weights.tolist()):
+            yield NetRecord(source, sinks[start:end], weight)
+
+    def to_rig(self):
+        """Get the netlist as Rig/Python objects, as json_to_netlist.
+
+        The result is built on first use and then kept, so the same objects
+        are returned every time.
+        """
+        if self._rig is None:
+            with phase("netlist_to_rig"):
+                self._rig = self._build_rig()
+        return self._rig
+
+    def _build_rig(self):
+        ids = self.vertex_ids
+        resources = self.resources
+
+        vertices_resources = {
+            ids[v]: resources[r]
+            for v, r in enumerate(self.vertex_resources.tolist())
+            if r != NO_RESOURCES}
+
+        offsets = self.net_sink_offsets.tolist()
+        sinks = [ids[s] for s in self.net_sinks.tolist()]
+        nets = [Net(ids[source], sinks[start:end], weight)
+                for source, start, end, weight
+                in zip(self.net_sources.tolist(), offsets, offsets[1:],
+                       self.net_weights.tolist())]
+
+        return {"vertices_resources": vertices_resources, "nets": nets}
+
+    def __getitem__(self, key):
+        """Get "vertices_resources" or "nets" as Rig objects (see to_rig)
+        or any extra top-level field."""
+        if key in ("vertices_resources", "nets"):
+            return self.to_rig()[key]
+        return self.extra[key]
+
+    @classmethod
+    def from_json(cls, json_netlist):
+        """Build a Netlist from a JSON-structured netlist."""
+        vertex_indices = {}
+        vertex_resources = array("L")
+        resource_indices = {}
+        resources = []
+        for vertex, vertex_json_resources in iteritems(
+                json_netlist["vertices_resources"]):
+            resource_key = tuple(iteritems(vertex_json_resources))
+            index = resource_indices.get(resource_key)
+            if index is None:
+                index = resource_indices[resource_key] = len(resources)
+                resources.append({STANDARD_RESOURCES.get(r, r): value
+                                  for r, value in resource_key})
+            vertex_indices[vertex] = len(vertex_resources)
+            vertex_resources.append(index)
+
+        def vertex_index(vertex):
+            index = vertex_indices.get(vertex)
+            if index is None:
+                # Appears in a net but has no resources
+                index = vertex_indices[vertex] = len(vertex_resources)
+                vertex_resources.append(NO_RESOURCES)
+            return index
+
+        json_nets = json_netlist["nets"]
+        net_sources = array("L")
+        net_sinks = array("L")
+        net_sink_counts = array("L")
+        for net in json_nets:
+            net_sources.append(vertex_index(net["source"]))
+            net_sinks.extend(vertex_index(sink) for sink in net["sinks"])
+            net_sink_counts.append(len(net["sinks"]))
+        net_sink_offsets = np.zeros(len(json_nets) + 1, dtype=np.uint64)
+        np.cumsum(np.asarray(net_sink_counts), out=net_sink_offsets[1:])
+
+        netlist = cls(list(vertex_indices),
+                      np.asarray(vertex_resources, dtype=np.uint32),
+                      resources,
+                      np.asarray(net_sources, dtype=np.uint32),
+                      net_sink_offsets,
+                      np.asarray(net_sinks, dtype=np.uint32),
+                      np.array([net["weight"] for net in json_nets],
+                               dtype=np.float64),
+                      {key: value for key, value in iteritems(json_netlist)
+                       if key not in ("vertices_resources", "nets")})
+        netlist._vertex_indices = vertex_indices
+        return netlist
+
+    @classmethod
+    def from_binary(cls, binary_netlist):
+        """Build a Netlist sharing the (memory-mapped) arrays of a
+        binary_netlist.BinaryNetlist."""
+        return cls(binary_netlist.vertex_ids,
+                   binary_netlist.vertex_resources,
+                   binary_netlist.resources,
+                   binary_netlist.net_sources,
+                   binary_netlist.net_sink_offsets,
+                   binary_netlist.net_sinks,
+                   binary_netlist.net_weights,
+                   binary_netlist.extra)
+
+
+class Placements(object):
+    """The placement of a Netlist.
+
+    Attributes
+    ----------
+    netlist : Netlist
+    locations : np.ndarray (int64, (num_vertices, 2))
+        The chip coordinates of each vertex, (-1, -1) for unplaced vertices.
+    algorithm : str
+    placement_duration : float
+    extra : {key: value, ...}
+        Any other fields of the placements JSON (e.g. "seed").
+    """
+
+    def __init__(self, netlist, locations, algorithm, placement_duration,
+                 extra=None):
+        self.netlist = netlist
+        self.locations = locations
+        self.algorithm = algorithm
+        self.placement_duration = placement_duration
+        self.extra = extra or {}
+
+        self._rig = None
+
+    @property
+    def placed(self):
+        """A boolean array indicating which vertices are placed."""
+        return self.locations[:, 0] >= 0
+
+    def to_rig(self):
+        """Get a Rig placements dict {vertex_id: (x, y), ...}, built on first
+        use and then kept."""
+        if self._rig is None:
+            ids = self.netlist.vertex_ids
+            self._rig = {ids[v]: (x, y)
+                         for v, (x, y) in enumerate(self.locations.tolist())
+                         if x >= 0}
+        return self._rig
+
+    def to_json(self):
+        """Get the placements in the format produced by place.py."""
+        json_placements = dict(self.extra)
+        json_placements["algorithm"] = self.algorithm
+        json_placements["placement_duration"] = self.placement_duration
+        json_placements["placements"] = {
+            v: [x, y] for v, (x, y) in iteritems(self.to_rig())}
+        return json_placements
+
+    def __getitem__(self, key):
+        """Get the "algorithm", "placement_duration", "placements" (as a Rig
+        placements dict, see to_rig) or any extra field of the placements
+        JSON (see from_json)."""
+        if key == "algorithm":
+            return self.algorithm
+        elif key == "placement_duration":
+            return self.placement_duration
+        elif key == "placements":
+            return self.to_rig()
+        return self.extra[key]
+
+    @classmethod
+    def from_rig(cls, netlist, placements, algorithm, placement_duration,
+                 extra=None):
+        """Build Placements from a Rig placements dict."""
+        locations = np.full((netlist.num_vertices, 2), -1, dtype=np.int64)
+        if placements:
+            vertex_indices = netlist.vertex_indices
+            try:
+                indices = [vertex_indices[v] for v in placements]
+            except KeyError as e:
+                raise ValueError(
+                    "Placement of unknown vertex {}".format(e))
+            locations[indices] = list(placements.values())
+        return cls(netlist, locations, algorithm, placement_duration, extra)
+
+    @classmethod
+    def from_json(cls, json_dict, netlist):
+        """Build Placements from an unpacked placements JSON file."""
+        return cls.from_rig(netlist, json_dict["placements"],
+                            json_dict["algorithm"],
+                            json_dict["placement_duration"],
+                            {key: value for key, value in iteritems(json_dict)
+                             if key not in ("algorithm", "placements",
+                                            "placement_duration")})
+
+
+def load_placements(filename, netlist):
+    """Load a placements JSON file for the given Netlist."""
+    with open(filename, "r") as f:
+        return Placements.from_json(json.load(f), netlist)
@@ -6,6 +6,8 @@ import pickle
 
 import json
 
+import re
+
 from collections import defaultdict
 
 from six import iteritems
@@ -13,6 +15,16 @@ from six import iteritems
 from rig.machine import Cores, SDRAM, SRAM
 from rig.netlist import Net
 
+from profiling import phase, start_timing
+
+
+# Resource names which correspond with Rig resource types
+STANDARD_RESOURCES = {
+    "Cores": Cores,
+    "SDRAM": SDRAM,
+    "SRAM": SRAM,
+}
+
 
 def netlist_to_json(netlist):
     """Convert a netlist into JSON."""
@@ -39,14 +51,8 @@ def netlist_to_json(netlist):
 
 def json_to_netlist(json_netlist):
     """Convert a JSON-structured netlist into Rig/Python objects."""
-    standard_resources = {
-        "Cores": Cores,
-        "SDRAM": SDRAM,
-        "SRAM": SRAM,
-    }
-
     vertices_resources = {
-        v: {standard_resources.get(r, r): v
+        v: {STANDARD_RESOURCES.get(r, r): v
             for r, v in iteritems(rs)}
         for v, rs in iteritems(json_netlist["vertices_resources"])}
 
@@ -57,12 +63,243 @@ def json_to_netlist(json_netlist):
             "nets": nets}
 
 
+class JSONNetlistWriter(object):
+    """Incrementally write a netlist as JSON with bounded memory usage.
+
+    The output is identical to ``json.dumps(netlist_to_json(netlist))`` (with
+    any extra fields appended). The vertices_resources are written immediately
+    and nets are then written one at a time as they are appended. This object
+    may be used in place of the list of nets given to functions which build up
+    a netlist using ``nets.append(...)`` or ``nets += [...]``.
+
+    Usage::
+
+        >>> writer = JSONNetlistWriter(f, vertices_resources)
+        >>> writer.append(Net(...))
+        >>> writer.close(generator_arguments="...")
+    """
+
+    def __init__(self, f, vertices_resources, renumber=True):
+        """
+        Parameters
+        ----------
+        f : file
+            File to write the netlist to.
+        vertices_resources : {vertex: {resource: value, ...}, ...}
+            Or an iterable of (vertex, resources) pairs.
+        renumber : bool
+            If True, vertices are given sequentially numbered IDs, as by
+            netlist_to_json. If False, the vertices are assumed to already be
+            strings and are used verbatim.
+        """
+        self._f = f
+        self._num_nets = 0
+
+        if renumber:
+            next_id = [0]
+
+            def new_id():
+                next_id[0] += 1
+                return str(next_id[0])
+
+            self._vertices = defaultdict(new_id)
+        else:
+            self._vertices = _Verbatim()
+
+        if isinstance(vertices_resources, dict):
+            vertices_resources = iteritems(vertices_resources)
+
+        f.write('{"vertices_resources": {')
+        for num, (v, r) in enumerate(vertices_resources):
+            f.write("{}{}: {}".format(
+                ", " if num else "",
+                json.dumps(self._vertices[v]),
+                json.dumps({str(r_): v_ for r_, v_ in iteritems(r)})))
+        f.write('}, "nets": [')
+
+    def write_net(self, source, sinks, weight):
+        vertices = self._vertices
+        self._f.write("{}{}".format(
+            ", " if self._num_nets else "",
+            json.dumps({"source": vertices[source],
+                        "sinks": [vertices[s] for s in sinks],
+                        "weight": float(weight)})))
+        self._num_nets += 1
+
+    def append(self, net):
+        self.write_net(net.source, net.sinks, net.weight)
+
+    def extend(self, nets):
+        for net in nets:
+            self.append(net)
+
+    def __iadd__(self, nets):
+        self.extend(nets)
+        return self
+
+    def __len__(self):
+        return self._num_nets
+
+    def close(self, **extra):
+        """Complete the netlist, adding any extra top-level fields."""
+        self._f.write("]")
+        for key, value in iteritems(extra):
+            self._f.write(", {}: {}".format(json.dumps(key),
+                                            json.dumps(value)))
+        self._f.write("}")
+
+
+class _Verbatim(object):
+    """A trivial mapping from every key to itself."""
+
+    def __getitem__(self, key):
+        return key
+
+
+def iter_json_netlist(f, chunk_size=1 << 16):
+    """Incrementally parse a JSON netlist with bounded memory usage.
+
+    Only a single vertex or net is held in memory at once, regardless of the
+    size of the netlist.
+
+    Generates
+    ---------
+    ("vertices_resources", (vertex_id, {resource_name: value, ...}))
+        For each vertex (with resources in their JSON form).
+    ("nets", {"source": vertex_id, "sinks": [vertex_id, ...], "weight": w})
+        For each net.
+    (key, value)
+        For any other top-level field, e.g. "generator_arguments".
+    """
+    reader = _JSONStreamReader(f, chunk_size)
+
+    reader.expect("{")
+    while reader.peek() != "}":
+        key = reader.value()
+        reader.expect(":")
+        if key == "vertices_resources":
+            reader.expect("{")
+            while reader.peek() != "}":
+                vertex = reader.value()
+                reader.expect(":")
+                yield (key, (vertex, reader.value()))
+                reader.expect(",", "}")
+            reader.expect("}")
+        elif key == "nets":
+            reader.expect("[")
+            while reader.peek() != "]":
+                yield (key, reader.value())
+                reader.expect(",", "]")
+            reader.expect("]")
+        else:
+            yield (key, reader.value())
+        reader.expect(",", "}")
+    reader.expect("}")
+
+
+# Matches a character which ends a JSON number or literal (true, false, null)
+_SCALAR_END = re.compile(r"[\s,:\]}]")
+
+
+class _JSONStreamReader(object):
+    """Reads a JSON document from a file in chunks, one token or value at a
+    time."""
+
+    def __init__(self, f, chunk_size):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Read another chunk, discarding the already-consumed data."""
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+
+    def peek(self):
+        """Get the next non-whitespace character."""
+        while True:
+            while (self._pos < len(self._buf) and
+                   self._buf[self._pos] in " \t\r\n"):
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            elif self._eof:
+                raise ValueError("Unexpected end of JSON netlist")
+            self._fill()
+
+    def expect(self, *chars):
+        """Consume the next character, which must be one of those given. If
+        the next character is one of the last of these, it is not
+        consumed (e.g. for a list's closing bracket)."""
+        char = self.peek()
+        if char not in chars:
+            raise ValueError("Expected {} in JSON netlist, got {}".format(
+                " or ".join(map(repr, chars)), repr(char)))
+        if len(chars) == 1 or char != chars[-1]:
+            self._pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        if self.peek() not in "{[\"":
+            # A number or literal may continue in the next chunk (and a
+            # prefix of one, e.g. "1." or "1e", may be decoded as a shorter
+            # value) so read until its end is in the buffer.
+            while (not self._eof and
+                   _SCALAR_END.search(self._buf, self._pos) is None):
+                self._fill()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                self._pos = end
+                return value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill()
+
+
+def load_netlist(filename):
+    """Load a netlist file as a netlist_core.Netlist.
+
+    Files ending in '.bin' are treated as binary netlists (see
+    binary_netlist.py), all others as JSON. The Rig/Python objects of the
+    netlist are available as ``netlist["vertices_resources"]`` and
+    ``netlist["nets"]``.
+    """
+    from netlist_core import Netlist
+    with phase("load_netlist"):
+        if filename.endswith(".bin"):
+            from binary_netlist import BinaryNetlist
+            return Netlist.from_binary(BinaryNetlist(filename))
+        else:
+            with open(filename, "r") as f:
+                with phase("parse_json"):
+                    json_netlist = json.load(f)
+            with phase("json_to_netlist"):
+                return Netlist.from_json(json_netlist)
+
+
 if __name__=="__main__":
     import sys
     if len(sys.argv) != 2:
         print("Expected one argument: netlist.")
         sys.exit(1)
     else:
-        with open(sys.argv[1], "rb") as f:
-            netlist = pickle.load(f)
-        print(json.dumps(netlist_to_json(netlist)))
+        timer = start_timing()
+        with phase("load_pickle"):
+            with open(sys.argv[1], "rb") as f:
+                netlist = pickle.load(f)
+        with phase("write_json"):
+            writer = JSONNetlistWriter(sys.stdout,
+                                       netlist["vertices_resources"])
+            writer.extend(netlist["nets"])
+            writer.close()
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+        timer.write_sidecars([sys.stdout])
@@ -4,12 +4,24 @@
 
 import sys
 
+import os
+
 import json
 
+import argparse
+
+import random
+
 from importlib import import_module
 
+from pkgutil import iter_modules
+
 import time
 
+from multiprocessing import Pool
+
+from os.path import basename, dirname, exists, join, splitext
+
 from six import iteritems
 
 from rig.machine import Cores
@@ -18,20 +30,52 @@ from rig.place_and_route.constraints import ReserveResourceConstraint
 
 from rig.place_and_route.exceptions import InsufficientResourceError
 
-from netlist_to_json import json_to_netlist
-from machine_to_json import json_to_machine
+from netlist_to_json import load_netlist
+from cache import load_machine
+from placement_metrics import placement_metrics
+from profiling import phase, start_timing
+
+
+# The default directory into which placement sweeps are written
+PLACEMENTS_DIR = join(dirname(__file__), "..", "placements")
 
 
-def place_to_json(vertices_resources, nets, machine, algorithm="default"):
-    """Place the specified netlist."""
+def get_placer(algorithm="default"):
+    """Get the placement function for the named algorithm or None if no such
+    algorithm exists."""
     if algorithm == "default":
         module = "rig.place_and_route"
     else:
         module = "rig.place_and_route.place.{}".format(algorithm)
     
     try:
-        placer = getattr(import_module(module), "place")
+        return getattr(import_module(module), "place")
     except (ImportError, AttributeError):
+        return None
+
+
+def available_placers():
+    """List the names of all placement algorithms available in Rig."""
+    package = import_module("rig.place_and_route.place")
+    return sorted(name for _, name, _ in iter_modules(package.__path__)
+                  if get_placer(name) is not None)
+
+
+def place_to_json(vertices_resources, nets, machine, algorithm="default",
+                  seed=None, metrics=False, constraints=None):
+    """Place the specified netlist.
+
+    Any additional placement constraints (e.g. LocationConstraints fixing the
+    positions of some vertices) may be given as constraints.
+
+    If a seed is given, Python's random number generator is seeded with it
+    immediately before placement and the seed is recorded in the output.
+
+    If metrics is True, cheap estimates of the placement's quality (see
+    placement_metrics) are also computed and recorded.
+    """
+    placer = get_placer(algorithm)
+    if placer is None:
         sys.stderr.write(
             "Placement algorithm {} does not exist\n".format(algorithm))
         sys.exit(1)
@@ -39,45 +83,216 @@ def place_to_json(vertices_resources, nets, machine, algorithm="default"):
     # Reserve space for the monitor and also a reinjection application
     constraints = [
         ReserveResourceConstraint(Cores, slice(0, 2))
-    ]
+    ] + list(constraints or [])
     
-    before = time.time()
-    placements = placer(vertices_resources, nets, machine, constraints)
-    after = time.time()
+    if seed is not None:
+        random.seed(seed)
     
-    return {"algorithm": algorithm,
-            "placements": {v: [x, y] for v, (x, y) in iteritems(placements)},
-            "placement_duration": after - before}
+    with phase("place"):
+        before = time.time()
+        placements = placer(vertices_resources, nets, machine, constraints)
+        after = time.time()
+    
+    json_placements = {
+        "algorithm": algorithm,
+        "placements": {v: [x, y] for v, (x, y) in iteritems(placements)},
+        "placement_duration": after - before}
+    if seed is not None:
+        json_placements["seed"] = seed
+    if metrics:
+        with phase("placement_metrics"):
+            json_placements["placement_metrics"] = placement_metrics(
+                nets, placements, machine)
+    return json_placements
+
+
+# The netlist and machine being placed by a sweep worker process. These are
+# set before the worker pool is forked so that each worker shares the parent's
+# copy rather than re-loading (or unpickling) its own.
+_sweep_netlist = None
+_sweep_machine = None
+_sweep_metrics = False
 
 
-def json_to_placements(json_dict):
-    """Get the placement duration and placement dictionary from an unpacked
-    JSON representation."""
-    return {"algorithm": json_dict["algorithm"],
-            "placement_duration": json_dict["placement_duration"],
-            "placements": {
-                v: (x, y)
-                for v, (x, y) in iteritems(json_dict["placements"])}
-           }
+def _sweep_place(algorithm, seed):
+    """Place the sweep's netlist in a worker process.
+
+    Returns (algorithm, seed, placements) where placements is None if the
+    netlist did not fit.
+    """
+    try:
+        return (algorithm, seed,
+                place_to_json(_sweep_netlist["vertices_resources"],
+                              _sweep_netlist["nets"],
+                              _sweep_machine, algorithm, seed,
+                              _sweep_metrics))
+    except InsufficientResourceError:
+        return (algorithm, seed, None)
+
+
+def _write_placements(filename, json_placements):
+    """Atomically write a placements JSON file, creating directories as
+    required."""
+    directory = dirname(filename)
+    if not exists(directory):
+        os.makedirs(directory)
+    temp_file = "{}.tmp{}".format(filename, os.getpid())
+    with open(temp_file, "w") as f:
+        json.dump(json_placements, f)
+    os.rename(temp_file, filename)
+
+
+def place_sweep(netlist_filename, machine_filename, algorithms, seeds=None,
+                processes=None, placements_dir=PLACEMENTS_DIR, metrics=False):
+    """Place a netlist using several algorithms (and seeds) in parallel.
+
+    The netlist and machine are loaded just once and shared between a pool of
+    worker processes. Each result is written to
+    ``placements_dir/algorithm/machine/netlist.json`` or, for algorithms which
+    did not fit, a ``netlist.skip`` file is created instead.
+
+    By default, each algorithm is run once without a seed. When several
+    seeds are given, the placement for the first seed which fits
+    is written to ``netlist.json`` with the mean and variance of the
+    placement duration across all seeds which fit. The placement for every
+    seed which fits is also written to ``netlist.seedN.json``. The
+    ``netlist.skip`` file is only created if no seed fits.
+
+    If metrics is True, placement quality metrics are recorded for every
+    placement.
+
+    Returns
+    -------
+    {algorithm: [json_placements or None, ...], ...}
+        The placements produced for each algorithm, one per seed.
+    """
+    global _sweep_netlist, _sweep_machine, _sweep_metrics
+    
+    if seeds is None:
+        seeds = [None]
+    
+    netlist_name = splitext(basename(netlist_filename))[0]
+    machine_name = splitext(basename(machine_filename))[0]
+    
+    _sweep_netlist = load_netlist(netlist_filename)
+    # Build the Rig objects before forking so that workers share them
+    _sweep_netlist.to_rig()
+    hostname, _sweep_machine = load_machine(machine_filename)
+    _sweep_metrics = metrics
+    
+    for algorithm in algorithms:
+        if get_placer(algorithm) is None:
+            raise ValueError(
+                "Placement algorithm {} does not exist".format(algorithm))
+    
+    results = {algorithm: [None] * len(seeds) for algorithm in algorithms}
+    pool = Pool(processes)
+    try:
+        async_results = [pool.apply_async(_sweep_place, (algorithm, seed))
+                         for algorithm in algorithms
+                         for seed in seeds]
+        for async_result in async_results:
+            algorithm, seed, json_placements = async_result.get()
+            results[algorithm][seeds.index(seed)] = json_placements
+    finally:
+        pool.close()
+        pool.join()
+    
+    for algorithm, runs in iteritems(results):
+        directory = join(placements_dir, algorithm, machine_name)
+        placement_file = join(directory, "{}.json".format(netlist_name))
+        skip_file = join(directory, "{}.skip".format(netlist_name))
+        
+        fitted = [r for r in runs if r is not None]
+        if not fitted:
+            # Did not fit with any seed
+            if not exists(directory):
+                os.makedirs(directory)
+            open(skip_file, "w").close()
+            continue
+        elif exists(skip_file):
+            os.remove(skip_file)
+        
+        # The first seed which fitted represents the algorithm
+        representative = fitted[0]
+        if len(seeds) > 1:
+            durations = [r["placement_duration"] for r in fitted]
+            mean = sum(durations) / len(durations)
+            variance = sum((d - mean)**2 for d in durations) / len(durations)
+            for seed, json_placements in zip(seeds, runs):
+                seed_file = join(directory,
+                                 "{}.seed{}.json".format(netlist_name, seed))
+                if json_placements is not None:
+                    _write_placements(seed_file, json_placements)
+                elif exists(seed_file):
+                    # Remove the stale placement of an earlier sweep
+                    os.remove(seed_file)
+            representative = dict(representative,
+                                  placement_duration_mean=mean,
+                                  placement_duration_variance=variance)
+        
+        _write_placements(placement_file, representative)
+    
+    return results
 
 
 if __name__=="__main__":
     import sys
-    if len(sys.argv) != 4:
-        print("Expected three arguments: netlist machine algorithm.")
+    
+    # When placing a single netlist, --metrics may be given after the three
+    # positional arguments.
+    argv = [arg for arg in sys.argv if arg != "--metrics"]
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "--sweep":
+        parser = argparse.ArgumentParser(
+            prog="place.py --sweep",
+            description="Place a netlist with several algorithms in parallel "
+                        "and write the results into the placements "
+                        "directory.")
+        parser.add_argument("netlist", metavar="NETLIST")
+        parser.add_argument("machine", metavar="MACHINE")
+        parser.add_argument("algorithms", metavar="ALGORITHM", nargs="*",
+                            help="Placement algorithms to use (default: all "
+                                 "available algorithms).")
+        parser.add_argument("--seeds", "-s", type=int,
+                            help="Place once with each of the seeds 0 to "
+                                 "SEEDS-1 (default: a single unseeded run).")
+        parser.add_argument("--processes", "-j", type=int,
+                            help="Number of worker processes to use.")
+        parser.add_argument("--placements-dir", default=PLACEMENTS_DIR,
+                            help="Directory to write placements into.")
+        parser.add_argument("--metrics", action="store_true",
+                            help="Record placement quality metrics.")
+        args = parser.parse_args(sys.argv[2:])
+        try:
+            place_sweep(args.netlist, args.machine,
+                        args.algorithms or available_placers(),
+                        list(range(args.seeds)) if args.seeds else [None],
+                        args.processes, args.placements_dir, args.metrics)
+        except ValueError as e:
+            sys.stderr.write("{}\n".format(e))
+            sys.exit(1)
+    elif len(argv) != 4:
+        print("Expected three arguments: netlist machine algorithm "
+              "[--metrics].")
+        print("Or: --sweep netlist machine [algorithm ...] (see --sweep -h).")
         sys.exit(1)
     else:
-        with open(sys.argv[1], "r") as f:
-            netlist = json_to_netlist(json.load(f))
-        with open(sys.argv[2], "r") as f:
-            hostname, machine = json_to_machine(json.load(f))
-        algorithm = sys.argv[3]
+        timer = start_timing()
+        netlist = load_netlist(argv[1])
+        hostname, machine = load_machine(argv[2])
+        algorithm = argv[3]
         try:
-            print(json.dumps(place_to_json(netlist["vertices_resources"],
-                                           netlist["nets"],
-                                           machine,
-                                           algorithm)))
+            json_placements = place_to_json(netlist["vertices_resources"],
+                                            netlist["nets"],
+                                            machine,
+                                            algorithm,
+                                            metrics="--metrics" in sys.argv)
         except InsufficientResourceError:
             # Did not fit. Fail quietly.
             sys.exit(10)
+        with phase("write_json"):
+            print(json.dumps(json_placements))
+        sys.stdout.flush()
+        timer.write_sidecars([sys.stdout])
 
@@ -0,0 +1,174 @@
+"""Cheap estimators of placement quality which do not require routing."""
+
+from collections import OrderedDict
+
+from itertools import chain
+
+from six.moves import map
+
+import numpy as np
+
+
+def placement_locations(placements):
+    """Index the vertices of a placement.
+
+    Returns
+    -------
+    (vertex_indices, locations)
+        vertex_indices is a dict {vertex: index, ...} and locations an
+        (num_vertices, 2) array giving the chip of each vertex by index.
+    """
+    vertex_indices = {v: i for i, v in enumerate(placements)}
+    locations = np.array(list(placements.values()),
+                         dtype=np.int64).reshape(-1, 2)
+    return (vertex_indices, locations)
+
+
+def rig_net_pins(nets, vertex_indices):
+    """Get the vertex of every pin (source followed by sinks) of every Rig Net
+    as indices into vertex_indices.
+
+    Returns
+    -------
+    (pin_offsets, pin_vertices, weights)
+        As net_pins, along with the weight of every net.
+    """
+    counts = np.fromiter((len(net.sinks) + 1 for net in nets),
+                         dtype=np.int64, count=len(nets))
+    pin_offsets = np.zeros(len(nets) + 1, dtype=np.int64)
+    np.cumsum(counts, out=pin_offsets[1:])
+
+    pins = chain.from_iterable(chain((net.source, ), net.sinks)
+                               for net in nets)
+    pin_vertices = np.fromiter(map(vertex_indices.__getitem__, pins),
+                               dtype=np.int64, count=pin_offsets[-1])
+    weights = np.fromiter((net.weight for net in nets),
+                          dtype=float, count=len(nets))
+    return (pin_offsets, pin_vertices, weights)
+
+
+def net_arrays(nets, placements):
+    """Get the chip coordinates of every net's source and sinks as arrays.
+
+    Parameters
+    ----------
+    nets : [Net, ...]
+    placements : {vertex: (x, y), ...}
+
+    Returns
+    -------
+    (pin_offsets, pin_x, pin_y, weights)
+        The coordinates of the pins of every net (the source followed by its
+        sinks), concatenated, with net i's pins being
+        ``pin_x[pin_offsets[i]:pin_offsets[i + 1]]``. Every net has at least
+        one pin (its source).
+    """
+    vertex_indices, locations = placement_locations(placements)
+    pin_offsets, pin_vertices, weights = rig_net_pins(nets, vertex_indices)
+    pins = locations[pin_vertices]
+    return (pin_offsets, pins[:, 0], pins[:, 1], weights)
+
+
+def net_pins(netlist):
+    """Get the vertex of every pin (source followed by sinks) of every net of
+    a netlist_core.Netlist (i.e. rig_net_pins without the dict lookups).
+
+    Returns
+    -------
+    (pin_offsets, pin_vertices)
+        As in net_arrays but with vertex indices in place of coordinates.
+    """
+    counts = np.diff(netlist.net_sink_offsets.astype(np.int64)) + 1
+    pin_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=pin_offsets[1:])
+
+    pin_vertices = np.empty(pin_offsets[-1], dtype=np.int64)
+    is_source = np.zeros(len(pin_vertices), dtype=bool)
+    is_source[pin_offsets[:-1]] = True
+    pin_vertices[is_source] = netlist.net_sources
+    pin_vertices[~is_source] = netlist.net_sinks
+    return (pin_offsets, pin_vertices)
+
+
+def half_perimeters(pin_offsets, pin_x, pin_y):
+    """Get the half-perimeter of the bounding box of each net's pins (ignoring
+    wrap-around links)."""
+    if len(pin_offsets) == 1:
+        return np.zeros(0, dtype=np.int64)
+    starts = pin_offsets[:-1]
+    return ((np.maximum.reduceat(pin_x, starts) -
+             np.minimum.reduceat(pin_x, starts)) +
+            (np.maximum.reduceat(pin_y, starts) -
+             np.minimum.reduceat(pin_y, starts)))
+
+
+def toroidal_distances(pin_offsets, pin_x, pin_y, width, height):
+    """Get the sum of the toroidal Manhattan distances from each net's source
+    to each of its sinks."""
+    counts = np.diff(pin_offsets)
+    source_x = np.repeat(pin_x[pin_offsets[:-1]], counts)
+    source_y = np.repeat(pin_y[pin_offsets[:-1]], counts)
+
+    dx = np.abs(pin_x - source_x)
+    dy = np.abs(pin_y - source_y)
+    distances = np.minimum(dx, width - dx) + np.minimum(dy, height - dy)
+
+    # The source pin's distance is always zero so summing over all pins is
+    # safe.
+    net_index = np.repeat(np.arange(len(counts)), counts)
+    return np.bincount(net_index, weights=distances, minlength=len(counts))
+
+
+def vertices_per_chip(locations, machine):
+    """Get a (width, height) array giving the number of vertices placed on
+    each chip by a (num_vertices, 2) array of locations."""
+    counts = np.bincount(locations[:, 0] * machine.height + locations[:, 1],
+                         minlength=machine.width * machine.height)
+    return counts.reshape((machine.width, machine.height))
+
+
+def placement_metrics(nets, placements, machine):
+    """Compute cheap estimators of the quality of a placement.
+
+    Parameters
+    ----------
+    nets : [Net, ...]
+    placements : {vertex: (x, y), ...}
+    machine : Machine
+
+    Returns
+    -------
+    OrderedDict
+        * ``weighted_hpwl``: The sum of the half-perimeter wirelength of every
+          net, weighted by the net's weight.
+        * ``weighted_toroidal_distance``: The sum of the toroidal Manhattan
+          distance from each net's source to each of its sinks, weighted by
+          the net's weight.
+        * ``mean_toroidal_distance`` and ``max_toroidal_distance``: The
+          (unweighted) mean and maximum per-net sum of distances.
+        * ``num_chips_used``: The number of chips with any vertices.
+        * ``max_vertices_per_chip`` and ``mean_vertices_per_chip``: The
+          vertex density of the chips used.
+    """
+    vertex_indices, locations = placement_locations(placements)
+    pin_offsets, pin_vertices, weights = rig_net_pins(nets, vertex_indices)
+    pin_x = locations[pin_vertices, 0]
+    pin_y = locations[pin_vertices, 1]
+    hpwl = half_perimeters(pin_offsets, pin_x, pin_y)
+    distances = toroidal_distances(pin_offsets, pin_x, pin_y,
+                                   machine.width, machine.height)
+    density = vertices_per_chip(locations, machine)
+    used = density[density > 0]
+
+    metrics = OrderedDict()
+    metrics["weighted_hpwl"] = float(np.dot(hpwl, weights))
+    metrics["weighted_toroidal_distance"] = float(np.dot(distances, weights))
+    metrics["mean_toroidal_distance"] = \
+        float(distances.mean()) if len(distances) else 0.0
+    metrics["max_toroidal_distance"] = \
+        float(distances.max()) if len(distances) else 0.0
+    metrics["num_chips_used"] = int(len(used))
+    metrics["max_vertices_per_chip"] = int(used.max()) if len(used) else 0
+    metrics["mean_vertices_per_chip"] = \
+        float(used.mean()) if len(used) else 0.0
+    return metrics
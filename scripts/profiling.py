@@ -0,0 +1,189 @@
+"""Lightweight timing of the phases of the pipeline scripts.
+
+Scripts call start_timing() when they start and then write_sidecars() with
+their output files once they have finished. Library functions mark their
+phases (e.g. loading a netlist, routing, writing CSVs) with::
+
+    with phase("route"):
+        ...
+
+which costs almost nothing when no timer has been started. Phases may be
+nested, in which case their names are joined with a '/'.
+
+For each phase the wall-clock time, CPU time (user and system) and the peak
+resident set size (RSS) of the process so far are recorded. These are written
+as JSON to a sidecar file (``output.timing.json``) next to every output file.
+When a script writes its output to stdout, the sidecar is written next to the
+file stdout is redirected to, if any.
+
+If the PROFILE_ENV environment variable is set to a non-empty value, the
+script is also run under cProfile and the profile dumped (in the format read
+by the pstats module) next to every output file (``output.prof``).
+"""
+
+import cProfile
+
+import json
+
+import os
+
+import stat
+
+import sys
+
+import time
+
+from collections import OrderedDict
+
+from contextlib import contextmanager
+
+from os.path import basename, exists
+
+from six import string_types
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+# The suffixes appended to output filenames to name sidecar files
+SIDECAR_SUFFIX = ".timing.json"
+PROFILE_SUFFIX = ".prof"
+
+# The environment variable which enables cProfile dumps
+PROFILE_ENV = "PIPELINE_PROFILE"
+
+# The timer phases are recorded into (see start_timing)
+_timer = None
+
+
+def _cpu_time():
+    """Get the CPU time (user and system) used by this process."""
+    if hasattr(time, "process_time"):
+        return time.process_time()
+    else:
+        # Python 2 (with a coarser resolution)
+        times = os.times()
+        return times[0] + times[1]
+
+
+def _peak_rss():
+    """Get the peak resident set size of this process in bytes (or None if
+    unknown)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes everywhere except macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _stdout_filename():
+    """Get the name of the regular file stdout is redirected to, if any."""
+    try:
+        fileno = sys.stdout.fileno()
+        if not stat.S_ISREG(os.fstat(fileno).st_mode):
+            return None
+        filename = os.readlink("/proc/self/fd/{}".format(fileno))
+    except (AttributeError, OSError, ValueError):
+        return None
+    return filename if exists(filename) else None
+
+
+class PhaseTimer(object):
+    """Records the time taken by each phase of a script."""
+
+    def __init__(self, profile=None):
+        """
+        Parameters
+        ----------
+        profile : bool or None
+            If True, run cProfile until the sidecars are written. If None,
+            cProfile is used only when PROFILE_ENV is set.
+        """
+        self.start_wall_time = time.time()
+        self.start_cpu_time = _cpu_time()
+        self.phases = []
+        self._names = []
+
+        if profile is None:
+            profile = bool(os.environ.get(PROFILE_ENV))
+        self._profiler = cProfile.Profile() if profile else None
+        if self._profiler is not None:
+            self._profiler.enable()
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager which times a phase of the script."""
+        self._names.append(name)
+        record = OrderedDict([("name", "/".join(self._names))])
+        self.phases.append(record)
+
+        start_wall_time = time.time()
+        start_cpu_time = _cpu_time()
+        try:
+            yield
+        finally:
+            record["wall_time"] = time.time() - start_wall_time
+            record["cpu_time"] = _cpu_time() - start_cpu_time
+            record["peak_rss"] = _peak_rss()
+            self._names.pop()
+
+    def to_json(self):
+        """Get the timings recorded so far as a JSON-serialisable dict."""
+        return OrderedDict([
+            ("script", basename(sys.argv[0])),
+            ("argv", sys.argv[1:]),
+            ("wall_time", time.time() - self.start_wall_time),
+            ("cpu_time", _cpu_time() - self.start_cpu_time),
+            ("peak_rss", _peak_rss()),
+            ("phases", self.phases),
+        ])
+
+    def write_sidecars(self, outputs):
+        """Write a timing sidecar (and profile, if profiling) next to each
+        output. Profiling stops once this has been called.
+
+        Parameters
+        ----------
+        outputs : [filename or file, ...]
+            The output files. Files without a name on disk are ignored
+            except for sys.stdout (see _stdout_filename).
+        """
+        filenames = []
+        for output in outputs:
+            if output is sys.stdout:
+                output = _stdout_filename()
+            elif not isinstance(output, string_types):
+                output = getattr(output, "name", None)
+            if isinstance(output, string_types) and exists(output):
+                filenames.append(output)
+
+        timings = self.to_json()
+        if self._profiler is not None:
+            self._profiler.disable()
+        for filename in filenames:
+            with open(filename + SIDECAR_SUFFIX, "w") as f:
+                json.dump(timings, f, indent=1)
+                f.write("\n")
+            if self._profiler is not None:
+                self._profiler.dump_stats(filename + PROFILE_SUFFIX)
+
+
+def start_timing(profile=None):
+    """Start timing a script, returning the PhaseTimer into which phase()
+    records."""
+    global _timer
+    _timer = PhaseTimer(profile)
+    return _timer
+
+
+@contextmanager
+def phase(name):
+    """Time a phase using the timer started by start_timing, if any."""
+    if _timer is None:
+        yield
+    else:
+        with _timer.phase(name):
+            yield
@@ -0,0 +1,314 @@
+"""Route placed netlists, caching the results on disk.
+
+The allocations, routing trees and routing tables produced for a placed
+netlist are stored in a compact route file (a NumPy .npz of flat arrays) in
+the cache directory, keyed on the hashes of the netlist, machine and placement
+files and the route file version (ROUTE_FILE_VERSION). Scripts which route
+placements can then reuse the routes of an unchanged placement rather than
+routing it again.
+
+Route files contain the following arrays (vertices and nets are identified by
+their index in the netlist's vertices_resources and nets respectively):
+
+* ``alloc_vertex``, ``alloc_resource``, ``alloc_start``, ``alloc_stop``: One
+  entry per allocated resource, ``alloc_resource`` indexing into the
+  ``resource_names`` array. Bounds are stored as floats since resources such
+  as SDRAM may be given fractional amounts.
+* ``tree_offsets``: Net i's routing tree entries are ``tree_offsets[i]`` to
+  ``tree_offsets[i + 1]``.
+* ``tree_parent``, ``tree_route``, ``tree_x``, ``tree_y``, ``tree_vertex``:
+  The routing tree entries of every net, in breadth-first order. The first
+  entry of each net is the root of its tree. Every other entry is a child of
+  the entry ``tree_parent`` (relative to the net's first entry), reached via
+  ``tree_route``. Entries with ``tree_vertex`` of -1 are RoutingTree nodes at
+  chip (``tree_x``, ``tree_y``), others are sink vertices.
+* ``table_x``, ``table_y``, ``table_key``, ``table_mask``, ``table_route``,
+  ``table_sources``: Every routing table entry. Routes are stored as bit
+  masks of Routes values with bit NONE_BIT representing None.
+"""
+
+import hashlib
+
+import os
+
+from array import array
+
+from collections import deque
+
+from os.path import dirname, exists, join
+
+import numpy as np
+
+from six import iteritems
+
+from rig.machine import Cores
+
+from rig.place_and_route import allocate, route
+from rig.place_and_route.utils import build_routing_tables
+
+from rig.place_and_route.constraints import ReserveResourceConstraint
+
+from rig.place_and_route.routing_tree import RoutingTree
+
+from rig.routing_table import RoutingTableEntry, Routes
+
+from cache import CACHE_DIR, cached_file_digest
+from profiling import phase
+
+
+# The bit used to represent None in route bit masks
+NONE_BIT = 31
+
+# Included in every route file's key. Change this whenever the routing
+# performed by route_netlist or the route file format changes so that stale
+# route files are not used.
+ROUTE_FILE_VERSION = 1
+
+
+def route_netlist(vertices_resources, nets, machine, placements):
+    """Allocate and route a placed netlist and build its routing tables.
+
+    Returns
+    -------
+    (allocations, routes, routing_tables)
+    """
+    constraints = [ReserveResourceConstraint(Cores, slice(0, 2))]
+    with phase("allocate"):
+        allocations = allocate(vertices_resources, nets, machine,
+                               constraints, placements)
+    with phase("route"):
+        routes = route(vertices_resources, nets, machine, constraints,
+                       placements, allocations)
+    with phase("build_routing_tables"):
+        routing_tables = build_routing_tables(routes,
+                                              {n: (k, -1)
+                                               for k, n in enumerate(nets)})
+    return (allocations, routes, routing_tables)
+
+
+def routes_key(netlist_filename, machine_filename, placements_filename):
+    """Get the key of the route file for a placed netlist."""
+    h = hashlib.sha1(str(ROUTE_FILE_VERSION).encode("ascii"))
+    for filename in (netlist_filename, machine_filename, placements_filename):
+        h.update(cached_file_digest(filename).encode("ascii"))
+    return h.hexdigest()
+
+
+def _routes_to_mask(routes):
+    mask = 0
+    for r in routes:
+        mask |= 1 << (NONE_BIT if r is None else int(r))
+    return mask
+
+
+def _mask_to_routes(mask):
+    return set(None if bit == NONE_BIT else Routes(bit)
+               for bit in range(NONE_BIT + 1) if mask & (1 << bit))
+
+
+def _to_int(value):
+    """Convert integral floats (e.g. allocation bounds) back into ints."""
+    return int(value) if value.is_integer() else value
+
+
+def write_route_file(f, vertices, nets, allocations, routes,
+                     routing_tables):
+    """Write a route file.
+
+    Parameters
+    ----------
+    f : file or filename
+    vertices : [vertex, ...]
+        The vertices of the netlist in the order of its vertices_resources.
+    nets : [Net, ...]
+    """
+    vertex_indices = {v: i for i, v in enumerate(vertices)}
+
+    resource_names = []
+    resource_indices = {}
+    alloc = [array("l"), array("l"), array("d"), array("d")]
+    for vertex, resources in iteritems(allocations):
+        for resource, allocation in iteritems(resources):
+            if resource not in resource_indices:
+                resource_indices[resource] = len(resource_names)
+                resource_names.append(resource)
+            for column, value in zip(alloc,
+                                     (vertex_indices[vertex],
+                                      resource_indices[resource],
+                                      allocation.start, allocation.stop)):
+                column.append(value)
+
+    tree_offsets = np.zeros(len(nets) + 1, dtype=np.int64)
+    tree = [array("l") for _ in range(5)]
+    for i, net in enumerate(nets):
+        start = len(tree[0])
+        root = routes[net]
+        x, y = root.chip
+        for column, value in zip(tree, (-1, -1, x, y, -1)):
+            column.append(value)
+        to_visit = deque([(root, 0)])
+        while to_visit:
+            node, node_index = to_visit.popleft()
+            for child_route, child in node.children:
+                if isinstance(child, RoutingTree):
+                    x, y = child.chip
+                    to_visit.append((child, len(tree[0]) - start))
+                    values = (node_index, int(child_route), x, y, -1)
+                else:
+                    values = (node_index, int(child_route), -1, -1,
+                              vertex_indices[child])
+                for column, value in zip(tree, values):
+                    column.append(value)
+        tree_offsets[i + 1] = len(tree[0])
+
+    table = [array("l") for _ in range(2)] + [array("q") for _ in range(4)]
+    for (x, y), entries in iteritems(routing_tables):
+        for entry in entries:
+            for column, value in zip(table,
+                                     (x, y, entry.key, entry.mask,
+                                      _routes_to_mask(entry.route),
+                                      _routes_to_mask(entry.sources))):
+                column.append(value)
+
+    def arrays(names, columns, dtype):
+        return {name: np.asarray(column, dtype=dtype)
+                for name, column in zip(names, columns)}
+
+    data = {"resource_names": np.array([str(r) for r in resource_names]),
+            "tree_offsets": tree_offsets}
+    data.update(arrays(["alloc_vertex", "alloc_resource"], alloc[:2],
+                       np.int64))
+    data.update(arrays(["alloc_start", "alloc_stop"], alloc[2:], np.float64))
+    data.update(arrays(["tree_parent", "tree_route", "tree_x", "tree_y",
+                        "tree_vertex"], tree, np.int64))
+    data.update(arrays(["table_x", "table_y", "table_key", "table_mask",
+                        "table_route", "table_sources"], table, np.int64))
+    np.savez_compressed(f, **data)
+
+
+def read_route_file(f, vertices, nets, resources):
+    """Read a route file.
+
+    Parameters
+    ----------
+    f : file or filename
+    vertices : [vertex, ...]
+    nets : [Net, ...]
+        The same vertices and nets as when the file was written.
+    resources : [resource, ...]
+        The resource objects (e.g. Cores) referred to by the allocations.
+
+    Returns
+    -------
+    (allocations, routes, routing_tables)
+    """
+    resources = {str(r): r for r in resources}
+
+    with np.load(f) as data:
+        resource_names = [resources[r]
+                          for r in data["resource_names"].tolist()]
+
+        allocations = {}
+        for v, r, start, stop in zip(data["alloc_vertex"].tolist(),
+                                     data["alloc_resource"].tolist(),
+                                     data["alloc_start"].tolist(),
+                                     data["alloc_stop"].tolist()):
+            allocations.setdefault(vertices[v], {})[resource_names[r]] = \
+                slice(_to_int(start), _to_int(stop))
+
+        routes = {}
+        offsets = data["tree_offsets"].tolist()
+        parents = data["tree_parent"].tolist()
+        tree_routes = data["tree_route"].tolist()
+        xs = data["tree_x"].tolist()
+        ys = data["tree_y"].tolist()
+        tree_vertices = data["tree_vertex"].tolist()
+        for net, start, end in zip(nets, offsets, offsets[1:]):
+            nodes = [RoutingTree((xs[start], ys[start]))]
+            for i in range(start + 1, end):
+                if tree_vertices[i] < 0:
+                    child = RoutingTree((xs[i], ys[i]))
+                else:
+                    child = vertices[tree_vertices[i]]
+                nodes.append(child)
+                nodes[parents[i]].children.append(
+                    (Routes(tree_routes[i]), child))
+            routes[net] = nodes[0]
+
+        routing_tables = {}
+        for x, y, key, mask, route_mask, sources_mask in zip(
+                *(data[name].tolist()
+                  for name in ("table_x", "table_y", "table_key",
+                               "table_mask", "table_route",
+                               "table_sources"))):
+            routing_tables.setdefault((x, y), []).append(
+                RoutingTableEntry(_mask_to_routes(route_mask), key, mask,
+                                  _mask_to_routes(sources_mask)))
+
+    return (allocations, routes, routing_tables)
+
+
+def _route_file(key, cache_dir=CACHE_DIR):
+    return join(cache_dir, "routes", "{}.npz".format(key))
+
+
+def load_cached_routes(key, vertices_resources, nets, machine,
+                       cache_dir=CACHE_DIR):
+    """Read the route file with the given key (see routes_key).
+
+    Returns
+    -------
+    (allocations, routes, routing_tables) or None
+        None if no route file with the given key exists.
+    """
+    route_file = _route_file(key, cache_dir)
+    if not exists(route_file):
+        return None
+
+    resources = set(machine.chip_resources)
+    for vertex_resources in vertices_resources.values():
+        resources.update(vertex_resources)
+    with phase("read_route_file"):
+        return read_route_file(route_file, list(vertices_resources), nets,
+                               resources)
+
+
+def store_routes(key, vertices_resources, nets, allocations, routes,
+                 routing_tables, cache_dir=CACHE_DIR):
+    """Write the route file with the given key (see routes_key)."""
+    route_file = _route_file(key, cache_dir)
+
+    # Written atomically since other processes may be reading the cache
+    if not exists(dirname(route_file)):
+        try:
+            os.makedirs(dirname(route_file))
+        except OSError:
+            # Created concurrently by another process
+            pass
+    temp_file = "{}.tmp{}.npz".format(route_file, os.getpid())
+    with phase("write_route_file"):
+        write_route_file(temp_file, list(vertices_resources), nets,
+                         allocations, routes, routing_tables)
+    os.rename(temp_file, route_file)
+
+
+def cached_route_netlist(key, vertices_resources, nets, machine, placements,
+                         cache_dir=CACHE_DIR):
+    """Route a placed netlist as route_netlist, reusing the route file with
+    the given key (see routes_key) if one exists.
+
+    If key is None, the netlist is simply routed.
+    """
+    if key is None:
+        return route_netlist(vertices_resources, nets, machine, placements)
+
+    cached = load_cached_routes(key, vertices_resources, nets, machine,
+                                cache_dir)
+    if cached is not None:
+        return cached
+
+    allocations, routes, routing_tables = route_netlist(
+        vertices_resources, nets, machine, placements)
+    store_routes(key, vertices_resources, nets, allocations, routes,
+                 routing_tables, cache_dir)
+    return (allocations, routes, routing_tables)
@@ -0,0 +1,569 @@
+#!/usr/bin/env python
+
+"""Place, analyse and run experiments on any new or modified netlists.
+
+Every netlist is placed using every placement algorithm on every machine and
+the resulting placements statically analysed. Experiments are run on just the
+machines named on the commandline. Placements and static analyses are carried
+out in parallel by a pool of worker processes while experiments are run
+one-at-a-time since each occupies a whole SpiNNaker machine.
+
+A job is only re-run when its outputs are missing or out-of-date. By default
+outputs are out-of-date when any input has been modified more recently. When
+--hash is given, outputs are instead out-of-date when the content of any input
+differs from when the outputs were produced.
+"""
+
+import argparse
+
+import hashlib
+
+import json
+
+import os
+
+import sys
+
+import traceback
+
+from collections import defaultdict, deque
+
+from contextlib import contextmanager
+
+from glob import glob
+
+from multiprocessing import Pool, cpu_count
+
+from os.path import abspath, basename, dirname, exists, getmtime, join, \
+    splitext
+
+from six.moves import queue
+
+from rig.place_and_route.exceptions import InsufficientResourceError
+
+from netlist_to_json import load_netlist
+from place import available_placers, place_to_json
+from netlist_core import load_placements
+from cache import file_digest, load_machine
+from static_analysis import measure_nets
+from route_cache import routes_key
+from table_compression import measure_tables
+from profiling import SIDECAR_SUFFIX, start_timing
+from aggregate_results import update_store
+
+
+BASE_DIR = abspath(join(dirname(__file__), ".."))
+
+SCRIPTS_DIR = join(BASE_DIR, "scripts")
+
+NETLISTS_DIR = join(BASE_DIR, "netlists")
+MACHINES_DIR = join(BASE_DIR, "machines")
+PLACEMENTS_DIR = join(BASE_DIR, "placements")
+RESULTS_DIR = join(BASE_DIR, "results")
+
+# Content hashes of the inputs used to produce each output (used by --hash)
+STAMPS_FILE = join(BASE_DIR, ".run_stamps.json")
+
+# The placement algorithms used by default (as the original run.sh). Use
+# "--placers all" to use every available algorithm.
+DEFAULT_PLACERS = ["hilbert", "sa", "rand"]
+
+# The per-run result files which are merged into a top-level CSV
+RESULT_FILES = ["totals", "router_counters", "net_stats", "chip_stats",
+                "link_stats", "link_summary", "table_stats"]
+
+
+def list_names(directory, extensions=(".json", )):
+    """List the names of the JSON (or other) files in a directory, ignoring
+    timing sidecars."""
+    return sorted(set(splitext(basename(f))[0]
+                      for extension in extensions
+                      for f in glob(join(directory, "*" + extension))
+                      if not f.endswith(SIDECAR_SUFFIX)))
+
+
+def netlist_file(netlist):
+    """Get the filename of a netlist, preferring the binary version (see
+    binary_netlist.py) when one exists."""
+    binary_file = join(NETLISTS_DIR, "{}.bin".format(netlist))
+    if exists(binary_file):
+        return binary_file
+    return join(NETLISTS_DIR, "{}.json".format(netlist))
+
+
+def machine_file(machine):
+    return join(MACHINES_DIR, "{}.json".format(machine))
+
+
+def placement_file(placer, machine, netlist, extension=".json"):
+    return join(PLACEMENTS_DIR, placer, machine,
+                "{}{}".format(netlist, extension))
+
+
+def result_file(result, placer, machine, netlist):
+    return join(RESULTS_DIR, result, placer, machine, "{}.csv".format(netlist))
+
+
+class Stamps(object):
+    """Records the content hash of the inputs used to produce each output."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._digests = {}
+        self._stamps = {}
+        if exists(filename):
+            with open(filename, "r") as f:
+                self._stamps = json.load(f)
+
+    def inputs_digest(self, inputs):
+        """Get a single hash for the contents of a set of input files."""
+        h = hashlib.sha1()
+        for filename in inputs:
+            key = (filename, getmtime(filename))
+            if key not in self._digests:
+                self._digests[key] = file_digest(filename)
+            h.update(self._digests[key].encode("ascii"))
+        return h.hexdigest()
+
+    def is_up_to_date(self, inputs, outputs):
+        digest = self.inputs_digest(inputs)
+        return all(self._stamps.get(relpath(output)) == digest
+                   for output in outputs)
+
+    def record(self, inputs, outputs):
+        digest = self.inputs_digest(inputs)
+        for output in outputs:
+            self._stamps[relpath(output)] = digest
+
+    def save(self):
+        with open(self.filename, "w") as f:
+            json.dump(self._stamps, f, indent=1, sort_keys=True)
+
+
+def relpath(filename):
+    return os.path.relpath(filename, BASE_DIR)
+
+
+def is_up_to_date(inputs, outputs, stamps=None):
+    """Are all outputs present and produced from the current inputs?"""
+    if not all(exists(output) for output in outputs):
+        return False
+    elif stamps is not None:
+        return stamps.is_up_to_date(inputs, outputs)
+    else:
+        return (max(getmtime(i) for i in inputs) <=
+                min(getmtime(o) for o in outputs))
+
+
+class Job(object):
+    """A single step of the pipeline for a netlist, placer and machine.
+
+    Attributes
+    ----------
+    kind : "place", "analyse", "compress" or "experiment"
+    inputs : [filename, ...]
+        Files which, when changed, require the job to be re-run.
+    outputs : [filename, ...]
+        Files produced by the job.
+    depends_on : :py:class:`.Job` or None
+        A job which must be completed before this job may be started.
+    """
+
+    def __init__(self, kind, netlist, placer, machine, inputs, outputs,
+                 depends_on=None):
+        self.kind = kind
+        self.netlist = netlist
+        self.placer = placer
+        self.machine = machine
+        self.inputs = inputs
+        self.outputs = outputs
+        self.depends_on = depends_on
+
+    @property
+    def placement_file(self):
+        return placement_file(self.placer, self.machine, self.netlist)
+
+    @property
+    def skip_file(self):
+        return placement_file(self.placer, self.machine, self.netlist,
+                              ".skip")
+
+    def can_run(self):
+        """Are the inputs to this job available?"""
+        return all(exists(i) for i in self.inputs)
+
+    def is_up_to_date(self, stamps=None):
+        if self.kind == "place":
+            # Placements which do not fit are marked with a 'skip' file which
+            # also counts as an up-to-date output.
+            return (is_up_to_date(self.inputs, self.outputs, stamps) or
+                    is_up_to_date(self.inputs, [self.skip_file], stamps))
+        else:
+            return is_up_to_date(self.inputs, self.outputs, stamps)
+
+    def __str__(self):
+        return "'{}' on '{}' with '{}'".format(self.netlist, self.machine,
+                                             self.placer)
+
+
+def build_jobs(netlists, placers, machines, experiment_machines,
+               compress_tables=False):
+    """Construct the set of jobs required to place, analyse and experiment
+    with every netlist, placer and machine combination.
+
+    If compress_tables is True, routing table compression (see
+    table_compression.py) is also performed for every placement.
+    """
+    jobs = []
+    for netlist in netlists:
+        for placer in placers:
+            for machine in machines:
+                netlist_f = netlist_file(netlist)
+                machine_f = machine_file(machine)
+                placement_f = placement_file(placer, machine, netlist)
+
+                place = Job("place", netlist, placer, machine,
+                            [netlist_f, machine_f,
+                             join(SCRIPTS_DIR, "place.py")],
+                            [placement_f])
+                jobs.append(place)
+
+                jobs.append(Job("analyse", netlist, placer, machine,
+                                [netlist_f, placement_f, machine_f,
+                                 join(SCRIPTS_DIR, "static_analysis.py")],
+                                [result_file(result, placer, machine, netlist)
+                                 for result in ("net_stats", "chip_stats",
+                                                "link_stats",
+                                                "link_summary")],
+                                place))
+
+                if compress_tables:
+                    jobs.append(Job("compress", netlist, placer, machine,
+                                    [netlist_f, placement_f, machine_f,
+                                     join(SCRIPTS_DIR,
+                                          "table_compression.py")],
+                                    [result_file("table_stats",
+                                                 placer, machine, netlist)],
+                                    place))
+
+                if machine in experiment_machines:
+                    jobs.append(Job("experiment", netlist, placer, machine,
+                                    [netlist_f, placement_f, machine_f,
+                                     join(SCRIPTS_DIR, "experiment.py")],
+                                    [result_file("totals",
+                                                 placer, machine, netlist),
+                                     result_file("router_counters",
+                                                 placer, machine, netlist)],
+                                    place))
+    return jobs
+
+
+def _make_dirs(filenames):
+    for filename in filenames:
+        directory = dirname(filename)
+        if not exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another worker may have just created it
+                pass
+
+
+@contextmanager
+def _open_atomically(filenames):
+    """Open a set of files for writing such that they are either all complete
+    or not present."""
+    temp_files = ["{}.tmp{}".format(f, os.getpid()) for f in filenames]
+    files = []
+    try:
+        for temp_file in temp_files:
+            files.append(open(temp_file, "w"))
+        yield files
+        for f in files:
+            f.close()
+        for temp_file, filename in zip(temp_files, filenames):
+            os.rename(temp_file, filename)
+    finally:
+        for f in files:
+            f.close()
+        for temp_file in temp_files:
+            if exists(temp_file):
+                os.remove(temp_file)
+
+
+def _write_atomically(filename, data):
+    with _open_atomically([filename]) as (f, ):
+        f.write(data)
+
+
+def _load_inputs(job):
+    netlist = load_netlist(netlist_file(job.netlist))
+    hostname, machine = load_machine(machine_file(job.machine))
+    return netlist, hostname, machine
+
+
+def _place(job):
+    netlist, hostname, machine = _load_inputs(job)
+
+    if exists(job.skip_file):
+        os.remove(job.skip_file)
+    try:
+        placements = place_to_json(netlist["vertices_resources"],
+                                   netlist["nets"],
+                                   machine,
+                                   job.placer)
+    except InsufficientResourceError:
+        # Did not fit: mark as skipped and remove any obsolete placement
+        open(job.skip_file, "w").close()
+        if exists(job.placement_file):
+            os.remove(job.placement_file)
+        return
+
+    _write_atomically(job.placement_file, json.dumps(placements))
+
+
+def _analyse(job):
+    netlist, hostname, machine = _load_inputs(job)
+    placements = load_placements(job.placement_file, netlist)
+
+    with _open_atomically(job.outputs) as files:
+        measure_nets(job.netlist,
+                     netlist["vertices_resources"], netlist["nets"],
+                     placements["algorithm"],
+                     placements["placement_duration"],
+                     placements["placements"],
+                     job.machine, machine,
+                     *files,
+                     route_key=routes_key(netlist_file(job.netlist),
+                                          machine_file(job.machine),
+                                          job.placement_file))
+
+
+def _compress(job):
+    netlist, hostname, machine = _load_inputs(job)
+    placements = load_placements(job.placement_file, netlist)
+
+    # Worker processes may not have their own pool so the tables of each
+    # placement are compressed serially.
+    with _open_atomically(job.outputs) as (table_stats_file, ):
+        measure_tables(job.netlist,
+                       netlist["vertices_resources"], netlist["nets"],
+                       placements["algorithm"],
+                       placements["placement_duration"],
+                       placements["placements"],
+                       job.machine, machine,
+                       table_stats_file,
+                       processes=1,
+                       route_key=routes_key(netlist_file(job.netlist),
+                                            machine_file(job.machine),
+                                            job.placement_file))
+
+
+def _experiment(job):
+    # Imported here since network_tester is only required for experiments
+    from experiment import run_experiment
+
+    netlist, hostname, machine = _load_inputs(job)
+    placements = load_placements(job.placement_file, netlist)
+
+    totals, router_counters = \
+        run_experiment(job.netlist, netlist, placements,
+                       job.machine, machine, hostname)
+
+    totals_file, router_counters_file = job.outputs
+    _write_atomically(totals_file, totals)
+    _write_atomically(router_counters_file, router_counters)
+
+
+def run_job(job_id, job):
+    """Execute a job (in a worker process).
+
+    Returns
+    -------
+    (job_id, error)
+        error is None on success or a description of the failure otherwise.
+    """
+    try:
+        timer = start_timing()
+        _make_dirs(job.outputs)
+        {"place": _place,
+         "analyse": _analyse,
+         "compress": _compress,
+         "experiment": _experiment}[job.kind](job)
+        timer.write_sidecars(job.outputs)
+        return (job_id, None)
+    except (Exception, SystemExit):
+        return (job_id, traceback.format_exc())
+
+
+def run_jobs(jobs, processes=None, stamps=None):
+    """Run all out-of-date jobs, respecting their dependencies.
+
+    Returns the number of jobs which failed.
+    """
+    dependants = defaultdict(list)
+    for job in jobs:
+        if job.depends_on is not None:
+            dependants[job.depends_on].append(job)
+
+    job_ids = {job: job_id for job_id, job in enumerate(jobs)}
+
+    pool = Pool(processes)
+    experiment_pool = None
+
+    # Jobs whose dependencies have been satisfied
+    ready = deque(job for job in jobs if job.depends_on is None)
+
+    # Completion notifications (job_id, error) from the pools
+    completed = queue.Queue()
+    num_running = 0
+
+    # Machines which have failed during an experiment are not used for
+    # further experiments
+    dead_machines = set()
+    num_failed = 0
+
+    try:
+        while ready or num_running:
+            while ready:
+                job = ready.popleft()
+                if not job.can_run() or (job.kind == "experiment" and
+                                         job.machine in dead_machines):
+                    continue
+                elif job.is_up_to_date(stamps):
+                    ready.extend(dependants[job])
+                    continue
+
+                print("  {} {}".format(job.kind, job))
+                if job.kind == "experiment":
+                    if experiment_pool is None:
+                        experiment_pool = Pool(1)
+                    job_pool = experiment_pool
+                else:
+                    job_pool = pool
+                job_pool.apply_async(run_job, (job_ids[job], job),
+                                     callback=completed.put)
+                num_running += 1
+
+            if num_running:
+                job_id, error = completed.get()
+                num_running -= 1
+                job = jobs[job_id]
+
+                if error is None:
+                    if stamps is not None:
+                        if job.kind == "place" and exists(job.skip_file):
+                            stamps.record(job.inputs, [job.skip_file])
+                        else:
+                            stamps.record(job.inputs, job.outputs)
+                    ready.extend(dependants[job])
+                else:
+                    num_failed += 1
+                    sys.stderr.write("ERROR: {} {} failed:\n{}".format(
+                        job.kind, job, error))
+                    if job.kind == "experiment":
+                        dead_machines.add(job.machine)
+    finally:
+        for p in (pool, experiment_pool):
+            if p is not None:
+                p.close()
+                p.join()
+        if stamps is not None:
+            stamps.save()
+
+    return num_failed
+
+
+def merge_results(netlists, placers, machines):
+    """Collate the per-run results files into top-level CSVs."""
+    for result in RESULT_FILES:
+        global_file = join(RESULTS_DIR, "{}.csv".format(result))
+        if exists(global_file):
+            os.remove(global_file)
+
+        header_written = False
+        for netlist in netlists:
+            for placer in placers:
+                for machine in machines:
+                    specific_file = result_file(result,
+                                                placer, machine, netlist)
+                    # Skip experiments which don't exist
+                    if not exists(specific_file):
+                        continue
+
+                    with open(specific_file, "r") as fin:
+                        header = fin.readline()
+                        with open(global_file, "a") as fout:
+                            # Only the first file has its CSV heading kept
+                            if not header_written:
+                                fout.write(header)
+                                header_written = True
+                            for line in fin:
+                                fout.write(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Place, analyse and run experiments on any new or "
+                    "modified netlists.")
+
+    parser.add_argument("machines", metavar="MACHINE", nargs="*",
+                        help="Machines to run experiments on. If none are "
+                             "given, only placement and static analysis "
+                             "are performed.")
+
+    parser.add_argument("--processes", "-j", type=int, default=cpu_count(),
+                        help="Number of worker processes to use for "
+                             "placement and static analysis.")
+
+    parser.add_argument("--placers", "-p", metavar="PLACER", nargs="+",
+                        help="Placement algorithms to use, or 'all' for "
+                             "every available algorithm (default: "
+                             "{}).".format(" ".join(DEFAULT_PLACERS)))
+
+    parser.add_argument("--hash", action="store_true",
+                        help="Re-run jobs only when the content of their "
+                             "inputs changes rather than when inputs are "
+                             "modified more recently than the outputs.")
+
+    parser.add_argument("--compress-tables", action="store_true",
+                        help="Also compress the routing tables of every "
+                             "placement and report their headroom (see "
+                             "table_compression.py).")
+
+    args = parser.parse_args(argv)
+
+    netlists = list_names(NETLISTS_DIR, (".json", ".bin"))
+    all_machines = list_names(MACHINES_DIR)
+    if args.placers is None:
+        placers = DEFAULT_PLACERS
+    elif "all" in args.placers:
+        placers = available_placers()
+    else:
+        placers = args.placers
+
+    for machine in args.machines:
+        if machine not in all_machines:
+            sys.stderr.write("ERROR: Unknown machine '{}'\n".format(machine))
+            return 1
+
+    stamps = Stamps(STAMPS_FILE) if args.hash else None
+
+    print("Placing, analysing and running experiments on {} machines..."
+          .format(len(args.machines)))
+    jobs = build_jobs(netlists, placers, all_machines, set(args.machines),
+                      args.compress_tables)
+    num_failed = run_jobs(jobs, args.processes, stamps)
+
+    print("Merging results...")
+    merge_results(netlists, placers, all_machines)
+
+    print("Updating results store...")
+    for result in RESULT_FILES:
+        update_store(result, RESULTS_DIR)
+
+    return 1 if num_failed else 0
+
+
+if __name__=="__main__":
+    sys.exit(main(sys.argv[1:]))
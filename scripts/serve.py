@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+"""A long-running service which places and analyses netlists from warm state.
+
+Running place.py or static_analysis.py once per job pays Python start-up,
+import and input-loading costs every time. This service instead keeps the
+netlists and machines it has loaded in memory (reloading files only when they
+change) and answers jobs given as JSON objects, one per line, either on stdin
+(with responses on stdout) or via a Unix domain socket.
+
+Requests have the form ``{"id": ..., "command": ..., ...}`` where "id" is
+optional and is echoed in the response. The commands are:
+
+* ``{"command": "load", "netlists": [filename, ...],
+  "machines": [filename, ...]}``: Preload netlists and machines.
+* ``{"command": "place", "netlist": filename, "machine": filename,
+  "algorithm": name, "seed": seed, "metrics": bool}``: Place a netlist.
+  "algorithm" (default: "default"), "seed" and "metrics" are optional. The
+  result is the placement in the same format as produced by place.py.
+* ``{"command": "analyse", "netlist": filename, "machine": filename,
+  "placements": filename}``: Statically analyse a placement, as
+  static_analysis.py. Instead of a filename, the placements may be given
+  inline (e.g. the result of a "place" command) as "placements_json". The
+  result is ``{"net_stats": csv, "chip_stats": csv, "link_stats": csv,
+  "link_summary": csv}``.
+* ``{"command": "status"}``: The result lists the loaded netlists and
+  machines.
+* ``{"command": "shutdown"}``: Stop the service.
+
+Responses have the form ``{"id": ..., "result": ..., "duration": seconds}`` or,
+when a request fails, ``{"id": ..., "error": message}``. Placements which do
+not fit are reported as an error with ``"insufficient_resources": true``.
+"""
+
+import argparse
+
+import inspect
+
+import json
+
+import os
+
+import sys
+
+import time
+
+import traceback
+
+from os.path import basename, exists, splitext
+
+from six import iteritems
+from six.moves import StringIO, socketserver
+
+from rig.place_and_route.exceptions import InsufficientResourceError
+
+from netlist_to_json import load_netlist
+from place import get_placer, place_to_json
+from netlist_core import Placements
+from cache import load_machine, cached_file_digest
+from static_analysis import measure_nets
+from route_cache import routes_key
+
+
+class RequestError(Exception):
+    """An invalid request."""
+
+
+class PlacementService(object):
+    """Places and analyses netlists, keeping loaded inputs in memory."""
+
+    def __init__(self):
+        # Loaded netlists {filename: (digest, netlist), ...}
+        self._netlists = {}
+        # Loaded machine filenames (the machines are kept by cache.py)
+        self._machines = set()
+        self.stopped = False
+
+    def netlist(self, filename):
+        """Get a netlist, loading it only if it is new or has changed."""
+        digest = cached_file_digest(filename)
+        loaded = self._netlists.get(filename)
+        if loaded is None or loaded[0] != digest:
+            loaded = self._netlists[filename] = (digest,
+                                                 load_netlist(filename))
+        return loaded[1]
+
+    def machine(self, filename):
+        """Get a (hostname, Machine) pair."""
+        self._machines.add(filename)
+        return load_machine(filename)
+
+    def load(self, netlists=None, machines=None):
+        for filename in netlists or []:
+            self.netlist(filename)
+        for filename in machines or []:
+            self.machine(filename)
+        return self.status()
+
+    def place(self, netlist, machine, algorithm="default", seed=None,
+              metrics=False):
+        if get_placer(algorithm) is None:
+            raise RequestError(
+                "Placement algorithm {} does not exist".format(algorithm))
+        loaded_netlist = self.netlist(netlist)
+        hostname, loaded_machine = self.machine(machine)
+        return place_to_json(loaded_netlist["vertices_resources"],
+                             loaded_netlist["nets"],
+                             loaded_machine, algorithm, seed, metrics)
+
+    def analyse(self, netlist, machine, placements=None,
+                placements_json=None):
+        if (placements is None) == (placements_json is None):
+            raise RequestError(
+                "Exactly one of placements or placements_json must be given")
+        loaded_netlist = self.netlist(netlist)
+        hostname, loaded_machine = self.machine(machine)
+        if placements is not None:
+            with open(placements, "r") as f:
+                placements_json = json.load(f)
+            route_key = routes_key(netlist, machine, placements)
+        else:
+            route_key = None
+        loaded_placements = Placements.from_json(placements_json,
+                                                 loaded_netlist)
+
+        files = [StringIO() for _ in range(4)]
+        measure_nets(splitext(basename(netlist))[0],
+                     loaded_netlist["vertices_resources"],
+                     loaded_netlist["nets"],
+                     loaded_placements["algorithm"],
+                     loaded_placements["placement_duration"],
+                     loaded_placements["placements"],
+                     splitext(basename(machine))[0], loaded_machine,
+                     *files, route_key=route_key)
+        return {name: f.getvalue()
+                for name, f in zip(["net_stats", "chip_stats",
+                                    "link_stats", "link_summary"], files)}
+
+    def status(self):
+        return {"netlists": sorted(self._netlists),
+                "machines": sorted(self._machines)}
+
+    def shutdown(self):
+        self.stopped = True
+
+    def handle(self, request):
+        """Handle a decoded request, returning the response."""
+        if not isinstance(request, dict):
+            return {"error": "Requests must be JSON objects"}
+        response = {"id": request.get("id")}
+        arguments = {k: v for k, v in iteritems(request)
+                     if k not in ("id", "command")}
+        command = {"load": self.load,
+                   "place": self.place,
+                   "analyse": self.analyse,
+                   "status": self.status,
+                   "shutdown": self.shutdown}.get(request.get("command"))
+
+        before = time.time()
+        try:
+            if command is None:
+                raise RequestError(
+                    "Unknown command {}".format(request.get("command")))
+            try:
+                inspect.signature(command).bind(**arguments)
+            except TypeError as e:
+                raise RequestError("Invalid arguments for {}: {}".format(
+                    request.get("command"), e))
+            response["result"] = command(**arguments)
+        except InsufficientResourceError as e:
+            response["error"] = str(e)
+            response["insufficient_resources"] = True
+        except (RequestError, IOError, OSError) as e:
+            # Invalid requests
+            response["error"] = str(e)
+        except Exception:
+            response["error"] = traceback.format_exc()
+        response["duration"] = time.time() - before
+        return response
+
+
+def serve_lines(service, readline, write):
+    """Handle requests, one JSON object per line, until EOF or shutdown.
+
+    Parameters
+    ----------
+    readline : f() -> str
+        Returns the next line or "" at EOF.
+    write : f(str)
+        Writes a response line.
+    """
+    while not service.stopped:
+        line = readline()
+        if not line:
+            break
+        elif not line.strip():
+            continue
+
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {"id": None, "error": "Invalid JSON: {}".format(e)}
+        else:
+            response = service.handle(request)
+        write(json.dumps(response) + "\n")
+
+
+def serve_socket(service, socket_filename):
+    """Serve requests from connections to a Unix domain socket, one at a
+    time."""
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            def write(data):
+                self.wfile.write(data.encode("utf-8"))
+                self.wfile.flush()
+            serve_lines(service,
+                        lambda: self.rfile.readline().decode("utf-8"),
+                        write)
+
+    if exists(socket_filename):
+        os.remove(socket_filename)
+    server = socketserver.UnixStreamServer(socket_filename, Handler)
+    try:
+        while not service.stopped:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(socket_filename)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(
+        description="Place and analyse netlists from warm state, taking "
+                    "JSON-lines requests on stdin (or a Unix socket).")
+    parser.add_argument("--socket", "-s", metavar="FILENAME",
+                        help="Listen on a Unix domain socket rather than "
+                             "stdin.")
+    parser.add_argument("--netlist", "-n", metavar="FILENAME",
+                        action="append", default=[],
+                        help="Preload a netlist (may be repeated).")
+    parser.add_argument("--machine", "-m", metavar="FILENAME",
+                        action="append", default=[],
+                        help="Preload a machine (may be repeated).")
+    args = parser.parse_args()
+
+    service = PlacementService()
+    service.load(args.netlist, args.machine)
+
+    if args.socket is not None:
+        serve_socket(service, args.socket)
+    else:
+        def write(data):
+            sys.stdout.write(data)
+            sys.stdout.flush()
+        serve_lines(service, sys.stdin.readline, write)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+
+"""Estimate the results of a network experiment using a software traffic model
+rather than SpiNNaker hardware.
+
+The experiment performed by experiment.py is reproduced using a simple
+steady-state flow model of the routed network:
+
+* Every net's source injects packets at the rate set by the experiment's
+  injection rate and the net's weight. If the total traffic entering a router
+  exceeds ROUTER_CAPACITY, the locally injected packets are blocked in
+  proportion.
+* Every link carries at most LINK_CAPACITY packets per second. Traffic beyond
+  this is dropped by the router, each branch of a multicast route being
+  treated independently.
+* When packet reinjection is enabled, up to REINJECTION_CAPACITY dropped
+  packets per second per chip are reinjected, adding to the load of the link
+  they were dropped from, and are then delivered.
+
+Since the acceptance of each link and router depends on the traffic offered to
+it (which in turn depends on the acceptance of the links upstream), the model
+is iterated until it reaches a fixed point. Every iteration is a handful of
+vectorised operations over flat arrays of every hop in every route.
+
+The resulting CSVs have the same columns as the totals and router_counters
+produced by experiment.py (the deadlines_missed and retried counters are not
+modelled and are always zero). The figures are estimates only and are
+intended for pre-screening placements and for regression testing without a
+machine.
+"""
+
+import argparse
+
+from array import array
+
+from math import ceil
+
+from os.path import splitext, basename
+
+import numpy as np
+
+from six import iteritems
+
+from rig.place_and_route.routing_tree import RoutingTree
+
+from netlist_to_json import load_netlist
+from netlist_core import load_placements
+from cache import load_machine
+from route_cache import cached_route_netlist, routes_key
+from profiling import phase, start_timing
+
+
+# The number of graduations in injection rate (as in experiment.py)
+NUM_STEPS = 30
+MAX_PACKETS_PER_TIMESTEP = 60
+
+# The experiment's timestep and duration (seconds, as in experiment.py)
+TIMESTEP = 1e-3
+DURATION = 0.1
+
+# Approximate capacities, in packets per second
+LINK_CAPACITY = 6.25e6
+ROUTER_CAPACITY = 20e6
+REINJECTION_CAPACITY = 1e6
+
+# Fixed-point iteration parameters
+MAX_ITERATIONS = 200
+TOLERANCE = 1e-6
+DAMPING = 0.5
+
+# The label columns added to every group by experiment.py
+LABELS = ["netlist", "reinject_packets", "machine", "placer",
+          "placement_duration", "injection_rate", "duration"]
+
+# The counter columns of the totals and router_counters results
+TOTALS_COUNTERS = ["deadlines_missed", "local_multicast",
+                   "external_multicast", "dropped_multicast", "reinjected",
+                   "sent", "blocked", "retried", "received", "ideal_received"]
+ROUTER_COUNTERS = ["local_multicast", "external_multicast",
+                   "dropped_multicast", "reinjected"]
+
+
+class RoutedNetwork(object):
+    """Flat array representation of a set of routes.
+
+    Attributes
+    ----------
+    num_chips : int
+        The number of chips (width * height). Chip (x, y) has index x * height
+        + y and its links have indices chip * 6 + link.
+    net_chip : np.ndarray
+        The index of the chip each net's source is on.
+    num_sinks : np.ndarray
+        The number of sinks of each net.
+    hop_net, hop_parent, hop_chip, hop_link, hop_dest : np.ndarray
+        For every hop in every route (in order of distance from the source),
+        the index of the net, of the previous hop in the route (-1 for the
+        first hop), of the chip the hop leaves, of the link used and of the
+        chip arrived at.
+    levels : [slice, ...]
+        Slices of the hop arrays containing the hops at each distance from
+        the source (parents always precede their children).
+    sink_net, sink_hop : np.ndarray
+        For every sink of every net, the net index and the hop which delivers
+        packets to the sink's chip (-1 for sinks on the source's chip).
+    """
+
+    def __init__(self, nets, routes, machine):
+        height = machine.height
+        self.num_chips = machine.width * height
+
+        net_index = {net: i for i, net in enumerate(nets)}
+        self.net_chip = np.zeros(len(nets), dtype=np.int64)
+        self.num_sinks = np.array([len(net.sinks) for net in nets],
+                                  dtype=np.int64)
+
+        hop_net = array("l")
+        hop_parent = array("l")
+        hop_depth = array("l")
+        hop_chip = array("l")
+        hop_link = array("l")
+        hop_dest = array("l")
+        sink_net = array("l")
+        sink_hop = array("l")
+        for net, routing_tree in iteritems(routes):
+            n = net_index[net]
+            x, y = routing_tree.chip
+            self.net_chip[n] = x * height + y
+
+            # (node, hop which reached node, depth)
+            to_visit = [(routing_tree, -1, 0)]
+            while to_visit:
+                node, parent, depth = to_visit.pop()
+                x, y = node.chip
+                chip = x * height + y
+                for link, child in node.children:
+                    if isinstance(child, RoutingTree):
+                        cx, cy = child.chip
+                        hop = len(hop_net)
+                        hop_net.append(n)
+                        hop_parent.append(parent)
+                        hop_depth.append(depth)
+                        hop_chip.append(chip)
+                        hop_link.append(chip * 6 + int(link))
+                        hop_dest.append(cx * height + cy)
+                        to_visit.append((child, hop, depth + 1))
+                    else:
+                        sink_net.append(n)
+                        sink_hop.append(parent)
+
+        # Sort hops by depth so that every parent precedes its children
+        depth = np.asarray(hop_depth, dtype=np.int64)
+        order = np.argsort(depth, kind="stable")
+        new_index = np.empty(len(order) + 1, dtype=np.int64)
+        new_index[order] = np.arange(len(order))
+        new_index[-1] = -1  # Maps -1 (no parent) to itself
+
+        def reorder(hop_array):
+            return np.asarray(hop_array, dtype=np.int64)[order]
+
+        self.hop_net = reorder(hop_net)
+        self.hop_parent = new_index[reorder(hop_parent)]
+        self.hop_chip = reorder(hop_chip)
+        self.hop_link = reorder(hop_link)
+        self.hop_dest = reorder(hop_dest)
+        self.sink_net = np.asarray(sink_net, dtype=np.int64)
+        self.sink_hop = new_index[np.asarray(sink_hop, dtype=np.int64)]
+
+        boundaries = np.searchsorted(depth[order],
+                                     np.arange(depth.max() + 2
+                                               if len(depth) else 0))
+        self.levels = [slice(start, end)
+                       for start, end in zip(boundaries, boundaries[1:])]
+
+
+def simulate(network, offered, reinject_packets,
+             link_capacity=LINK_CAPACITY, router_capacity=ROUTER_CAPACITY,
+             reinjection_capacity=REINJECTION_CAPACITY):
+    """Estimate the steady-state packet rates in a routed network.
+
+    Parameters
+    ----------
+    network : RoutedNetwork
+    offered : np.ndarray
+        The rate (packets per second) at which each net's source attempts to
+        send packets.
+    reinject_packets : bool
+
+    Returns
+    -------
+    {counter: value or np.ndarray, ...}
+        "sent", "blocked", "received" and "ideal_received" give network-wide
+        packet rates. "local_multicast", "external_multicast",
+        "dropped_multicast" and "reinjected" give per-chip packet rates.
+    """
+    num_chips = network.num_chips
+    hop_net = network.hop_net
+    hop_parent = network.hop_parent
+    hop_chip = network.hop_chip
+    hop_link = network.hop_link
+    hop_dest = network.hop_dest
+    first_hop = hop_parent < 0
+
+    local_offered = np.bincount(network.net_chip, weights=offered,
+                                minlength=num_chips)
+
+    link_accept = np.ones(num_chips * 6)
+    local_accept = np.ones(num_chips)
+    reinject_fraction = np.zeros(num_chips)
+
+    arriving = np.zeros(len(hop_net))
+    passing = np.zeros(len(hop_net))
+    for _ in range(MAX_ITERATIONS):
+        injected = offered * local_accept[network.net_chip]
+
+        # Propagate traffic along every route, one hop-distance at a time
+        hop_accept = link_accept[hop_link]
+        hop_pass = (hop_accept +
+                    (1.0 - hop_accept) * reinject_fraction[hop_chip])
+        for level in network.levels:
+            arriving[level] = np.where(first_hop[level],
+                                       injected[hop_net[level]],
+                                       passing[hop_parent[level]])
+            passing[level] = arriving[level] * hop_pass[level]
+
+        dropped = arriving * (1.0 - hop_accept)
+        reinjected = dropped * reinject_fraction[hop_chip]
+
+        # Reinjected packets make a second attempt at the same link
+        link_load = np.bincount(hop_link, weights=arriving + reinjected,
+                                minlength=num_chips * 6)
+        new_link_accept = np.minimum(
+            1.0, link_capacity / np.maximum(link_load, 1e-12))
+
+        if reinject_packets:
+            chip_dropped = np.bincount(hop_chip, weights=dropped,
+                                       minlength=num_chips)
+            new_reinject_fraction = np.minimum(
+                1.0, reinjection_capacity / np.maximum(chip_dropped, 1e-12))
+        else:
+            new_reinject_fraction = reinject_fraction
+
+        # Locally injected packets only get whatever router bandwidth is left
+        # by the arriving traffic
+        external = np.bincount(hop_dest, weights=passing,
+                               minlength=num_chips)
+        new_local_accept = np.clip(
+            (router_capacity - external) / np.maximum(local_offered, 1e-12),
+            0.0, 1.0)
+
+        change = max(np.abs(new_link_accept - link_accept).max(),
+                     np.abs(new_reinject_fraction - reinject_fraction).max(),
+                     np.abs(new_local_accept - local_accept).max())
+        link_accept += DAMPING * (new_link_accept - link_accept)
+        reinject_fraction += DAMPING * (new_reinject_fraction -
+                                        reinject_fraction)
+        local_accept += DAMPING * (new_local_accept - local_accept)
+        if change < TOLERANCE:
+            break
+
+    sink_hop = network.sink_hop
+    received = injected[network.sink_net]
+    remote = sink_hop >= 0
+    received[remote] = passing[sink_hop[remote]]
+
+    return {
+        "sent": injected.sum(),
+        "blocked": (offered - injected).sum(),
+        "received": received.sum(),
+        "ideal_received": np.dot(offered, network.num_sinks),
+        "local_multicast": np.bincount(network.net_chip, weights=injected,
+                                       minlength=num_chips),
+        "external_multicast": np.bincount(hop_dest, weights=passing,
+                                          minlength=num_chips),
+        "dropped_multicast": np.bincount(hop_chip, weights=dropped,
+                                         minlength=num_chips),
+        "reinjected": np.bincount(hop_chip, weights=reinjected,
+                                  minlength=num_chips),
+    }
+
+
+def _to_csv(header, rows):
+    """Render rows in the same style as network_tester.to_csv."""
+    return "\n".join([",".join(header)] +
+                     [",".join(map(str, row)) for row in rows]) + "\n"
+
+
+def simulate_experiment(netlist_name, vertices_resources, nets,
+                        placement_algorithm, placement_duration, placements,
+                        machine_name, machine, route_key=None,
+                        **capacities):
+    """Estimate the results of experiment.run_experiment.
+
+    Any capacities given are passed to simulate. If a route_key (see
+    route_cache.routes_key) is given, cached routes are used when available.
+
+    Returns
+    -------
+    (totals, router_counters)
+        CSV strings with the same columns as those produced by
+        experiment.run_experiment.
+    """
+    allocations, routes, routing_tables = cached_route_netlist(
+        route_key, vertices_resources, nets, machine, placements)
+    network = RoutedNetwork(nets, routes, machine)
+    weights = np.array([net.weight for net in nets], dtype=float)
+    max_weight = weights.max()
+
+    # Chips in the order network_tester reports them (by row, then column)
+    chips = sorted(machine, key=lambda xy: (xy[1], xy[0]))
+    chip_indices = np.array([x * machine.height + y for x, y in chips],
+                            dtype=np.int64)
+
+    totals = []
+    router_counters = []
+    group = 0
+    for reinject_packets in [False, True]:
+        for step in range(NUM_STEPS):
+            ppts = (((step + 1) / float(NUM_STEPS)) *
+                    MAX_PACKETS_PER_TIMESTEP)
+
+            # As in experiment.py, the most highly weighted net sends ppts
+            # packets per timestep on average.
+            packets_per_timestep = int(ceil(ppts))
+            probability = (ppts / packets_per_timestep) / max_weight
+            offered = (packets_per_timestep * probability * weights /
+                       TIMESTEP)
+
+            result = simulate(network, offered, reinject_packets,
+                              **capacities)
+            # Whole numbers of packets but, as network_tester's results,
+            # given as doubles
+            counts = {counter: np.rint(value * DURATION)
+                      for counter, value in iteritems(result)}
+
+            labels = [netlist_name, reinject_packets, machine_name,
+                      placement_algorithm, placement_duration,
+                      ppts / TIMESTEP, DURATION]
+
+            totals.append(
+                labels + [group, DURATION] +
+                [counts[c].sum() if c in counts else 0.0
+                 for c in TOTALS_COUNTERS])
+
+            for (x, y), chip in zip(chips, chip_indices):
+                router_counters.append(
+                    labels + [group, DURATION, float(x), float(y)] +
+                    [counts[c][chip] for c in ROUTER_COUNTERS])
+
+            group += 1
+
+    return (_to_csv(LABELS + ["group", "time"] + TOTALS_COUNTERS, totals),
+            _to_csv(LABELS + ["group", "time", "x", "y"] + ROUTER_COUNTERS,
+                    router_counters))
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(
+        description="Estimate the results of a network experiment using a "
+                    "software traffic model.")
+    parser.add_argument("netlist", metavar="NETLIST")
+    parser.add_argument("placements", metavar="PLACEMENTS")
+    parser.add_argument("machine", metavar="MACHINE")
+    parser.add_argument("totals", metavar="TOTALS")
+    parser.add_argument("router_counters", metavar="ROUTER_COUNTERS")
+    parser.add_argument("--link-capacity", type=float, default=LINK_CAPACITY,
+                        help="Packets per second each link can carry "
+                             "(default: %(default)s).")
+    parser.add_argument("--router-capacity", type=float,
+                        default=ROUTER_CAPACITY,
+                        help="Packets per second each router can route "
+                             "(default: %(default)s).")
+    parser.add_argument("--reinjection-capacity", type=float,
+                        default=REINJECTION_CAPACITY,
+                        help="Packets per second each chip can reinject "
+                             "(default: %(default)s).")
+    args = parser.parse_args()
+
+    timer = start_timing()
+    netlist_name = splitext(basename(args.netlist))[0]
+    netlist = load_netlist(args.netlist)
+    with phase("load_placements"):
+        placements = load_placements(args.placements, netlist)
+    machine_name = splitext(basename(args.machine))[0]
+    hostname, machine = load_machine(args.machine)
+
+    totals, router_counters = \
+        simulate_experiment(netlist_name,
+                            netlist["vertices_resources"], netlist["nets"],
+                            placements["algorithm"],
+                            placements["placement_duration"],
+                            placements["placements"],
+                            machine_name, machine,
+                            route_key=routes_key(args.netlist, args.machine,
+                                                 args.placements),
+                            link_capacity=args.link_capacity,
+                            router_capacity=args.router_capacity,
+                            reinjection_capacity=args.reinjection_capacity)
+
+    with open(args.totals, "w") as f:
+        f.write(totals)
+    with open(args.router_counters, "w") as f:
+        f.write(router_counters)
+    timer.write_sidecars([args.totals, args.router_counters])
@@ -1,111 +1,286 @@
 #!/usr/bin/env python
 
-"""Calculate routing metrics for a placement."""
+"""Calculate routing metrics for a placement.
+
+With --batch, many placements of the same netlist on the same machine are
+analysed in parallel (see analyse_batch) and the results combined into one
+set of CSV files.
+"""
 
 import sys
 
-from collections import defaultdict
+import csv
 
-from os.path import splitext, basename
+import argparse
 
-from six import iteritems
+from multiprocessing import Pool
 
-from rig.machine import Cores
+from collections import defaultdict
 
-from rig.place_and_route import allocate, route
-from rig.place_and_route.utils import build_routing_tables
+from os.path import splitext, basename
 
-from rig.place_and_route.constraints import ReserveResourceConstraint
+from six import iteritems
+from six.moves import StringIO
 
 from rig.place_and_route.routing_tree import RoutingTree
 
-import json
+from netlist_to_json import load_netlist
+from netlist_core import load_placements
+from cache import load_machine
+from route_cache import cached_route_netlist, routes_key
+from profiling import phase, start_timing
+from link_load import link_loads, working_links, \
+    write_link_stats, write_link_summary
 
-from netlist_to_json import json_to_netlist
-from place import json_to_placements
-from machine_to_json import json_to_machine
+
+# Label columns included in every results file
+STD_HEADER = ["netlist", "machine", "placer", "placement_duration"]
 
 
 def measure_nets(netlist_name, vertices_resources, nets,
                  placement_algorithm, placement_duration, placements,
-                 machine_name, machine):
-    constraints = [ReserveResourceConstraint(Cores, slice(0, 2))]
+                 machine_name, machine, per_net_file, per_chip_file,
+                 per_link_file=None, link_summary_file=None,
+                 route_key=None):
+    """Route a placed netlist and write per-net and per-chip statistics as
+    CSV into the supplied file objects.
     
-    # Route the nets
-    allocations = allocate(vertices_resources, nets, machine, constraints,
-                           placements)
-    routes = route(vertices_resources, nets, machine, constraints, placements,
-                   allocations)
+    If supplied, the load on every link and a summary of the link loads are
+    also written as CSV into per_link_file and link_summary_file.
     
-    routing_tables = build_routing_tables(routes,
-                                          {n: (k, -1)
-                                           for k, n in enumerate(nets)})
+    If a route_key (see route_cache.routes_key) is given, cached routes are
+    used when available.
+    """
+    # Route the nets
+    allocations, routes, routing_tables = cached_route_netlist(
+        route_key, vertices_resources, nets, machine, placements)
     
     # Standard columns
-    std_header = "netlist,machine,placer,placement_duration"
-    std_cols = "{},{},{},{}".format(netlist_name,
-                                    machine_name,
-                                    placement_algorithm,
-                                    placement_duration)
+    std_cols = [netlist_name,
+                machine_name,
+                placement_algorithm,
+                placement_duration]
     
-    # Create per-net summary
-    per_net_csv = "{},net,fan_out,total_hops\n".format(std_header)
-    for net, routing_tree in iteritems(routes):
-        index = nets.index(net)
-        fan_out = len(net.sinks)
-        total_hops = len(list(routing_tree))
-        per_net_csv += "{},{},{},{}\n".format(std_cols,
-                                              index,
-                                              fan_out,
-                                              total_hops)
+    with phase("write_route_stats"):
+        write_route_stats(std_cols, nets, routes, routing_tables, machine,
+                          per_net_file, per_chip_file)
     
-    # Create per-chip summary
-    per_chip_csv = "{},x,y,routing_table_entries,num_nets,total_weight\n".format(std_header)
+    # Model the load on each link
+    if per_link_file is not None or link_summary_file is not None:
+        with phase("link_loads"):
+            loads = link_loads(routes, machine)
+            mask = working_links(machine)
+        if per_link_file is not None:
+            with phase("write_link_stats"):
+                write_link_stats(STD_HEADER, std_cols, loads, mask,
+                                 per_link_file)
+        if link_summary_file is not None:
+            with phase("write_link_summary"):
+                write_link_summary(STD_HEADER, std_cols, loads, mask,
+                                   link_summary_file)
+
+
+def write_route_stats(std_cols, nets, routes, routing_tables, machine,
+                      per_net_file, per_chip_file):
+    """Write per-net and per-chip routing statistics as CSV.
+    
+    Each routing tree is traversed exactly once, with the per-net rows being
+    streamed out as they are produced and the per-chip totals accumulated
+    along the way.
+    """
+    net_indices = {net: index for index, net in enumerate(nets)}
+    
+    # Create per-net summary
+    per_net_csv = csv.writer(per_net_file, lineterminator="\n")
+    per_net_csv.writerow(STD_HEADER + ["net", "fan_out", "total_hops"])
     chip_num_nets = defaultdict(lambda: 0)
     chip_total_weight = defaultdict(lambda: 0.0)
     for net, routing_tree in iteritems(routes):
+        total_hops = 0
         for node in routing_tree:
+            total_hops += 1
             if isinstance(node, RoutingTree):
                 chip_num_nets[node.chip] += 1
                 chip_total_weight[node.chip] += net.weight
+        per_net_csv.writerow(std_cols + [net_indices[net],
+                                         len(net.sinks),
+                                         total_hops])
+    
+    # Create per-chip summary
+    per_chip_csv = csv.writer(per_chip_file, lineterminator="\n")
+    per_chip_csv.writerow(STD_HEADER + ["x", "y", "routing_table_entries",
+                                        "num_nets", "total_weight"])
     for x, y in machine:
-        routing_table_entries = len(routing_tables[(x, y)])
-        per_chip_csv += "{},{},{},{},{},{}\n".format(std_cols,
-                                               x, y,
-                                               routing_table_entries,
-                                               chip_num_nets[(x, y)],
-                                               chip_total_weight[(x, y)])
+        routing_table_entries = len(routing_tables.get((x, y), ()))
+        per_chip_csv.writerow(std_cols + [x, y,
+                                          routing_table_entries,
+                                          chip_num_nets[(x, y)],
+                                          chip_total_weight[(x, y)]])
+
+
+# The netlist and machine being analysed by a batch worker process. These are
+# set before the worker pool is forked so that each worker shares the parent's
+# copy (including the Rig objects) rather than re-loading its own.
+_batch_netlist = None
+_batch_machine = None
+_batch_names = None
+_batch_link_stats = False
+
+
+def _batch_measure(placements_filename):
+    """Analyse one placement of the batch's netlist in a worker process.
+    
+    Returns
+    -------
+    [csv, ...]
+        The per-net, per-chip and (if requested) per-link and link summary
+        CSVs.
+    """
+    netlist_filename, netlist_name, machine_filename, machine_name = \
+        _batch_names
+    with phase("load_placements"):
+        placements = load_placements(placements_filename, _batch_netlist)
+    
+    files = [StringIO() for _ in range(4 if _batch_link_stats else 2)]
+    measure_nets(netlist_name,
+                 _batch_netlist["vertices_resources"],
+                 _batch_netlist["nets"],
+                 placements["algorithm"],
+                 placements["placement_duration"],
+                 placements["placements"],
+                 machine_name, _batch_machine,
+                 *files,
+                 route_key=routes_key(netlist_filename, machine_filename,
+                                      placements_filename))
+    return [f.getvalue() for f in files]
+
+
+def analyse_batch(netlist_filename, machine_filename, placements_filenames,
+                  per_net_file, per_chip_file, per_link_file=None,
+                  link_summary_file=None, processes=None):
+    """Route and analyse many placements of a netlist in parallel, writing
+    combined statistics as CSV into the supplied file objects.
+    
+    The netlist and machine are loaded just once and shared between a pool of
+    worker processes, each of which routes (or fetches from the route cache)
+    and measures one placement at a time. The rows for each placement are
+    written (in the order the placements are given) under a single header,
+    with the usual label columns distinguishing the placements.
+    """
+    global _batch_netlist, _batch_machine, _batch_names, _batch_link_stats
+    
+    netlist_name = splitext(basename(netlist_filename))[0]
+    machine_name = splitext(basename(machine_filename))[0]
+    
+    _batch_netlist = load_netlist(netlist_filename)
+    # Build the Rig objects before forking so that workers share them
+    _batch_netlist.to_rig()
+    hostname, _batch_machine = load_machine(machine_filename)
+    _batch_names = (netlist_filename, netlist_name,
+                    machine_filename, machine_name)
+    _batch_link_stats = (per_link_file is not None or
+                         link_summary_file is not None)
+    
+    files = [per_net_file, per_chip_file]
+    if _batch_link_stats:
+        files += [per_link_file, link_summary_file]
     
-    return (per_net_csv, per_chip_csv)
+    pool = Pool(processes)
+    try:
+        for i, results in enumerate(pool.imap(_batch_measure,
+                                              placements_filenames)):
+            with phase("write_results"):
+                for f, data in zip(files, results):
+                    if f is None:
+                        continue
+                    if i > 0:
+                        # Drop the header
+                        data = data.split("\n", 1)[1]
+                    f.write(data)
+    finally:
+        pool.close()
+        pool.join()
 
 
 if __name__=="__main__":
     import sys
-    if len(sys.argv) != 6:
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        parser = argparse.ArgumentParser(
+            prog="static_analysis.py --batch",
+            description="Analyse many placements of a netlist on the same "
+                        "machine in parallel, writing combined results.")
+        parser.add_argument("netlist", metavar="NETLIST")
+        parser.add_argument("machine", metavar="MACHINE")
+        parser.add_argument("per_net_stats", metavar="PER_NET_STATS")
+        parser.add_argument("per_chip_stats", metavar="PER_CHIP_STATS")
+        parser.add_argument("placements", metavar="PLACEMENTS", nargs="*")
+        parser.add_argument("--placements-file", "-f",
+                            help="A file listing further placement files, "
+                                 "one per line.")
+        parser.add_argument("--link-stats", metavar="FILENAME",
+                            help="Also write per-link statistics.")
+        parser.add_argument("--link-summary", metavar="FILENAME",
+                            help="Also write a summary of the link loads.")
+        parser.add_argument("--processes", "-j", type=int,
+                            help="Number of worker processes (default: one "
+                                 "per CPU).")
+        args = parser.parse_args(sys.argv[2:])
+        
+        filenames = list(args.placements)
+        if args.placements_file is not None:
+            with open(args.placements_file, "r") as f:
+                filenames.extend(f.read().split())
+        if not filenames:
+            parser.error("expected at least one placement file")
+        
+        timer = start_timing()
+        outputs = [args.per_net_stats, args.per_chip_stats,
+                   args.link_stats, args.link_summary]
+        files = [open(f, "w") if f is not None else None for f in outputs]
+        try:
+            analyse_batch(args.netlist, args.machine, filenames, *files,
+                          processes=args.processes)
+        finally:
+            for f in files:
+                if f is not None:
+                    f.close()
+        timer.write_sidecars([f for f in outputs if f is not None])
+        sys.exit(0)
+    
+    if len(sys.argv) not in (6, 8):
         print("Expected five arguments: netlist placements machine per_net_stats per_chip_stats.")
+        print("And optionally: per_link_stats link_summary.")
         sys.exit(1)
     else:
+        timer = start_timing()
         netlist_name = splitext(basename(sys.argv[1]))[0]
-        with open(sys.argv[1], "r") as f:
-            netlist = json_to_netlist(json.load(f))
-        with open(sys.argv[2], "r") as f:
-            placements = json_to_placements(json.load(f))
+        netlist = load_netlist(sys.argv[1])
+        with phase("load_placements"):
+            placements = load_placements(sys.argv[2], netlist)
         machine_name = splitext(basename(sys.argv[3]))[0]
-        with open(sys.argv[3], "r") as f:
-            hostname, machine = json_to_machine(json.load(f))
-        
-        per_net_csv, per_chip_csv = \
-            measure_nets(netlist_name,
-                         netlist["vertices_resources"], netlist["nets"],
-                         placements["algorithm"],
-                         placements["placement_duration"],
-                         placements["placements"],
-                         machine_name, machine)
+        hostname, machine = load_machine(sys.argv[3])
         
-        with open(sys.argv[4], "w") as f:
-            f.write(per_net_csv)
-        with open(sys.argv[5], "w") as f:
-            f.write(per_chip_csv)
+        link_files = [open(f, "w") for f in sys.argv[6:8]] or [None, None]
+        try:
+            with open(sys.argv[4], "w") as per_net_file:
+                with open(sys.argv[5], "w") as per_chip_file:
+                    measure_nets(netlist_name,
+                                 netlist["vertices_resources"],
+                                 netlist["nets"],
+                                 placements["algorithm"],
+                                 placements["placement_duration"],
+                                 placements["placements"],
+                                 machine_name, machine,
+                                 per_net_file, per_chip_file,
+                                 *link_files,
+                                 route_key=routes_key(sys.argv[1],
+                                                      sys.argv[3],
+                                                      sys.argv[2]))
+        finally:
+            for f in link_files:
+                if f is not None:
+                    f.close()
+        timer.write_sidecars(sys.argv[4:])
 
 
 
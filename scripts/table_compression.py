@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""Compress the routing tables of a placement and report their headroom.
+
+Unlike static_analysis.py, which gives every net a single key with an
+all-ones mask and reports the raw size of each routing table, this script
+assigns key spaces as an application would: every net gets a block of keys
+(one per neuron of its source, selected by the low NEURON_BITS bits which the
+net's mask leaves unconstrained) and nets whose sources are on the same chip
+share a common key prefix. Each chip's routing table is then minimised using
+ordered covering followed by default route removal. The compressed size of each
+table is reported along with its headroom (remaining entries) and whether it
+still overflows the router's TABLE_SIZE entries.
+
+Tables are compressed in parallel by a pool of worker processes.
+"""
+
+import argparse
+
+import csv
+
+from collections import defaultdict
+
+from multiprocessing import Pool
+
+from os.path import splitext, basename
+
+from six import iteritems
+
+from rig.place_and_route.utils import build_routing_tables
+
+from rig.routing_table.ordered_covering import ordered_covering
+from rig.routing_table.remove_default_routes import \
+    minimise as remove_default_routes
+
+from netlist_to_json import load_netlist
+from netlist_core import load_placements
+from cache import load_machine
+from route_cache import cached_route_netlist, routes_key
+from static_analysis import STD_HEADER
+from profiling import phase, start_timing
+
+
+# The number of entries in a SpiNNaker router's routing table
+TABLE_SIZE = 1024
+
+# The number of low-order key bits identifying the neuron (within the source
+# vertex) sending a packet. These bits are left unmasked in every net's key.
+NEURON_BITS = 8
+
+
+def _num_bits(n):
+    """The number of bits needed to represent 0 to n - 1."""
+    return max(1, (n - 1).bit_length())
+
+
+def assign_keys(nets, placements, machine, neuron_bits=NEURON_BITS):
+    """Assign a key and mask to every net.
+
+    Keys are of the form ``(x, y, index, neuron)`` where (x, y) is the chip
+    of the net's source, index distinguishes nets with sources on the same
+    chip (nets with the same source vertex being numbered consecutively) and
+    neuron is the low neuron_bits bits, which are zero in the key and are not
+    covered by the mask. Nets from the same chip thus share a key prefix
+    which allows their routing entries to be merged.
+
+    Returns
+    -------
+    {net: (key, mask), ...}
+
+    Raises
+    ------
+    ValueError
+        If more than 32 bits are required.
+    """
+    chip_nets = defaultdict(list)
+    for net in nets:
+        chip_nets[placements[net.source]].append(net)
+
+    x_bits = _num_bits(machine.width)
+    y_bits = _num_bits(machine.height)
+    index_bits = _num_bits(max(len(n) for n in chip_nets.values())
+                           if chip_nets else 1)
+    num_bits = x_bits + y_bits + index_bits + neuron_bits
+    if num_bits > 32:
+        raise ValueError(
+            "Keys require {} bits (more than 32).".format(num_bits))
+    mask = (0xFFFFFFFF << neuron_bits) & 0xFFFFFFFF
+
+    vertex_order = {}
+    net_keys = {}
+    for (x, y), chip_net_list in iteritems(chip_nets):
+        chip_net_list.sort(
+            key=lambda n: vertex_order.setdefault(n.source,
+                                                  len(vertex_order)))
+        prefix = (((x << y_bits) | y) << index_bits)
+        for index, net in enumerate(chip_net_list):
+            net_keys[net] = ((prefix | index) << neuron_bits, mask)
+    return net_keys
+
+
+def _compress_table(task):
+    """Compress a single routing table.
+
+    Parameters
+    ----------
+    task : ((x, y), [RoutingTableEntry, ...], target_length)
+        The table must include entries which could be default routed.
+
+    Returns
+    -------
+    ((x, y), uncompressed_entries, compressed_entries)
+        uncompressed_entries excludes default-routed entries.
+    """
+    chip, table, target_length = task
+    uncompressed = remove_default_routes(table, None)
+    compressed, _ = ordered_covering(table, target_length, no_raise=True)
+    compressed = remove_default_routes(compressed, None)
+    return (chip, len(uncompressed), len(compressed))
+
+
+def compress_tables(routes, net_keys, target_length=None, processes=None):
+    """Compress the routing tables for a set of routes.
+
+    Parameters
+    ----------
+    target_length : int or None
+        Stop compressing a table once it has this many entries. If None,
+        tables are compressed as far as possible.
+    processes : int or None
+        The number of worker processes to use (default: one per CPU). If 1,
+        tables are compressed in this process.
+
+    Returns
+    -------
+    {(x, y): (uncompressed_entries, compressed_entries), ...}
+    """
+    routing_tables = build_routing_tables(routes, net_keys,
+                                          omit_default_routes=False)
+
+    # Largest tables first so that a straggler is not left until last
+    tasks = sorted(((chip, table, target_length)
+                    for chip, table in iteritems(routing_tables)),
+                   key=lambda task: len(task[1]), reverse=True)
+
+    if processes == 1:
+        results = map(_compress_table, tasks)
+        return {chip: (u, c) for chip, u, c in results}
+
+    pool = Pool(processes)
+    try:
+        return {chip: (u, c)
+                for chip, u, c in pool.imap_unordered(_compress_table, tasks)}
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_table_stats(std_cols, table_sizes, machine, table_stats_file):
+    """Write per-chip compressed routing table sizes as CSV."""
+    table_stats_csv = csv.writer(table_stats_file, lineterminator="\n")
+    table_stats_csv.writerow(STD_HEADER + ["x", "y", "routing_table_entries",
+                                           "compressed_entries", "headroom",
+                                           "overflow"])
+    for x, y in machine:
+        uncompressed, compressed = table_sizes.get((x, y), (0, 0))
+        table_stats_csv.writerow(std_cols + [x, y, uncompressed, compressed,
+                                             TABLE_SIZE - compressed,
+                                             compressed > TABLE_SIZE])
+
+
+def measure_tables(netlist_name, vertices_resources, nets,
+                   placement_algorithm, placement_duration, placements,
+                   machine_name, machine, table_stats_file,
+                   target_length=None, processes=None, route_key=None,
+                   neuron_bits=NEURON_BITS):
+    """Route a placed netlist, compress its routing tables and write per-chip
+    table sizes as CSV into the supplied file object.
+
+    Returns
+    -------
+    {(x, y): (uncompressed_entries, compressed_entries), ...}
+    """
+    allocations, routes, routing_tables = cached_route_netlist(
+        route_key, vertices_resources, nets, machine, placements)
+
+    net_keys = assign_keys(nets, placements, machine, neuron_bits)
+    with phase("compress_tables"):
+        table_sizes = compress_tables(routes, net_keys, target_length,
+                                      processes)
+
+    std_cols = [netlist_name,
+                machine_name,
+                placement_algorithm,
+                placement_duration]
+    write_table_stats(std_cols, table_sizes, machine, table_stats_file)
+
+    return table_sizes
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(
+        description="Compress the routing tables of a placement and report "
+                    "their size and headroom.")
+    parser.add_argument("netlist", metavar="NETLIST")
+    parser.add_argument("placements", metavar="PLACEMENTS")
+    parser.add_argument("machine", metavar="MACHINE")
+    parser.add_argument("table_stats", metavar="TABLE_STATS")
+    parser.add_argument("--target-length", type=int,
+                        help="Stop compressing tables once they have this "
+                             "many entries (default: compress as far as "
+                             "possible).")
+    parser.add_argument("--processes", "-j", type=int,
+                        help="Number of worker processes to use (default: "
+                             "one per CPU).")
+    parser.add_argument("--neuron-bits", type=int, default=NEURON_BITS,
+                        help="Number of low key bits identifying the "
+                             "neuron sending a packet (default: "
+                             "%(default)s).")
+    args = parser.parse_args()
+
+    timer = start_timing()
+    netlist_name = splitext(basename(args.netlist))[0]
+    netlist = load_netlist(args.netlist)
+    with phase("load_placements"):
+        placements = load_placements(args.placements, netlist)
+    machine_name = splitext(basename(args.machine))[0]
+    hostname, machine = load_machine(args.machine)
+
+    with open(args.table_stats, "w") as f:
+        table_sizes = measure_tables(
+            netlist_name,
+            netlist["vertices_resources"], netlist["nets"],
+            placements["algorithm"],
+            placements["placement_duration"],
+            placements["placements"],
+            machine_name, machine, f,
+            args.target_length, args.processes,
+            route_key=routes_key(args.netlist, args.machine,
+                                 args.placements),
+            neuron_bits=args.neuron_bits)
+    timer.write_sidecars([args.table_stats])
+
+    print("{} of {} chips overflow after compression ({} before).".format(
+        sum(c > TABLE_SIZE for u, c in table_sizes.values()),
+        len(table_sizes),
+        sum(u > TABLE_SIZE for u, c in table_sizes.values())))